@@ -0,0 +1,351 @@
+# run.py
+"""
+Benchmark suite: every pipeline stage in isolation, then end to end.
+
+    python -m bench.run                      # stub models, compare with bench/baseline.json
+    python -m bench.run --real               # the real LLM / BGE from the registry
+    python -m bench.run --update-baseline    # store this run as the new baseline
+
+Results are written as JSON (--out). Exit status is 1 when a benchmark
+regressed past --threshold against the baseline, 2 when the baseline was
+recorded with different models, parameters or CPU count (not compared).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+# -------------------------
+# Isolation: no persistent caches, no state left in the working tree.
+# Must happen before any project module reads its config.
+# -------------------------
+_TMP = tempfile.mkdtemp(prefix="curasense-bench-")
+for _key, _value in {
+    "EXTRACT_CACHE": "0",
+    "ANSWER_CACHE": "0",
+    "SUMMARY_CACHE": "0",
+    "LLM_PREFIX_CACHE": "0",
+    "KB_MANIFEST_PATH": os.path.join(_TMP, "kb_manifest.json"),
+    "KB_VERSION_FILE": os.path.join(_TMP, "kb_version.txt"),
+    "NAME_INDEX_PATH": os.path.join(_TMP, "name_index.json"),
+    "VECTOR_INDEX_DIR": os.path.join(_TMP, "vector_index"),
+}.items():
+    os.environ.setdefault(_key, _value)
+
+from bench import synthetic  # noqa: E402
+from bench.stubs import StubLLM, install_stubs  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+RESULTS_FORMAT = 1
+# relative slowdown that counts as a regression
+DEFAULT_THRESHOLD = float(os.getenv("BENCH_THRESHOLD", 0.25))
+# latencies this small are timer noise; never flagged
+NOISE_FLOOR_MS = 0.5
+
+QUESTION = "Explain abnormalities in this report."
+
+
+# -------------------------
+# Timing
+# -------------------------
+def measure(fn: Callable[[int], object], repeat: int, warmup: int = 1, items: int = 1) -> Dict:
+    """
+    Call fn(i) `repeat` times after `warmup` untimed calls. `items` is how
+    many units one call processes (texts, queries, pages), for throughput.
+    """
+    for i in range(warmup):
+        fn(i)
+    times = []
+    for i in range(warmup, warmup + repeat):
+        start = time.perf_counter()
+        fn(i)
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    total_s = sum(times) / 1000
+    return {
+        "n": repeat,
+        "items": items,
+        "mean_ms": round(statistics.fmean(times), 3),
+        "p50_ms": round(_percentile(times, 50), 3),
+        "p95_ms": round(_percentile(times, 95), 3),
+        "items_per_s": round(repeat * items / total_s, 1) if total_s else 0.0,
+    }
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+# -------------------------
+# Setup
+# -------------------------
+def setup_models(real: bool, llm_ms: float, gen_ms: float):
+    from qdrant_client import QdrantClient
+
+    from utils.model_registry import registry
+
+    if real:
+        # real LLM + embedder; the KB is still the synthetic in-memory one
+        registry.override("qdrant", QdrantClient(":memory:"))
+        registry.get("llm")
+        registry.get("bge")
+        return "real"
+    install_stubs(registry, StubLLM(prompt_ms_per_token=llm_ms, gen_ms_per_token=gen_ms))
+    return "stub"
+
+
+def load_synthetic_kb(size: int):
+    from src.name_index import write_name_index
+    from utils.embedding import add_kb_chunks, ensure_collection, scroll_points
+
+    ensure_collection()
+    texts, metas = synthetic.kb_entries(size)
+    start = time.perf_counter()
+    add_kb_chunks(texts, metas)
+    load_s = time.perf_counter() - start
+
+    names: Dict[str, Dict[str, str]] = {}
+    for p in scroll_points(["category", "name"]):
+        names.setdefault(p.payload.get("category", ""), {})[str(p.id)] = p.payload.get("name", "")
+    write_name_index(names)
+    return texts, load_s
+
+
+def tesseract_available() -> bool:
+    import pytesseract
+
+    return shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+
+
+# -------------------------
+# Benchmarks
+# -------------------------
+def run_benchmarks(args, kb_texts: List[str]) -> Dict[str, Dict]:
+    from src.generator import call_llm, rag_answer, rag_answer_batch, rag_answer_with_pdf, summarize_multiple_pdfs
+    from src.prompt_packer import packer
+    from src.retriever import retrieve, retrieve_for_document, search_vectors
+    from utils.embedding import embed_texts
+    from utils.pdf_reader import extract_pdf_text, shutdown_ocr_pool
+
+    results: Dict[str, Dict] = {}
+    repeat = args.repeat
+
+    def bench(name: str, fn, n: int = repeat, items: int = 1):
+        print(f"[ bench ] {name} ...", flush=True)
+        results[name] = measure(fn, n, items=items)
+
+    def skip(name: str, reason: str):
+        print(f"[ bench ] {name} skipped: {reason}", flush=True)
+        results[name] = {"skipped": reason}
+
+    # ---- extraction ----
+    for pages in args.pages:
+        pdf = synthetic.make_pdf(pages, seed=pages)
+        bench(f"extract_digital_{pages}p", lambda i: extract_pdf_text(pdf), items=pages)
+
+    scanned_pages = [p for p in args.pages if p <= args.max_scanned_pages]
+    if not tesseract_available():
+        for pages in scanned_pages:
+            skip(f"extract_scanned_{pages}p", "tesseract not installed")
+    else:
+        for pages in scanned_pages:
+            pdf = synthetic.make_pdf(pages, scanned=True, seed=pages)
+            bench(f"extract_scanned_{pages}p", lambda i: extract_pdf_text(pdf), n=max(repeat // 10, 2), items=pages)
+        shutdown_ocr_pool()
+
+    # ---- embedding ----
+    n_embed = max(repeat // 5, 3)
+    for size in args.embed_batches:
+        # one batch per call, warmup included
+        batches = [kb_texts[(i * size) % len(kb_texts):][:size] for i in range(n_embed + 1)]
+        bench(f"embed_texts_{size}", lambda i: embed_texts(batches[i]), n=n_embed, items=size)
+
+    # ---- retrieval (a fresh query every call: the embedding LRU must miss) ----
+    queries = synthetic.queries(4 * (repeat + 1))
+    bench("retrieve", lambda i: retrieve(queries[i]))
+    bench("retrieve_category", lambda i: retrieve(queries[repeat + 1 + i], category="lab_test"))
+
+    vecs = embed_texts(queries[: repeat + 1])
+    bench("search_vectors", lambda i: search_vectors([vecs[i]]))
+    bench("search_vectors_category", lambda i: search_vectors([vecs[i]], category="medicine"))
+
+    report_text = extract_pdf_text(synthetic.make_pdf(2, seed=7))
+    bench("retrieve_for_document", lambda i: retrieve_for_document(report_text, category="lab_test"))
+
+    # ---- prompt building ----
+    docs = retrieve_for_document(report_text, category="lab_test")
+    bench("prompt_pack_report", lambda i: packer.report(QUESTION, report_text, docs))
+    prompt, _ = packer.report(QUESTION, report_text, docs)
+
+    # ---- LLM ----
+    bench("call_llm", lambda i: call_llm(prompt), n=max(repeat // 5, 3))
+
+    # ---- end to end ----
+    # 32 questions one by one vs. one batch (fresh questions each time: no cache hits)
+    n_batch = max(repeat // 10, 2)
+    batch_questions = synthetic.queries(32 * (2 * n_batch + 2), seed=3)
+    bench("general_x32", lambda i: [rag_answer(q) for q in batch_questions[i * 32:(i + 1) * 32]],
+          n=n_batch, items=32)
+    offset = 32 * (n_batch + 1)
+    bench("batch_x32", lambda i: rag_answer_batch(batch_questions[offset + i * 32:offset + (i + 1) * 32]),
+          n=n_batch, items=32)
+
+    report_pdf = synthetic.make_pdf(2, seed=11)
+    bench("e2e_report", lambda i: rag_answer_with_pdf(QUESTION, report_pdf), n=max(repeat // 5, 3))
+
+    summary_pdfs = [synthetic.make_pdf(3, seed=21), synthetic.make_pdf(3, seed=22)]
+    bench(
+        "e2e_summary_2pdf",
+        lambda i: summarize_multiple_pdfs(summary_pdfs, names=["a.pdf", "b.pdf"]),
+        n=max(repeat // 10, 2),
+    )
+    return results
+
+
+# -------------------------
+# Baseline comparison
+# -------------------------
+# run settings that change what the timings mean; a baseline differing in any is not comparable
+COMPARABLE_META = (
+    "models", "kb_size", "repeat", "pages", "max_scanned_pages", "embed_batches",
+    "stub_prompt_ms", "stub_gen_ms", "machine", "cpus",
+)
+
+
+def meta_mismatches(current: Dict, baseline: Dict) -> List[str]:
+    """Settings of `current` that differ from the baseline's (empty when comparable)."""
+    before = baseline.get("meta", {})
+    return [
+        f"{key}: baseline {before.get(key)!r}, this run {current['meta'].get(key)!r}"
+        for key in COMPARABLE_META
+        if before.get(key) != current["meta"].get(key)
+    ]
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Human-readable regressions of `current` against a comparable `baseline` (empty when none)."""
+    regressions = []
+    for name, now in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before or "skipped" in now or "skipped" in before:
+            continue
+        if now["p50_ms"] > before["p50_ms"] * (1 + threshold) and now["p50_ms"] - before["p50_ms"] > NOISE_FLOOR_MS:
+            regressions.append(
+                f"{name}: p50 {before['p50_ms']:.3f} -> {now['p50_ms']:.3f} ms "
+                f"(+{(now['p50_ms'] / before['p50_ms'] - 1) * 100:.0f}%)"
+            )
+    return regressions
+
+
+def format_results(results: Dict[str, Dict], baseline: Optional[Dict]) -> str:
+    base = (baseline or {}).get("results", {})
+    lines = [f"{'benchmark':<28} {'p50 ms':>10} {'p95 ms':>10} {'items/s':>10} {'vs base':>8}"]
+    for name, r in results.items():
+        if "skipped" in r:
+            lines.append(f"{name:<28} {'skipped: ' + r['skipped']}")
+            continue
+        delta = ""
+        if name in base and "p50_ms" in base[name] and base[name]["p50_ms"]:
+            delta = f"{(r['p50_ms'] / base[name]['p50_ms'] - 1) * 100:+.0f}%"
+        lines.append(f"{name:<28} {r['p50_ms']:>10.3f} {r['p95_ms']:>10.3f} {r['items_per_s']:>10.1f} {delta:>8}")
+    return "\n".join(lines)
+
+
+def _load_json(path: str) -> Optional[Dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_json(path: str, data: Dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench.run", description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--real", action="store_true", help="use the real models instead of stubs")
+    parser.add_argument("--repeat", type=int, default=50, help="timed calls per benchmark (fewer for slow stages)")
+    parser.add_argument("--kb-size", type=int, default=2000, help="synthetic KB entries")
+    parser.add_argument("--pages", type=lambda s: [int(p) for p in s.split(",")], default=[1, 5, 20])
+    parser.add_argument("--max-scanned-pages", type=int, default=5, help="largest page count OCR'd")
+    parser.add_argument("--embed-batches", type=lambda s: [int(p) for p in s.split(",")], default=[1, 32, 256])
+    parser.add_argument("--stub-prompt-ms", type=float, default=0.0, help="simulated stub LLM cost per prompt token")
+    parser.add_argument("--stub-gen-ms", type=float, default=0.0, help="simulated stub LLM cost per generated token")
+    parser.add_argument("--out", default="", help="write results JSON here")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    models = setup_models(args.real, args.stub_prompt_ms, args.stub_gen_ms)
+    kb_texts, load_s = load_synthetic_kb(args.kb_size)
+
+    current = {
+        "format": RESULTS_FORMAT,
+        "meta": {
+            "models": models,
+            "kb_size": args.kb_size,
+            "kb_load_s": round(load_s, 2),
+            "repeat": args.repeat,
+            "pages": args.pages,
+            "max_scanned_pages": args.max_scanned_pages,
+            "embed_batches": args.embed_batches,
+            "stub_prompt_ms": args.stub_prompt_ms,
+            "stub_gen_ms": args.stub_gen_ms,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": run_benchmarks(args, kb_texts),
+    }
+    shutil.rmtree(_TMP, ignore_errors=True)
+
+    baseline = None if args.update_baseline else _load_json(args.baseline)
+    mismatches = meta_mismatches(current, baseline) if baseline is not None else []
+    print()
+    print(format_results(current["results"], None if mismatches else baseline))
+
+    if args.out:
+        _write_json(args.out, current)
+        print(f"\n[ bench ] Results written to {args.out}")
+    if args.update_baseline:
+        _write_json(args.baseline, current)
+        print(f"[ bench ] Baseline updated: {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"\n[ bench ] No baseline at {args.baseline}; record one with --update-baseline")
+        return 0
+    if mismatches:
+        print(f"\n[ bench ] Not comparing with {args.baseline}, it was recorded with other settings:")
+        for m in mismatches:
+            print(f"  - {m}")
+        return 2
+
+    regressions = compare(current, baseline, args.threshold)
+    if regressions:
+        print(f"\n[ bench ] {len(regressions)} regression(s) over {args.threshold:.0%}:")
+        for r in regressions:
+            print(f"  - {r}")
+        return 1
+    print(f"\n[ bench ] No regressions over {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
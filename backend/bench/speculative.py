@@ -0,0 +1,163 @@
+# speculative.py
+"""
+Prompt-lookup decoding vs. plain decoding on the lab report and
+prescription prompts, with the real LLM (LLM_MODEL_PATH) at temperature 0.
+
+    python -m bench.speculative                       # 3 runs per prompt and mode
+    python -m bench.speculative --repeat 5 --out spec.json
+
+Modes:
+    plain            context without per-position logits (SPECULATIVE_ENDPOINTS empty)
+    plain_all_logits the speculative-capable context, drafting off
+    speculative      the same context with the prompt-lookup draft model
+
+Reports prompt evaluation time, generation tokens/s, drafted / accepted
+draft tokens and whether the speculative output matches the plain one.
+Draft size and n-gram length come from LLM_DRAFT_TOKENS / LLM_DRAFT_NGRAM.
+"""
+import argparse
+import shutil
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+from bench import run as bench_run  # sets up the isolated environment first
+from bench import synthetic
+from bench.stubs import StubEmbedder
+
+
+def build_prompts(kb_size: int) -> Dict[str, str]:
+    """Report / prescription prompts exactly as the endpoints pack them (stub embedder for retrieval)."""
+    from qdrant_client import QdrantClient
+
+    from src.prompt_packer import packer
+    from src.retriever import retrieve_for_document
+    from utils.model_registry import registry
+    from utils.pdf_reader import extract_pdf_text
+
+    registry.override("qdrant", QdrantClient(":memory:"))
+    registry.override("bge", StubEmbedder())
+    bench_run.load_synthetic_kb(kb_size)
+
+    report_text = extract_pdf_text(synthetic.make_pdf(2, seed=11))
+    rx_text = extract_pdf_text(synthetic.make_pdf(1, seed=12, kind="prescription"))
+    lab_prompt, _ = packer.report(
+        bench_run.QUESTION, report_text, retrieve_for_document(report_text, category="lab_test")
+    )
+    rx_prompt, _ = packer.prescription(
+        "Explain this prescription.", rx_text, retrieve_for_document(rx_text, category="medicine")
+    )
+    return {"lab": lab_prompt, "prescription": rx_prompt}
+
+
+def generate(llm, prompt: str, speculative: bool) -> Dict:
+    """One cold completion (no KV reuse), timed like src/generator._timed_chunks."""
+    from src.prompt_packer import LLM_MAX_TOKENS
+    from src.speculative import speculative_decoding
+
+    llm.reset()
+    pieces: List[str] = []
+    with speculative_decoding(llm, speculative) as drafts:
+        start = time.perf_counter()
+        first_at = None
+        for chunk in llm(prompt, max_tokens=LLM_MAX_TOKENS, temperature=0.0, stop=["###"], stream=True):
+            if first_at is None:
+                first_at = time.perf_counter()
+            pieces.append(chunk["choices"][0]["text"])
+        end = time.perf_counter()
+    if speculative and drafts is None:
+        raise RuntimeError("the context was loaded without logits_all; it cannot verify drafts")
+
+    n = len(pieces)
+    first_at = first_at or end
+    return {
+        "text": "".join(pieces),
+        "tokens": n,
+        "prompt_eval_ms": (first_at - start) * 1000,
+        "tokens_per_s": (n - 1) / (end - first_at) if n > 1 and end > first_at else 0.0,
+        "drafted": drafts.drafted if drafts else 0,
+        "accepted": drafts.accepted(n) if drafts else 0,
+    }
+
+
+def summarize(runs: List[Dict], reference: str) -> Dict:
+    drafted = sum(r["drafted"] for r in runs)
+    accepted = sum(r["accepted"] for r in runs)
+    return {
+        "n": len(runs),
+        "tokens": runs[0]["tokens"],
+        "prompt_eval_ms": round(statistics.median(r["prompt_eval_ms"] for r in runs), 1),
+        "tokens_per_s": round(statistics.median(r["tokens_per_s"] for r in runs), 2),
+        "drafted": drafted,
+        "accepted": accepted,
+        "accept_rate": round(accepted / drafted, 3) if drafted else None,
+        "identical": all(r["text"] == reference for r in runs),
+    }
+
+
+def run(prompts: Dict[str, str], repeat: int) -> Dict[str, Dict[str, Dict]]:
+    from utils.model_registry import load_llama
+
+    plain_llm = load_llama(speculative=False)
+    spec_llm = load_llama(speculative=True)
+    modes = (("plain", plain_llm, False), ("plain_all_logits", spec_llm, False), ("speculative", spec_llm, True))
+
+    results: Dict[str, Dict[str, Dict]] = {}
+    for kind, prompt in prompts.items():
+        print(f"[ bench ] {kind}: prompt of {len(plain_llm.tokenize(prompt.encode('utf-8')))} tokens", flush=True)
+        reference = generate(plain_llm, prompt, False)["text"]  # also the warmup
+        results[kind] = {}
+        for mode, llm, speculative in modes:
+            print(f"[ bench ] {kind} / {mode} ...", flush=True)
+            runs = [generate(llm, prompt, speculative) for _ in range(repeat)]
+            results[kind][mode] = summarize(runs, reference)
+        plain_rate = results[kind]["plain"]["tokens_per_s"]
+        if plain_rate:
+            results[kind]["speculative"]["speedup"] = round(results[kind]["speculative"]["tokens_per_s"] / plain_rate, 2)
+    return results
+
+
+def format_results(results: Dict[str, Dict[str, Dict]]) -> str:
+    header = f"{'prompt':<14}{'mode':<18}{'tokens':>7}{'prompt ms':>11}{'tok/s':>10}{'drafted':>9}{'accept':>8}{'same':>6}"
+    lines = [header, "-" * len(header)]
+    for kind, modes in results.items():
+        for mode, r in modes.items():
+            rate = f"{r['accept_rate']:.0%}" if r["accept_rate"] is not None else "-"
+            lines.append(
+                f"{kind:<14}{mode:<18}{r['tokens']:>7}{r['prompt_eval_ms']:>11.1f}{r['tokens_per_s']:>10.2f}"
+                f"{r['drafted']:>9}{rate:>8}{'yes' if r['identical'] else 'NO':>6}"
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench.speculative", description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--repeat", type=int, default=3, help="completions per prompt and mode")
+    parser.add_argument("--kb-size", type=int, default=500, help="synthetic KB entries")
+    parser.add_argument("--out", default="", help="write results JSON here")
+    args = parser.parse_args(argv)
+
+    from src.speculative import LLM_DRAFT_NGRAM, LLM_DRAFT_TOKENS
+
+    prompts = build_prompts(args.kb_size)
+    current = {
+        "meta": {
+            "draft_tokens": LLM_DRAFT_TOKENS,
+            "draft_ngram": LLM_DRAFT_NGRAM,
+            "repeat": args.repeat,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": run(prompts, args.repeat),
+    }
+    shutil.rmtree(bench_run._TMP, ignore_errors=True)
+    print()
+    print(format_results(current["results"]))
+    if args.out:
+        bench_run._write_json(args.out, current)
+        print(f"\n[ bench ] Results written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+# stubs.py
+import re
+import time
+import zlib
+from typing import Dict, List
+
+import numpy as np
+
+EMBEDDING_DIM = 384
+_TOKEN = re.compile(rb"\S+\s*|\s+")
+
+
+class StubEmbedder:
+    """
+    Stands in for the "bge" model: a hashed bag-of-words, so similar texts
+    still land near each other and retrieval results are meaningful.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+
+    def encode(self, texts, return_dense: bool = True, **kwargs) -> Dict[str, np.ndarray]:
+        if isinstance(texts, str):
+            texts = [texts]
+        vecs = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split()[:512]:
+                vecs[i, zlib.crc32(word.encode("utf-8")) % self.dim] += 1.0
+        vecs[:, 0] += 1e-3  # no all-zero rows
+        return {"dense_vecs": vecs}
+
+
+class StubLLM:
+    """
+    Stands in for llama_cpp.Llama: word-level tokenizer, canned answer,
+    optional simulated cost per prompt and per generated token.
+    """
+
+    def __init__(self, prompt_ms_per_token: float = 0.0, gen_ms_per_token: float = 0.0, answer_tokens: int = 64):
+        self.prompt_ms_per_token = prompt_ms_per_token
+        self.gen_ms_per_token = gen_ms_per_token
+        self.answer_tokens = answer_tokens
+        self.input_ids = np.zeros(0, dtype=np.intc)
+        self._vocab: Dict[bytes, int] = {}
+        self._pieces: List[bytes] = []
+
+    @property
+    def n_tokens(self) -> int:
+        return len(self.input_ids)
+
+    # ---- tokenizer: one id per word (+ trailing whitespace), vocabulary grows as needed ----
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        ids = []
+        for piece in _TOKEN.findall(text):
+            tid = self._vocab.get(piece)
+            if tid is None:
+                tid = self._vocab.setdefault(piece, len(self._pieces))
+                if tid == len(self._pieces):
+                    self._pieces.append(piece)
+            ids.append(tid)
+        return ids
+
+    def detokenize(self, tokens) -> bytes:
+        return b"".join(self._pieces[t] for t in tokens)
+
+    # ---- KV state (enough for src/prefix_cache.py) ----
+    def reset(self):
+        self.input_ids = np.zeros(0, dtype=np.intc)
+
+    def eval(self, tokens):
+        self.input_ids = np.concatenate([self.input_ids, np.asarray(tokens, dtype=np.intc)])
+
+    def save_state(self):
+        return self.input_ids.copy()
+
+    def load_state(self, state):
+        self.input_ids = state.copy()
+
+    # ---- generation ----
+    def _answer(self, max_tokens: int) -> List[str]:
+        n = min(self.answer_tokens, max_tokens or self.answer_tokens)
+        return [f"word{i} " for i in range(n)]
+
+    def __call__(self, prompt: str, max_tokens: int = 256, stream: bool = False, **kwargs):
+        if self.prompt_ms_per_token:
+            time.sleep(len(self.tokenize(prompt.encode("utf-8"))) * self.prompt_ms_per_token / 1000)
+        pieces = self._answer(max_tokens)
+        if stream:
+            return self._stream(pieces)
+        if self.gen_ms_per_token:
+            time.sleep(len(pieces) * self.gen_ms_per_token / 1000)
+        return {"choices": [{"text": "".join(pieces)}], "usage": {"completion_tokens": len(pieces)}}
+
+    def _stream(self, pieces):
+        for piece in pieces:
+            if self.gen_ms_per_token:
+                time.sleep(self.gen_ms_per_token / 1000)
+            yield {"choices": [{"text": piece}]}
+
+
+def install_stubs(registry, llm: StubLLM = None):
+    """Register stub models + an in-memory Qdrant in place of the real ones."""
+    from qdrant_client import QdrantClient
+
+    registry.override("llm", llm or StubLLM())
+    registry.override("bge", StubEmbedder())
+    registry.override("qdrant", QdrantClient(":memory:"))
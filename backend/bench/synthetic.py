@@ -0,0 +1,89 @@
+# synthetic.py
+import random
+from typing import Dict, List, Tuple
+
+import fitz  # PyMuPDF
+
+# -------------------------
+# Vocabulary for generated documents and KB entries
+# -------------------------
+PARAMETERS = [
+    "Hemoglobin", "Platelet Count", "Total Leucocyte Count", "Fasting Blood Sugar", "HbA1c",
+    "Serum Creatinine", "Blood Urea", "Uric Acid", "Total Cholesterol", "Triglycerides",
+    "HDL Cholesterol", "LDL Cholesterol", "SGPT", "SGOT", "Alkaline Phosphatase",
+    "Total Bilirubin", "TSH", "Free T4", "Vitamin D", "Vitamin B12", "Sodium", "Potassium",
+]
+MEDICINES = [
+    "Dolo 650 Tablet", "Augmentin 625 Duo Tablet", "Pan 40 Tablet", "Azithral 500 Tablet",
+    "Montair LC Tablet", "Telma 40 Tablet", "Glycomet 500 Tablet", "Shelcal 500 Tablet",
+    "Ecosprin 75 Tablet", "Atorva 10 Tablet", "Cetzine 10 Tablet", "Allegra 120 Tablet",
+]
+FILLER = (
+    "patient reports mild fatigue and occasional headache advised rest hydration and follow up "
+    "review after two weeks results interpreted in clinical context"
+).split()
+
+
+def lab_report_lines(rng: random.Random, n: int) -> List[str]:
+    lines = ["CITY DIAGNOSTICS - LABORATORY REPORT", "Patient: Test Patient   Age: 42   Sex: M", ""]
+    for i in range(n):
+        p = PARAMETERS[i % len(PARAMETERS)]
+        lines.append(f"{p:<28} {rng.uniform(0.5, 250):8.1f}   ref {rng.randint(1, 50)}-{rng.randint(60, 300)}")
+    return lines
+
+
+def prescription_lines(rng: random.Random, n: int) -> List[str]:
+    lines = ["Dr. A. Sharma, MBBS MD", "Rx", ""]
+    for i in range(n):
+        m = MEDICINES[rng.randrange(len(MEDICINES))]
+        lines.append(f"{i + 1}. Tab {m.replace(' Tablet', '')}  1-0-1  x {rng.randint(3, 10)} days")
+    lines.append(" ".join(rng.choice(FILLER) for _ in range(20)))
+    return lines
+
+
+def make_pdf(pages: int, scanned: bool = False, seed: int = 0, dpi: int = 150, kind: str = "lab") -> bytes:
+    """
+    A lab-report-like (or, with kind="prescription", prescription-like) PDF.
+    Digital pages carry a text layer; scanned pages are the same text
+    rendered to an image, so extraction has to OCR them.
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=595, height=842)
+        lines = prescription_lines(rng, 12) if kind == "prescription" else lab_report_lines(rng, 40)
+        page.insert_text((40, 60), "\n".join(lines), fontsize=10, fontname="cour")
+        if scanned:
+            pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+            png = pix.tobytes("png")
+            doc.delete_page(-1)
+            page = doc.new_page(width=595, height=842)
+            page.insert_image(page.rect, stream=png)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def kb_entries(size: int, seed: int = 0) -> Tuple[List[str], List[Dict]]:
+    """`size` KB documents spread over the real categories."""
+    rng = random.Random(seed)
+    categories = ["medicine", "lab_test", "remedy", "disease"]
+    texts, metas = [], []
+    for i in range(size):
+        cat = categories[i % len(categories)]
+        if cat == "lab_test":
+            name = f"{PARAMETERS[i % len(PARAMETERS)]} {i}"
+        elif cat == "medicine":
+            name = f"{MEDICINES[i % len(MEDICINES)]} {i}"
+        else:
+            name = f"{cat} entry {i}"
+        body = " ".join(rng.choice(FILLER) for _ in range(rng.randint(20, 120)))
+        texts.append(f"Name: {name}\n{body}")
+        metas.append({"category": cat, "name": name})
+    return texts, metas
+
+
+def queries(n: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    pool = PARAMETERS + MEDICINES
+    return [f"what does {rng.choice(pool).lower()} {rng.choice(FILLER)} mean {i}" for i in range(n)]
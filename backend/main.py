@@ -1,48 +1,206 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Request, HTTPException
 from fastapi.params import Form
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from typing import List, Optional, Union
 from src.generator import (
-    rag_answer,
-    rag_answer_with_pdf,
-    rag_answer_with_prescription_pdf,
-    summarize_multiple_pdfs
+    rag_answer_async,
+    rag_answer_with_pdf_async,
+    rag_answer_with_prescription_pdf_async,
+    summarize_multiple_pdfs_async,
+    rag_answer_batch_async,
+    BATCH_MAX_ITEMS,
+    warm_prefix_cache,
+    stream_rag_answer,
+    stream_rag_answer_with_pdf,
+    stream_rag_answer_with_prescription_pdf,
+    stream_summarize_multiple_pdfs
 )
+from src import executor
+from src.answer_cache import answer_cache
+from src.prompt_packer import packer
+from src.retriever import RETRIEVAL_BACKEND, TOP_K, embed_service
+from src.summary_cache import open_summary_cache
+from utils.model_registry import registry
+from utils.pdf_reader import shutdown_ocr_pool
+from utils.uploads import RequestSizeLimit, UploadTooLargeError, read_upload
+from utils.extract_cache import open_extract_cache
+from src.executor import QueueFullError, batch_queue, llm_queue
 from utils.logger import log
+from utils.metrics import current_spans, record_request, render_metrics, span_summary, start_request
+import json
 import os
+import threading
+import time
+import weakref
 
 app = FastAPI()
+# added before request_context, so it runs inside it: early 413s are still logged and counted
+app.add_middleware(RequestSizeLimit)
+
+# scraped / polled often; timed but not logged
+QUIET_PATHS = {"/ping", "/metrics", "/stats"}
+
+
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """Request id (X-Request-ID, or a new one) for every log line and span, plus latency."""
+    request_id, spans = start_request(request.headers.get("x-request-id"))
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start
+        # unmatched paths share one label so scanners can't blow up the series count
+        path = request.url.path if status != 404 else "unmatched"
+        record_request(path, status, elapsed)
+        if path not in QUIET_PATHS:
+            log(f"[ request ] {request.method} {path} {status}", ms=round(elapsed * 1000, 1), stages=span_summary(spans))
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    log(f"🔴 [QUEUE] Rejected {request.url.path}: {exc}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(executor.RETRY_AFTER_SECONDS)},
+    )
+
+
+@app.exception_handler(UploadTooLargeError)
+async def upload_too_large_handler(request: Request, exc: UploadTooLargeError):
+    log(f"🔴 [UPLOAD] Rejected {request.url.path}: {exc}")
+    return JSONResponse(status_code=413, content={"detail": str(exc)})
+
+
+# Models load lazily on first use. List them here (comma separated) to
+# load them at startup instead, or call POST /warmup before marking ready.
+WARMUP_ON_STARTUP = [m for m in os.getenv("WARMUP_ON_STARTUP", "").split(",") if m.strip()]
+# what /warmup loads by default: Qdrant only when searches go through it (an
+# embedded Qdrant takes a per-process lock, the numpy backend never opens it)
+DEFAULT_WARMUP = ["llm", "bge"] + (["qdrant"] if RETRIEVAL_BACKEND == "qdrant" else [])
+
+
+async def _warmup(names) -> dict:
+    """Load each model; returns {name: error} for the ones that failed."""
+    errors = {}
+    for name in names:
+        try:
+            if name == "llm":
+                await executor.run_llm(registry.get, "llm")
+                await executor.run_llm(warm_prefix_cache)
+            else:
+                await executor.run_retrieve(registry.get, name)
+        except Exception as e:
+            log(f"🔴 [WARMUP] Loading '{name}' failed: {type(e).__name__}: {e}")
+            errors[name] = f"{type(e).__name__}: {e}"
+    return errors
+
+
+@app.on_event("startup")
+async def warmup_on_startup():
+    if WARMUP_ON_STARTUP:
+        await _warmup([m.strip() for m in WARMUP_ON_STARTUP])
+
+
+@app.on_event("shutdown")
+async def shutdown_executors():
+    executor.shutdown()
+    shutdown_ocr_pool()
 
 @app.get("/ping")
 async def ping():
-    print("🔥 BACKEND RECEIVED /ping REQUEST")
+    log("🔥 BACKEND RECEIVED /ping REQUEST")
     return {"message": "pong"}
 
+@app.post("/warmup")
+async def warmup(models: Optional[str] = None):
+    names = [m.strip() for m in models.split(",") if m.strip()] if models else DEFAULT_WARMUP
+    unknown = [n for n in names if not registry.is_registered(n)]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown model(s): {', '.join(unknown)}")
+
+    log(f"🔥 [WARMUP] Loading models: {','.join(names)}")
+    errors = await _warmup(names)
+    # 503 while anything failed, so a readiness probe keeps the pod out of rotation
+    return JSONResponse(status_code=503 if errors else 200, content={**registry.info(), "errors": errors})
+
+
+def _disk_cache_info() -> dict:
+    """Entries / bytes of the disk caches this process has opened; /stats never creates one."""
+    extract, summary = open_extract_cache(), open_summary_cache()
+    return {
+        "extract_cache": extract.info() if extract is not None else None,
+        "summary_cache": summary.info() if summary is not None else None,
+    }
+
+
+@app.get("/stats")
+async def stats():
+    # COUNT / total queries on SQLite: off the event loop
+    disk_caches = await executor.run_retrieve(_disk_cache_info)
+    return {
+        "models": registry.info(),
+        "llm_queue": {"pending": llm_queue.pending, "max_depth": llm_queue.max_depth},
+        "batch_jobs": {"running": batch_queue.pending, "max": batch_queue.max_depth},
+        "embedding": embed_service.stats(),
+        "answer_cache": answer_cache.info() if answer_cache is not None else None,
+        **disk_caches,
+        "prompts": packer.stats.info(),
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # -------------------------
 # 1️⃣ General Medical Q&A
 # -------------------------
 @app.get("/general")
 async def general(q: str):
     log(f"🔵 [GENERAL] Request received. Question: {q}")
-    ans = rag_answer(q)
+    with llm_queue.admit():
+        ans = await rag_answer_async(q)
     log(f"🟢 [GENERAL] Response generated.")
     return ans
     # return {"question": q, "answer": ans}
 
 
+async def _read_uploads(files) -> list:
+    """Read every upload into per-request storage (memory or a private temp file)."""
+    uploads = []
+    try:
+        for file in files:
+            uploads.append(await read_upload(file))
+    except BaseException:
+        for u in uploads:
+            u.close()
+        raise
+    return uploads
+
+
+def _close_uploads(uploads):
+    for u in uploads:
+        u.close()
+
+
 # -------------------------
 # 2️⃣ Lab Report Analysis
 # -------------------------
 @app.post("/lab")
 async def lab_analysis(q: str = Form(...), file: UploadFile = File(...)):
     log(f"🟣 [LAB] Request received. Question: {q}, File: {file.filename}")
-    pdf_path = "temp_lab.pdf"
-    with open(pdf_path, "wb") as f:
-        f.write(await file.read())
-    log(f"🟣 [LAB] PDF saved at {pdf_path}")
-    ans = rag_answer_with_pdf(q, pdf_path)
-    log(f"🟢 [LAB] Response generated.")
-    if os.path.exists(pdf_path):
-        os.remove(pdf_path)
-        log("🗑️ Deleted temp_lab.pdf")
+    with llm_queue.admit():
+        with await read_upload(file) as pdf:
+            log(f"🟣 [LAB] PDF received ({pdf.size} bytes)")
+            ans = await rag_answer_with_pdf_async(q, pdf.source)
+        log(f"🟢 [LAB] Response generated.")
     return ans
     # return {"question": q, "answer": ans}
 
@@ -53,15 +211,11 @@ async def lab_analysis(q: str = Form(...), file: UploadFile = File(...)):
 @app.post("/prescription")
 async def prescription_analysis(q: str = Form(...), file: UploadFile = File(...)):
     log(f"🟠 [PRESCRIPTION] Request received. Question: {q}, File: {file.filename}")
-    pdf_path = "temp_prescription.pdf"
-    with open(pdf_path, "wb") as f:
-        f.write(await file.read())
-    log(f"🟠 [PRESCRIPTION] PDF saved at {pdf_path}")
-    ans = rag_answer_with_prescription_pdf(q, pdf_path)
-    log(f"🟢 [PRESCRIPTION] Response generated.")
-    if os.path.exists(pdf_path):
-        os.remove(pdf_path)
-        log("🗑️ Deleted temp_prescription.pdf")
+    with llm_queue.admit():
+        with await read_upload(file) as pdf:
+            log(f"🟠 [PRESCRIPTION] PDF received ({pdf.size} bytes)")
+            ans = await rag_answer_with_prescription_pdf_async(q, pdf.source)
+        log(f"🟢 [PRESCRIPTION] Response generated.")
     return ans
     # return {"question": q, "answer": ans}
 
@@ -72,20 +226,147 @@ async def prescription_analysis(q: str = Form(...), file: UploadFile = File(...)
 @app.post("/summary")
 async def multi_summary(files: list[UploadFile], question: str = Form(None)):
     log(f"🟡 [SUMMARY] Request received. Files: {[f.filename for f in files]}")
-    paths = []
-
-    # Save all PDFs
-    for i, file in enumerate(files):
-        temp = f"temp_multi_{i}.pdf"
-        with open(temp, "wb") as f:
-            f.write(await file.read())
-        paths.append(temp)
-    log(f"🟡 [SUMMARY] Files saved: {paths}")
-    ans = summarize_multiple_pdfs(paths, question)
-    log(f"🟢 [SUMMARY] Summary generated.")
-    for p in paths:
-        if os.path.exists(p):
-            os.remove(p)
-            log(f"🗑️ Deleted {p}")
+    with llm_queue.admit():
+        uploads = await _read_uploads(files)
+        try:
+            log(f"🟡 [SUMMARY] Files received: {[(u.filename, u.size) for u in uploads]}")
+            ans = await summarize_multiple_pdfs_async(
+                [u.source for u in uploads], question, names=[u.filename for u in uploads]
+            )
+        finally:
+            _close_uploads(uploads)
+        log(f"🟢 [SUMMARY] Summary generated.")
     return ans
     # return {"summary": ans, "question": question}
+
+
+# -------------------------
+# Batch Q&A (offline jobs; runs outside the interactive LLM queue)
+# -------------------------
+class BatchQuestion(BaseModel):
+    question: str
+    category: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    questions: List[Union[str, BatchQuestion]]
+    top_k: int = TOP_K
+
+
+@app.post("/batch")
+async def batch_questions(req: BatchRequest):
+    log(f"⚪ [BATCH] Request received. {len(req.questions)} questions")
+    if len(req.questions) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch holds at most {BATCH_MAX_ITEMS} questions.")
+    items = [q if isinstance(q, str) else {"question": q.question, "category": q.category} for q in req.questions]
+    with batch_queue.admit():
+        result = await rag_answer_batch_async(items, req.top_k)
+    log(f"🟢 [BATCH] {result['items']} answers generated.", ms=result["timings_ms"]["total"])
+    return result
+
+
+# -------------------------
+# 5️⃣ Streaming variants (Server-Sent Events)
+# event: sources -> retrieved KB entries
+# event: token   -> generated text piece
+# event: done / error
+# -------------------------
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class _StreamSlot:
+    """The llm_queue slot and uploads held by one streaming response; released exactly once."""
+
+    def __init__(self, uploads):
+        self.uploads = uploads
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        llm_queue.release()
+        _close_uploads(self.uploads)
+
+
+def _event_stream(tag: str, events, uploads=()):
+    """
+    Wrap a generator event stream as SSE. The caller has already taken an
+    llm_queue slot. It is released (and uploads closed) when the stream ends,
+    by the response's background task if the body never ran or was cut off
+    by a disconnect, and at the latest when the response is discarded unsent.
+    """
+    slot = _StreamSlot(uploads)
+
+    async def body():
+        try:
+            async for event, data in events:
+                if event == "token":
+                    yield _sse("token", {"text": data})
+                else:
+                    yield _sse(event, data)
+            yield _sse("done", {})
+            log(f"🟢 [{tag}] Stream finished.", stages=span_summary(current_spans()))
+        except Exception as e:
+            log(f"🔴 [{tag}] Stream failed: {e}")
+            yield _sse("error", {"detail": str(e)})
+        finally:
+            slot.release()
+
+    response = StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(slot.release),
+    )
+    weakref.finalize(response, slot.release)
+    return response
+
+
+@app.get("/general/stream")
+async def general_stream(q: str):
+    log(f"🔵 [GENERAL] Stream request received. Question: {q}")
+    llm_queue.acquire()
+    return _event_stream("GENERAL", stream_rag_answer(q))
+
+
+@app.post("/lab/stream")
+async def lab_analysis_stream(q: str = Form(...), file: UploadFile = File(...)):
+    log(f"🟣 [LAB] Stream request received. Question: {q}, File: {file.filename}")
+    llm_queue.acquire()
+    try:
+        pdf = await read_upload(file)
+    except BaseException:
+        llm_queue.release()
+        raise
+    return _event_stream("LAB", stream_rag_answer_with_pdf(q, pdf.source), [pdf])
+
+
+@app.post("/prescription/stream")
+async def prescription_analysis_stream(q: str = Form(...), file: UploadFile = File(...)):
+    log(f"🟠 [PRESCRIPTION] Stream request received. Question: {q}, File: {file.filename}")
+    llm_queue.acquire()
+    try:
+        pdf = await read_upload(file)
+    except BaseException:
+        llm_queue.release()
+        raise
+    return _event_stream("PRESCRIPTION", stream_rag_answer_with_prescription_pdf(q, pdf.source), [pdf])
+
+
+@app.post("/summary/stream")
+async def multi_summary_stream(files: list[UploadFile], question: str = Form(None)):
+    log(f"🟡 [SUMMARY] Stream request received. Files: {[f.filename for f in files]}")
+    llm_queue.acquire()
+    try:
+        uploads = await _read_uploads(files)
+    except BaseException:
+        llm_queue.release()
+        raise
+    events = stream_summarize_multiple_pdfs(
+        [u.source for u in uploads], question, names=[u.filename for u in uploads]
+    )
+    return _event_stream("SUMMARY", events, uploads)
@@ -0,0 +1,219 @@
+# answer_cache.py
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.disk_cache import DiskCache
+from utils.kb_version import read_kb_version
+from utils.logger import log
+
+# -------------------------
+# CONFIG
+# -------------------------
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 2048))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 24 * 3600))
+# cosine distance (1 - cosine similarity) under which two questions count as the same.
+# 0 = exact matches only: near-identical wordings can ask different medical
+# questions (a child's dose vs. an adult's), so near-duplicate hits are opt-in
+ANSWER_CACHE_MAX_DISTANCE = float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", 0))
+# optional on-disk backing store shared by all workers ("" = memory only)
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "")
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+
+def normalize_question(question: str) -> str:
+    q = (question or "").lower()
+    q = re.sub(r"[^\w\s]", " ", q)
+    return re.sub(r"\s+", " ", q).strip()
+
+
+class AnswerCache:
+    """
+    Cache of LLM answers for general questions.
+
+    An entry is keyed on the normalized question + the IDs of the KB points
+    retrieved for it (the answer depends on nothing else). A lookup hits when
+    - the key matches exactly, or
+    - max_distance > 0 and an entry with the same retrieved IDs has a query
+      vector within max_distance (cosine) of the new one.
+
+    Entries expire after ttl seconds, the in-memory map is LRU-bounded, and
+    everything is dropped when the KB version stamp changes (re-ingestion).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = ANSWER_CACHE_SIZE,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_distance: float = ANSWER_CACHE_MAX_DISTANCE,
+        disk_path: str = ANSWER_CACHE_PATH,
+        disk_max_bytes: int = ANSWER_CACHE_MAX_BYTES,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._by_ids: Dict[tuple, set] = {}
+        self._lock = threading.Lock()
+        self._kb_version = read_kb_version()
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0}
+
+        self.disk = DiskCache(disk_path, disk_max_bytes) if disk_path else None
+        if self.disk is not None:
+            self.disk.reset_if_meta_changed("kb_version", self._kb_version)
+            self._load_from_disk()
+
+    # -------------------------
+    # Keys / bookkeeping
+    # -------------------------
+    @staticmethod
+    def make_key(question: str, doc_ids: List) -> str:
+        ids = ",".join(sorted(str(i) for i in doc_ids))
+        raw = f"{normalize_question(question)}|{ids}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _add(self, key: str, entry: Dict):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._by_ids.setdefault(entry["ids"], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._by_ids.get(entry["ids"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_ids[entry["ids"]]
+
+    def _expired(self, entry: Dict) -> bool:
+        return self.ttl > 0 and time.time() - entry["created"] > self.ttl
+
+    def _check_kb_version(self):
+        version = read_kb_version()
+        if version == self._kb_version:
+            return
+        log(f"[ answer_cache ] KB version changed ({self._kb_version!r} -> {version!r}); clearing cache.")
+        self._entries.clear()
+        self._by_ids.clear()
+        self._kb_version = version
+        self.stats["invalidations"] += 1
+        if self.disk is not None:
+            self.disk.reset_if_meta_changed("kb_version", version)
+
+    # -------------------------
+    # Disk backing
+    # -------------------------
+    def _load_from_disk(self):
+        for key, value, created in self.disk.recent(self.max_entries):
+            entry = self._decode(value)
+            if entry is not None and not self._expired(entry):
+                self._entries[key] = entry
+                self._by_ids.setdefault(entry["ids"], set()).add(key)
+        # recent() is newest first; LRU order wants oldest first
+        self._entries = OrderedDict(reversed(list(self._entries.items())))
+
+    @staticmethod
+    def _encode(entry: Dict) -> bytes:
+        return json.dumps({
+            "ids": list(entry["ids"]),
+            "vector": entry["vector"].tolist(),
+            "answer": entry["answer"],
+            "created": entry["created"],
+        }).encode("utf-8")
+
+    @staticmethod
+    def _decode(value: bytes) -> Optional[Dict]:
+        try:
+            data = json.loads(value)
+            return {
+                "ids": tuple(data["ids"]),
+                "vector": np.asarray(data["vector"], dtype=np.float32),
+                "answer": data["answer"],
+                "created": data["created"],
+            }
+        except Exception:
+            return None
+
+    # -------------------------
+    # Public API
+    # -------------------------
+    def lookup(self, question: str, vector, doc_ids: List) -> Optional[str]:
+        key = self.make_key(question, doc_ids)
+        ids = tuple(sorted(str(i) for i in doc_ids))
+
+        with self._lock:
+            self._check_kb_version()
+
+            entry = self._entries.get(key)
+            if entry is None and self.disk is not None:
+                raw = self.disk.get(key)
+                entry = self._decode(raw) if raw is not None else None
+                if entry is not None:
+                    self._add(key, entry)
+
+            if entry is not None and not self._expired(entry):
+                self._entries.move_to_end(key)
+                self.stats["exact_hits"] += 1
+                return entry["answer"]
+            if entry is not None:
+                self._remove(key)
+
+            # near-duplicate question that retrieved the same KB points (opt-in)
+            vec = np.asarray(vector, dtype=np.float32)
+            best_key, best_dist = None, self.max_distance
+            candidates = self._by_ids.get(ids, ()) if self.max_distance > 0 else ()
+            for other in candidates:
+                cand = self._entries[other]
+                if self._expired(cand):
+                    continue
+                dist = 1.0 - float(np.dot(vec, cand["vector"]))
+                if dist <= best_dist:
+                    best_key, best_dist = other, dist
+
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                self.stats["semantic_hits"] += 1
+                return self._entries[best_key]["answer"]
+
+            self.stats["misses"] += 1
+            return None
+
+    def store(self, question: str, vector, doc_ids: List, answer: str):
+        key = self.make_key(question, doc_ids)
+        entry = {
+            "ids": tuple(sorted(str(i) for i in doc_ids)),
+            "vector": np.asarray(vector, dtype=np.float32),
+            "answer": answer,
+            "created": time.time(),
+        }
+        with self._lock:
+            self._check_kb_version()
+            self._add(key, entry)
+        if self.disk is not None:
+            self.disk.set(key, self._encode(entry))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_ids.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def info(self) -> Dict:
+        return {**self.stats, "entries": len(self._entries)}
+
+
+answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
@@ -0,0 +1,181 @@
+# embed_service.py
+import hashlib
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+
+import numpy as np
+
+# -------------------------
+# CONFIG
+# -------------------------
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", 4096))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", 32))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", 5))
+
+
+def _cache_key(text: str) -> str:
+    # long texts (whole PDF reports) are keyed by digest to keep the cache small
+    if len(text) <= 256:
+        return text
+    return "sha1:" + hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingService:
+    """
+    Thread-safe front for an encode function (texts -> normalized vectors).
+
+    - LRU cache of recent vectors, so repeated queries skip the model.
+    - Micro-batching: cache misses from concurrent callers are queued and a
+      single worker thread gathers them for up to max_wait_ms (or max_batch
+      texts) before running ONE encode call for all of them.
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        cache_size: int = EMBED_CACHE_SIZE,
+        max_batch: int = EMBED_MAX_BATCH,
+        max_wait_ms: float = EMBED_MAX_WAIT_MS,
+    ):
+        self.encode_fn = encode_fn
+        self.cache_size = cache_size
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "batches": 0,
+            "batched_texts": 0,
+            "max_batch_size": 0,
+            "encode_seconds": 0.0,
+        }
+        self._batch_sizes: Dict[int, int] = {}
+
+        self._worker = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+        self._worker.start()
+
+    # -------------------------
+    # Cache
+    # -------------------------
+    def _cache_get(self, key: str):
+        with self._cache_lock:
+            vec = self._cache.get(key)
+            if vec is not None:
+                self._cache.move_to_end(key)
+            return vec
+
+    def _cache_put(self, key: str, vec: np.ndarray):
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = vec
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # -------------------------
+    # Batching
+    # -------------------------
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        start = time.perf_counter()
+        vecs = np.asarray(self.encode_fn(texts), dtype=np.float32)
+        elapsed = time.perf_counter() - start
+
+        with self._stats_lock:
+            n = len(texts)
+            self._stats["batches"] += 1
+            self._stats["batched_texts"] += n
+            self._stats["max_batch_size"] = max(self._stats["max_batch_size"], n)
+            self._stats["encode_seconds"] += elapsed
+            self._batch_sizes[n] = self._batch_sizes.get(n, 0) + 1
+        return vecs
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # several callers may ask for the same text in one window
+            unique: Dict[str, int] = {}
+            for text, _ in pending:
+                unique.setdefault(text, len(unique))
+
+            try:
+                vecs = self._encode(list(unique))
+            except BaseException as e:
+                for _, fut in pending:
+                    fut.set_exception(e)
+                continue
+
+            for text, fut in pending:
+                fut.set_result(vecs[unique[text]])
+
+    # -------------------------
+    # Public API
+    # -------------------------
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        out: List = [None] * len(texts)
+        misses = []
+        for i, text in enumerate(texts):
+            vec = self._cache_get(_cache_key(text))
+            if vec is None:
+                misses.append(i)
+            else:
+                out[i] = vec
+
+        with self._stats_lock:
+            self._stats["cache_hits"] += len(texts) - len(misses)
+            self._stats["cache_misses"] += len(misses)
+
+        if misses:
+            miss_texts = [texts[i] for i in misses]
+            if len(miss_texts) >= self.max_batch:
+                # already a full batch: no point waiting for company
+                vecs = list(self._encode(miss_texts))
+            else:
+                futures = []
+                for text in miss_texts:
+                    fut: Future = Future()
+                    self._queue.put((text, fut))
+                    futures.append(fut)
+                vecs = [f.result() for f in futures]
+
+            for i, vec in zip(misses, vecs):
+                out[i] = vec
+                self._cache_put(_cache_key(texts[i]), vec)
+
+        return [np.asarray(v).tolist() for v in out]
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            s = dict(self._stats)
+            sizes = dict(sorted(self._batch_sizes.items()))
+        lookups = s["cache_hits"] + s["cache_misses"]
+        s["cache_hit_rate"] = s["cache_hits"] / lookups if lookups else 0.0
+        s["avg_batch_size"] = s["batched_texts"] / s["batches"] if s["batches"] else 0.0
+        s["batch_size_histogram"] = sizes
+        with self._cache_lock:
+            s["cache_entries"] = len(self._cache)
+        return s
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
@@ -0,0 +1,166 @@
+# executor.py
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# -------------------------
+# CONFIG
+# -------------------------
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", 2))
+RETRIEVE_WORKERS = int(os.getenv("RETRIEVE_WORKERS", 4))
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", 1))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", 8))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", 5))
+# bulk /batch jobs run one at a time on their own thread, off the interactive pools
+BATCH_MAX_JOBS = int(os.getenv("BATCH_MAX_JOBS", 1))
+
+# -------------------------
+# Bounded executors (one per blocking stage)
+# -------------------------
+extract_pool = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix="extract")
+retrieve_pool = ThreadPoolExecutor(max_workers=RETRIEVE_WORKERS, thread_name_prefix="retrieve")
+llm_pool = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+batch_pool = ThreadPoolExecutor(max_workers=BATCH_MAX_JOBS, thread_name_prefix="batch")
+
+
+class QueueFullError(Exception):
+    """Raised when the inference queue is at capacity."""
+
+
+class AdmissionQueue:
+    """
+    Counts requests that are waiting for or holding the LLM.
+    Admission is refused immediately (no waiting) once max_depth is reached,
+    so callers can answer with a 503 instead of piling up behind a long job.
+    """
+
+    def __init__(self, max_depth: int):
+        self.max_depth = max_depth
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def acquire(self):
+        with self._lock:
+            if self._pending >= self.max_depth:
+                raise QueueFullError(
+                    f"Inference queue is full ({self._pending}/{self.max_depth}). Try again shortly."
+                )
+            self._pending += 1
+
+    def release(self):
+        with self._lock:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.notify_all()
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Block until nothing is admitted or `timeout` seconds pass; True when idle."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    @contextmanager
+    def admit(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+llm_queue = AdmissionQueue(LLM_MAX_QUEUE)
+batch_queue = AdmissionQueue(BATCH_MAX_JOBS)
+
+
+# -------------------------
+# Async helpers
+# -------------------------
+async def run_in(pool: ThreadPoolExecutor, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # the worker thread sees the caller's request id and span list
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(pool, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+async def run_extract(fn, *args, **kwargs):
+    return await run_in(extract_pool, fn, *args, **kwargs)
+
+
+def map_extract(fn, items) -> list:
+    """
+    Blocking counterpart of gather(run_extract(fn, x) ...): `fn` over
+    `items` on the same bounded pool, results in input order. Not to be
+    called from an extract_pool thread.
+    """
+    futures = [extract_pool.submit(contextvars.copy_context().run, fn, item) for item in items]
+    return [f.result() for f in futures]
+
+
+async def run_retrieve(fn, *args, **kwargs):
+    return await run_in(retrieve_pool, fn, *args, **kwargs)
+
+
+async def run_llm(fn, *args, **kwargs):
+    return await run_in(llm_pool, fn, *args, **kwargs)
+
+
+async def stream_in(pool: ThreadPoolExecutor, gen_fn, *args, **kwargs):
+    """
+    Drive a blocking generator on `pool` and yield its items on the event loop.
+    gen_fn receives a threading.Event as `stop`; it is set when the consumer
+    goes away (e.g. client disconnect) so the worker can stop early.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def put(entry):
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(queue.put_nowait, entry)
+
+    def produce():
+        gen = gen_fn(*args, stop=stop, **kwargs)
+        try:
+            for item in gen:
+                put((item, None))
+                if stop.is_set():
+                    break
+        except BaseException as e:
+            put((None, e))
+        finally:
+            gen.close()
+            put((done, None))
+
+    loop.run_in_executor(pool, contextvars.copy_context().run, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+
+
+def run_llm_stream(gen_fn, *args, **kwargs):
+    return stream_in(llm_pool, gen_fn, *args, **kwargs)
+
+
+async def run_batch(fn, *args, **kwargs):
+    return await run_in(batch_pool, fn, *args, **kwargs)
+
+
+def shutdown():
+    for pool in (extract_pool, retrieve_pool, llm_pool, batch_pool):
+        pool.shutdown(wait=False, cancel_futures=True)
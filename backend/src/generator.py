@@ -1,91 +1,573 @@
 # generator.py
-from llama_cpp import Llama
-from src.retriever import retrieve
-from src.prompt_builder import build_general_prompt, build_report_prompt, build_prescription_prompt,build_multi_pdf_summary_prompt
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, NamedTuple, Optional
+
+from src.executor import llm_queue, map_extract, run_batch, run_extract, run_retrieve, run_llm, run_llm_stream
+from src.retriever import TOP_K, encode_queries, retrieve_for_document, retrieve_with_vector, search_vectors_each
+from src.answer_cache import answer_cache
+from src.prompt_builder import PROMPT_PREFIXES
+from src.prompt_packer import LLM_MAX_TOKENS, packer
+from src.summary_cache import get_summary_cache
+from src.prefix_cache import PrefixCache
+from src.speculative import is_speculative, speculative_decoding
+from utils.metrics import record_llm_phase, span
+from utils.model_registry import registry
 from utils.pdf_reader import extract_pdf_text
 
-LLM_MODEL_PATH = "../models/Phi-3-mini-4k-instruct-q4.gguf"
+USE_PREFIX_CACHE = os.getenv("LLM_PREFIX_CACHE", "1") == "1"
+# multi-PDF summaries: "auto" = one prompt when everything fits, map-reduce otherwise;
+# "map_reduce" = always summarize per document first; "single" = one (trimmed) prompt
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "auto")
+MAX_REDUCE_LEVELS = 3
+DOC_SEPARATOR = "\n\n--- NEW DOCUMENT ---\n\n"
+
+# A Llama context is not thread-safe; every generation goes through this lock.
+# (A RemoteLLM - see src/llm_server.py - is: the server queues requests for
+# its workers, which also keep the prefix KV cache.)
+llm_lock = threading.Lock()
+_prefix_cache = None
+
+
+def get_llm():
+    return registry.get("llm")
+
+
+def _is_remote(llm) -> bool:
+    return getattr(llm, "remote", False)
+
+
+def _get_prefix_cache() -> PrefixCache:
+    # caller holds llm_lock; the fixed prefixes are evaluated together with
+    # the cache, so the first request already starts from their KV state
+    global _prefix_cache
+    if _prefix_cache is None:
+        cache = PrefixCache(get_llm())
+        if USE_PREFIX_CACHE:
+            cache.warm(PROMPT_PREFIXES)
+        _prefix_cache = cache
+    return _prefix_cache
+
+
+def warm_prefix_cache():
+    """Load the LLM and evaluate the fixed prompt prefixes now instead of before the first request."""
+    if _is_remote(get_llm()):
+        return
+    with llm_lock:
+        _get_prefix_cache()
+
+
+@contextmanager
+def _locked_llm():
+    llm = get_llm()
+    if _is_remote(llm):
+        yield llm
+        return
+    with span("llm_wait"):
+        llm_lock.acquire()
+    try:
+        yield llm
+    finally:
+        llm_lock.release()
+
+
+def _timed_chunks(chunks, prompt_tokens: int):
+    """
+    Pass llama.cpp stream chunks through while timing the two phases:
+    prompt evaluation (until the first token) and generation (the rest).
+    Returns the number of chunks once the stream is exhausted.
+    """
+    start = time.perf_counter()
+    first_at, n = None, 0
+    try:
+        for chunk in chunks:
+            if first_at is None:
+                first_at = time.perf_counter()
+            n += 1
+            yield chunk
+    finally:
+        chunks.close()
+        if first_at is not None:
+            record_llm_phase("prompt_eval", prompt_tokens, first_at - start)
+            record_llm_phase("generation", n - 1, time.perf_counter() - first_at)
+    return n
+
+
+def _generate(llm, prompt: str, speculative: bool = False):
+    # always streamed internally: the first chunk marks the end of prompt evaluation
+    remote = _is_remote(llm)
+    if not remote:
+        _get_prefix_cache().restore_for(prompt)
+    # a remote worker attaches the draft model itself
+    extra = {"speculative": True} if remote and speculative else {}
+    with speculative_decoding(llm, speculative and not remote) as drafts:
+        chunks = llm(
+            prompt,
+            max_tokens=LLM_MAX_TOKENS,
+            temperature=0.0,
+            stop=["###"],
+            stream=True,
+            **extra
+        )
+        generated = yield from _timed_chunks(chunks, packer.counter.count(prompt))
+    if drafts is not None:
+        drafts.record(generated)
+
+
+def call_llm(prompt: str, speculative: bool = False) -> str:
+    with _locked_llm() as llm:
+        text = "".join(chunk["choices"][0]["text"] for chunk in _generate(llm, prompt, speculative))
+    return text.strip()
 
-llm = Llama(
-    model_path=LLM_MODEL_PATH,
-    n_ctx=2048,
-    n_threads=8,
-    n_gpu_layers=-15,
-    verbose=False
-)
 
-def call_llm(prompt: str) -> str:
-    output = llm(
-        prompt,
-        max_tokens=256,
-        temperature=0.0,
-        stop=["###"]
-    )
-    return output["choices"][0]["text"].strip()
+def stream_llm(prompt: str, stop=None, speculative: bool = False):
+    """
+    Yield generated text pieces as llama.cpp produces them.
+    `stop` is an optional threading.Event; when set, generation is abandoned.
+    `speculative` turns on prompt-lookup decoding (see src/speculative.py).
+    """
+    with _locked_llm() as llm:
+        chunks = _generate(llm, prompt, speculative)
+        started = False
+        try:
+            for chunk in chunks:
+                if stop is not None and stop.is_set():
+                    break
+                text = chunk["choices"][0]["text"]
+                # mirror call_llm's strip() for the leading whitespace
+                if not started:
+                    text = text.lstrip()
+                    if not text:
+                        continue
+                    started = True
+                yield text
+        finally:
+            chunks.close()
 
 # 1️⃣ GENERAL Q&A
+def _cached_general(question: str):
+    """Retrieve for `question`; returns (docs, cached answer or None, store callback)."""
+    vec, docs = retrieve_with_vector(question)
+    if answer_cache is None:
+        return docs, None, None
+
+    ids = [d["id"] for d in docs]
+    cached = answer_cache.lookup(question, vec, ids)
+
+    def store(answer: str):
+        if answer:
+            answer_cache.store(question, vec, ids, answer)
+
+    return docs, cached, store
+
+
 def rag_answer(question: str) -> str:
-    docs = retrieve(question)
-    prompt = build_general_prompt(question, docs)
-    return call_llm(prompt)
+    docs, cached, store = _cached_general(question)
+    if cached is not None:
+        return cached
+
+    prompt, docs = packer.general(question, docs)
+    answer = call_llm(prompt, is_speculative("general"))
+    if store is not None:
+        store(answer)
+    return answer
 
 # 2️⃣ REPORT ANALYSIS
+NO_TEXT_MESSAGE = (
+    "It looks like you may have attached the wrong PDF, or the quality of the PDF "
+    "is too low to extract text. Please upload a clear lab report PDF."
+)
+
 def rag_answer_with_pdf(question: str, pdf_path: str) -> str:
     pdf_text = extract_pdf_text(pdf_path)
     if not pdf_text:
-        return (
-            "It looks like you may have attached the wrong PDF, or the quality of the PDF "
-            "is too low to extract text. Please upload a clear lab report PDF."
-        )
+        return NO_TEXT_MESSAGE
 
     # combined_query = f"{question}\n\nEXTRACTED LAB REPORT:\n{pdf_text}"
 
-    docs = retrieve(pdf_text, category="lab_test")
+    docs = retrieve_for_document(pdf_text, category="lab_test")
 
 
-    prompt = build_report_prompt(question, pdf_text, docs)
+    prompt, docs = packer.report(question, pdf_text, docs)
 
-    return call_llm(prompt)
+    return call_llm(prompt, is_speculative("lab"))
 
 def rag_answer_with_prescription_pdf(question: str, pdf_path: str) -> str:
     pdf_text = extract_pdf_text(pdf_path)
     # combined = f"{question}\n\n{pdf_text}"
     if not pdf_text:
-        return (
-            "It looks like you may have attached the wrong PDF, or the quality of the PDF "
-            "is too low to extract text. Please upload a clear lab report PDF."
-        )
+        return NO_TEXT_MESSAGE
 
-    docs = retrieve(pdf_text, category="medicine")  # ONLY medicine category
+    docs = retrieve_for_document(pdf_text, category="medicine")  # ONLY medicine category
 
-    prompt = build_prescription_prompt(question, pdf_text, docs)
-    return call_llm(prompt)
+    prompt, docs = packer.prescription(question, pdf_text, docs)
+    return call_llm(prompt, is_speculative("prescription"))
 
 
 
 # -------------------------------------------------------------
 # 4️⃣ MULTIPLE PDF SUMMARY
 # -------------------------------------------------------------
-def summarize_multiple_pdfs(pdf_paths: list, question: str = None) -> str:
-    extracted_texts = []
+def _pdf_labels(pdf_paths: list, names: list = None) -> list:
+    # in-memory uploads have no path; label them by filename / position
+    if names:
+        return list(names)
+    return [p if isinstance(p, str) else f"document {i + 1}" for i, p in enumerate(pdf_paths)]
 
-    for path in pdf_paths:
-        pdf_text = extract_pdf_text(path)
 
-        # Safety check for each PDF
-        if not pdf_text or len(pdf_text.strip()) < 15:
-            extracted_texts.append(
-                f"[WARNING] Could not extract text from file: {path}. "
-                f"It may be the wrong file or too low quality."
-            )
-        else:
-            extracted_texts.append(pdf_text)
+def _has_text(pdf_text: str) -> bool:
+    return bool(pdf_text) and len(pdf_text.strip()) >= 15
+
+
+def _checked_pdf_text(label, pdf_text: str) -> str:
+    # Safety check for each PDF
+    if not _has_text(pdf_text):
+        return (
+            f"[WARNING] Could not extract text from file: {label}. "
+            f"It may be the wrong file or too low quality."
+        )
+    return pdf_text
+
+
+def _use_map_reduce(combined_pdf_text: str, question: str = None) -> bool:
+    if SUMMARY_MODE == "single":
+        return False
+    if SUMMARY_MODE == "map_reduce":
+        return True
+    return not packer.summary_fits(combined_pdf_text, question)
+
+
+# -------------------------------------------------------------
+# Map-reduce summary
+# Written as a step generator so the sync and async drivers share it:
+# it yields lists of map prompts, is sent back their summaries, and
+# finally returns the reduce prompt.
+# -------------------------------------------------------------
+def _map_reduce_steps(labels: list, pdf_texts: list, question: str = None):
+    # map: every chunk of every readable document
+    chunk_prompts = [
+        [packer.doc_summary(chunk) for chunk in packer.split_for_map(text)] if _has_text(text) else []
+        for text in pdf_texts
+    ]
+    summaries = yield [p for prompts in chunk_prompts for p in prompts]
+
+    parts, i = [], 0
+    for label, text, prompts in zip(labels, pdf_texts, chunk_prompts):
+        if not prompts:
+            parts.append(_checked_pdf_text(label, text))
+            continue
+        parts.append(f"[{label}]\n" + "\n".join(s.strip() for s in summaries[i:i + len(prompts)]))
+        i += len(prompts)
+
+    # reduce: if the key points alone overflow one prompt, condense groups first
+    for _ in range(MAX_REDUCE_LEVELS):
+        groups = packer.group_for_reduce(parts, question)
+        if len(groups) <= 1:
+            break
+        parts = yield [packer.summary_combine("\n\n".join(parts[j] for j in g)) for g in groups]
+
+    return packer.summary_reduce("\n\n".join(parts), question)
+
+
+def _advance(steps, value=None):
+    """One step of _map_reduce_steps: ("map", prompts) or ("reduce", prompt)."""
+    try:
+        return "map", steps.send(value)
+    except StopIteration as done:
+        return "reduce", done.value
+
+
+def _cached_summaries(prompts: list) -> list:
+    cache = get_summary_cache()
+    if cache is None:
+        return [None] * len(prompts)
+    return [cache.get(p, LLM_MAX_TOKENS) for p in prompts]
+
+
+def _summarize_chunk(prompt: str) -> str:
+    summary = call_llm(prompt, is_speculative("summary"))
+    cache = get_summary_cache()
+    if cache is not None and summary:
+        cache.set(prompt, LLM_MAX_TOKENS, summary)
+    return summary
+
+
+def _map_reduce_prompt(labels: list, pdf_texts: list, question: str = None) -> str:
+    steps = _map_reduce_steps(labels, pdf_texts, question)
+    kind, value = _advance(steps)
+    while kind == "map":
+        summaries = [c if c is not None else _summarize_chunk(p) for p, c in zip(value, _cached_summaries(value))]
+        kind, value = _advance(steps, summaries)
+    return value
+
+
+def summarize_multiple_pdfs(pdf_paths: list, question: str = None, names: list = None) -> str:
+    labels = _pdf_labels(pdf_paths, names)
+    # same bounded extract pool as the async endpoints
+    pdf_texts = map_extract(extract_pdf_text, pdf_paths)
+    extracted_texts = [_checked_pdf_text(label, pdf_text) for label, pdf_text in zip(labels, pdf_texts)]
 
     # Combine all extracted text
-    combined_pdf_text = "\n\n--- NEW DOCUMENT ---\n\n".join(extracted_texts)
+    combined_pdf_text = DOC_SEPARATOR.join(extracted_texts)
 
     # Build summary prompt
-    prompt = build_multi_pdf_summary_prompt(combined_pdf_text, question)
+    if _use_map_reduce(combined_pdf_text, question):
+        prompt = _map_reduce_prompt(labels, pdf_texts, question)
+    else:
+        prompt = packer.summary(combined_pdf_text, question)
 
     # Generate summary
-    return call_llm(prompt)
+    return call_llm(prompt, is_speculative("summary"))
+
+
+# -------------------------------------------------------------
+# 5️⃣ BATCH Q&A (offline jobs: FAQ generation, evaluation runs)
+# One encode() call and one vector search for every question, then
+# the prompts go to the LLM back to back, each one only after any
+# waiting interactive request has been served (or BATCH_MAX_DEFER_S
+# has passed, so steady interactive load cannot starve a batch).
+# -------------------------------------------------------------
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 500))
+BATCH_MAX_DEFER_S = float(os.getenv("BATCH_MAX_DEFER_S", 30))
+
+
+class BatchItem(NamedTuple):
+    question: str
+    category: Optional[str] = None     # restrict retrieval to one KB category
+
+
+def _batch_items(items: list) -> list:
+    # questions as plain strings, {"question", "category"} dicts or BatchItems
+    return [
+        BatchItem(it) if isinstance(it, str)
+        else BatchItem(it["question"], it.get("category")) if isinstance(it, dict)
+        else BatchItem(*it)
+        for it in items
+    ]
+
+
+def _ms_since(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def _yield_to_interactive() -> float:
+    """Block while interactive requests are waiting for / holding the LLM, at most BATCH_MAX_DEFER_S; returns ms waited."""
+    start = time.perf_counter()
+    llm_queue.wait_idle(BATCH_MAX_DEFER_S)
+    return _ms_since(start)
+
+
+def _batch_answer(item: BatchItem, vec, docs: list) -> dict:
+    ids = [d["id"] for d in docs]
+    timings = {}
+    answer = answer_cache.lookup(item.question, vec, ids) if answer_cache is not None else None
+    cached = answer is not None
+    if not cached:
+        start = time.perf_counter()
+        prompt, docs = packer.general(item.question, docs)
+        timings["pack"] = _ms_since(start)
+        timings["wait"] = _yield_to_interactive()
+        start = time.perf_counter()
+        answer = call_llm(prompt, is_speculative("batch"))
+        timings["llm"] = _ms_since(start)
+        if answer_cache is not None and answer:
+            answer_cache.store(item.question, vec, ids, answer)
+    return {
+        "question": item.question,
+        "category": item.category,
+        "answer": answer,
+        "cached": cached,
+        "sources": _source_info(docs),
+        "timings_ms": timings,
+    }
+
+
+def rag_answer_batch(items: list, top_k: int = TOP_K) -> dict:
+    """
+    Answer many general questions in one pass. `items` are questions or
+    {"question", "category"} dicts; results keep their order. An item
+    whose generation fails carries an "error" instead of an answer.
+    """
+    items = _batch_items(items)
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f"A batch holds at most {BATCH_MAX_ITEMS} questions (got {len(items)}).")
+    total = time.perf_counter()
+    if not items:
+        return {"items": 0, "results": [], "timings_ms": {"embed": 0.0, "search": 0.0, "total": 0.0}}
+
+    start = time.perf_counter()
+    vecs = encode_queries([it.question for it in items])
+    embed_ms = _ms_since(start)
+
+    start = time.perf_counter()
+    hits = search_vectors_each(vecs, [it.category for it in items], top_k)
+    search_ms = _ms_since(start)
+
+    results = []
+    for item, vec, docs in zip(items, vecs, hits):
+        try:
+            results.append(_batch_answer(item, vec, docs))
+        except Exception as e:
+            results.append({"question": item.question, "category": item.category, "error": str(e)})
+
+    return {
+        "items": len(items),
+        "results": results,
+        "timings_ms": {"embed": embed_ms, "search": search_ms, "total": _ms_since(total)},
+    }
+
+
+# -------------------------------------------------------------
+# ASYNC VARIANTS (used by the FastAPI handlers)
+# Each blocking stage runs on its own bounded executor so the
+# event loop stays free for /ping and short requests.
+# -------------------------------------------------------------
+class Prepared(NamedTuple):
+    prompt: Optional[str]
+    docs: list
+    answer: Optional[str] = None                 # ready answer, LLM is skipped
+    on_answer: Optional[Callable] = None         # receives the generated answer
+    speculative: bool = False                    # prompt-lookup decoding for this endpoint
+
+
+async def _prepare_general(question: str) -> Prepared:
+    docs, cached, store = await run_retrieve(_cached_general, question)
+    if cached is not None:
+        return Prepared(None, docs, answer=cached)
+    prompt, docs = await run_retrieve(packer.general, question, docs)
+    return Prepared(prompt, docs, on_answer=store, speculative=is_speculative("general"))
+
+
+async def _prepare_report(question: str, pdf_path: str) -> Prepared:
+    pdf_text = await run_extract(extract_pdf_text, pdf_path)
+    if not pdf_text:
+        return Prepared(None, [], answer=NO_TEXT_MESSAGE)
+
+    docs = await run_retrieve(retrieve_for_document, pdf_text, category="lab_test")
+    prompt, docs = await run_retrieve(packer.report, question, pdf_text, docs)
+    return Prepared(prompt, docs, speculative=is_speculative("lab"))
+
+
+async def _prepare_prescription(question: str, pdf_path: str) -> Prepared:
+    pdf_text = await run_extract(extract_pdf_text, pdf_path)
+    if not pdf_text:
+        return Prepared(None, [], answer=NO_TEXT_MESSAGE)
+
+    docs = await run_retrieve(retrieve_for_document, pdf_text, category="medicine")
+    prompt, docs = await run_retrieve(packer.prescription, question, pdf_text, docs)
+    return Prepared(prompt, docs, speculative=is_speculative("prescription"))
+
+
+async def _prepare_summary(pdf_paths: list, question: str = None, names: list = None) -> Prepared:
+    # all files are extracted concurrently, at most EXTRACT_WORKERS at a time
+    pdf_texts = await asyncio.gather(*(run_extract(extract_pdf_text, p) for p in pdf_paths))
+    labels = _pdf_labels(pdf_paths, names)
+    extracted_texts = [_checked_pdf_text(l, t) for l, t in zip(labels, pdf_texts)]
+
+    combined_pdf_text = DOC_SEPARATOR.join(extracted_texts)
+    speculative = is_speculative("summary")
+    if not await run_retrieve(_use_map_reduce, combined_pdf_text, question):
+        return Prepared(await run_retrieve(packer.summary, combined_pdf_text, question), [], speculative=speculative)
+    return Prepared(await _map_reduce_prompt_async(labels, list(pdf_texts), question), [], speculative=speculative)
+
+
+async def _map_reduce_prompt_async(labels: list, pdf_texts: list, question: str = None) -> str:
+    # packing (tokenizer work) on the retrieve pool; map prompts run
+    # concurrently on the LLM pool, skipping ones summarized before
+    steps = _map_reduce_steps(labels, pdf_texts, question)
+    kind, value = await run_retrieve(_advance, steps)
+    while kind == "map":
+        cached = await run_retrieve(_cached_summaries, value)
+        summaries = await asyncio.gather(*(
+            run_llm(_summarize_chunk, p) if c is None else _ready(c)
+            for p, c in zip(value, cached)
+        ))
+        kind, value = await run_retrieve(_advance, steps, list(summaries))
+    return value
+
+
+async def _ready(value):
+    return value
+
+
+async def _answer(prepared: Prepared) -> str:
+    if prepared.answer is not None:
+        return prepared.answer
+
+    answer = await run_llm(call_llm, prepared.prompt, prepared.speculative)
+    if prepared.on_answer is not None:
+        # a SQLite write (and maybe eviction) when the answer cache is on disk
+        await run_retrieve(prepared.on_answer, answer)
+    return answer
+
+
+async def rag_answer_async(question: str) -> str:
+    return await _answer(await _prepare_general(question))
+
+
+async def rag_answer_with_pdf_async(question: str, pdf_path: str) -> str:
+    return await _answer(await _prepare_report(question, pdf_path))
+
+
+async def rag_answer_with_prescription_pdf_async(question: str, pdf_path: str) -> str:
+    return await _answer(await _prepare_prescription(question, pdf_path))
+
+
+async def summarize_multiple_pdfs_async(pdf_paths: list, question: str = None, names: list = None) -> str:
+    return await _answer(await _prepare_summary(pdf_paths, question, names))
+
+
+async def rag_answer_batch_async(items: list, top_k: int = TOP_K) -> dict:
+    # the whole job runs on the batch thread: no interactive pool slot is held
+    return await run_batch(rag_answer_batch, items, top_k)
+
+
+# -------------------------------------------------------------
+# STREAMING VARIANTS
+# Yield (event, data) pairs: one "sources" event with the retrieved
+# KB entries, then "token" events as the LLM generates.
+# -------------------------------------------------------------
+def _source_info(docs: list) -> list:
+    return [
+        {"score": d["score"], "category": d["category"], "name": d["name"]}
+        for d in docs
+    ]
+
+
+async def _stream(prepared: Prepared):
+    yield "sources", _source_info(prepared.docs)
+
+    if prepared.answer is not None:
+        yield "token", prepared.answer
+        return
+
+    pieces = []
+    async for text in run_llm_stream(stream_llm, prepared.prompt, speculative=prepared.speculative):
+        pieces.append(text)
+        yield "token", text
+
+    if prepared.on_answer is not None:
+        await run_retrieve(prepared.on_answer, "".join(pieces).strip())
+
+
+async def stream_rag_answer(question: str):
+    async for event in _stream(await _prepare_general(question)):
+        yield event
+
+
+async def stream_rag_answer_with_pdf(question: str, pdf_path: str):
+    async for event in _stream(await _prepare_report(question, pdf_path)):
+        yield event
+
+
+async def stream_rag_answer_with_prescription_pdf(question: str, pdf_path: str):
+    async for event in _stream(await _prepare_prescription(question, pdf_path)):
+        yield event
+
+
+async def stream_summarize_multiple_pdfs(pdf_paths: list, question: str = None, names: list = None):
+    async for event in _stream(await _prepare_summary(pdf_paths, question, names)):
+        yield event
@@ -0,0 +1,353 @@
+# llm_server.py
+import itertools
+import multiprocessing
+import os
+import queue
+import signal
+import stat
+import threading
+from multiprocessing.connection import Client, Listener, wait
+from typing import Dict, List, Optional
+
+from utils.logger import log
+from utils.metrics import record_draft_tokens
+
+# -------------------------
+# CONFIG
+# One inference server process owns the GGUF weights; each of its
+# LLM_SERVER_WORKERS child processes runs one llama.cpp context on its
+# own share of the cores. API workers (any number of uvicorn processes)
+# connect over local IPC, see RemoteLLM.
+# -------------------------
+# unix socket path, or host:port for TCP; empty = LLM runs in each API process
+LLM_SERVER_ADDRESS = os.getenv("LLM_SERVER_ADDRESS", "")
+# messages are pickles: whoever passes the handshake can run code in the server.
+# The built-in default only guards the unix socket (which is created with
+# mode 600); TCP refuses to start without an explicit secret.
+_AUTHKEY_SET = bool(os.getenv("LLM_SERVER_AUTHKEY"))
+LLM_SERVER_AUTHKEY = (os.getenv("LLM_SERVER_AUTHKEY") or "curasense-llm").encode("utf-8")
+LLM_SERVER_WORKERS = int(os.getenv("LLM_SERVER_WORKERS", 1))
+# pin each worker to its own cores (Linux only)
+LLM_PIN_CORES = os.getenv("LLM_PIN_CORES", "0") == "1"
+
+
+def parse_address(address: str):
+    """'host:port' -> (host, port) for TCP, anything else is a unix socket path."""
+    if ":" in address and not address.startswith(("/", ".")):
+        host, port = address.rsplit(":", 1)
+        return host, int(port)
+    return address
+
+
+def available_cores() -> List[int]:
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # not Linux
+        return list(range(os.cpu_count() or 1))
+
+
+def plan_workers(n_workers: int, threads: int = 0, cores: Optional[List[int]] = None) -> List[Dict]:
+    """
+    Split the available cores between workers: each gets `threads`
+    threads (default: its even share) and, for pinning, its own core range.
+    """
+    cores = cores if cores is not None else available_cores()
+    share = max(len(cores) // max(n_workers, 1), 1)
+    plans = []
+    for i in range(n_workers):
+        own = cores[i * share:(i + 1) * share] or cores
+        plans.append({"index": i, "threads": threads or share, "cores": own})
+    return plans
+
+
+# -------------------------
+# Worker process: one llama.cpp context
+# -------------------------
+def _worker_main(conn, plan: Dict):
+    from src.prefix_cache import PrefixCache
+    from src.prompt_builder import PROMPT_PREFIXES
+    from src.speculative import speculative_decoding
+    from utils.model_registry import load_llama
+
+    if LLM_PIN_CORES and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, plan["cores"])
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the server shuts workers down
+
+    llm = load_llama(n_threads=plan["threads"])
+    prefix_cache = PrefixCache(llm)
+    if os.getenv("LLM_PREFIX_CACHE", "1") == "1":
+        prefix_cache.warm(PROMPT_PREFIXES)
+    conn.send({"ready": plan["index"]})
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        if msg.get("op") != "complete":
+            continue  # a "cancel" that arrived after its request had finished
+        kwargs = dict(msg.get("kwargs", {}))
+        speculative = kwargs.pop("speculative", False)
+        try:
+            prefix_cache.restore_for(msg["prompt"])
+            with speculative_decoding(llm, speculative) as drafts:
+                chunks = llm(msg["prompt"], stream=True, **kwargs)
+                n = 0
+                for chunk in chunks:
+                    n += 1
+                    conn.send({"chunk": chunk})
+                    if conn.poll() and conn.recv() == {"op": "cancel", "id": msg["id"]}:
+                        chunks.close()
+                        break
+            done = {"done": True}
+            if drafts is not None:
+                # the worker exports no metrics: draft counts go back to the API process
+                done["drafts"] = {"drafted": drafts.drafted, "accepted": drafts.accepted(n)}
+            conn.send(done)
+        except Exception as e:
+            conn.send({"error": f"{type(e).__name__}: {e}"})
+
+
+# -------------------------
+# Server process: accepts API connections, hands each request to an idle worker
+# -------------------------
+class LLMServer:
+    def __init__(self, address: str = LLM_SERVER_ADDRESS, n_workers: int = LLM_SERVER_WORKERS, threads: int = 0):
+        from utils.model_registry import LLM_THREADS
+
+        if not address:
+            raise ValueError("Set LLM_SERVER_ADDRESS (a unix socket path or host:port)")
+        self.address = parse_address(address)
+        if isinstance(self.address, tuple) and not _AUTHKEY_SET:
+            raise ValueError("A TCP LLM server needs an explicit LLM_SERVER_AUTHKEY (a long random secret)")
+        self.plans = plan_workers(n_workers, threads or LLM_THREADS)
+        self.idle: "queue.Queue" = queue.Queue()
+        self.processes = [None] * len(self.plans)
+        self._slot = {}  # worker connection -> plan index
+        self._ctx = multiprocessing.get_context("spawn")
+        self.busy = 0
+        self._busy_lock = threading.Lock()
+        self._ids = itertools.count()
+
+    def _spawn(self, plan: Dict):
+        parent, child = self._ctx.Pipe()
+        p = self._ctx.Process(target=_worker_main, args=(child, plan), name=f"llm-worker-{plan['index']}", daemon=True)
+        p.start()
+        child.close()  # only the worker holds its end: its death shows up as EOF here
+        self.processes[plan["index"]] = p
+        self._slot[parent] = plan["index"]
+        log(f"[ llm_server ] worker {plan['index']}: {plan['threads']} threads, cores {plan['cores']}")
+        return parent
+
+    def start_workers(self):
+        conns = [self._spawn(plan) for plan in self.plans]
+        for conn in conns:
+            conn.recv()  # {"ready": i}: model mapped, prefixes warmed
+            self.idle.put(conn)
+
+    def _replace(self, worker):
+        """Start a new process in a dead worker's slot; it rejoins the idle queue once loaded."""
+        index = self._slot.pop(worker)
+        worker.close()
+        old = self.processes[index]
+        if old.is_alive():
+            old.terminate()
+        old.join(timeout=5)
+        conn = self._spawn(self.plans[index])
+
+        def ready():
+            try:
+                conn.recv()
+            except (EOFError, OSError):
+                log(f"[ llm_server ] worker {index} failed to restart; running with one worker less")
+                return
+            self.idle.put(conn)
+
+        threading.Thread(target=ready, name=f"llm-worker-{index}-restart", daemon=True).start()
+
+    def _relay(self, client, msg):
+        worker = self.idle.get()
+        with self._busy_lock:
+            self.busy += 1
+        # cancels carry the request id: a late one must not stop the worker's next request
+        rid = next(self._ids)
+        cancel = {"op": "cancel", "id": rid}
+        client_gone, worker_ok = False, True
+        try:
+            worker.send({**msg, "id": rid})
+            while True:
+                ready = wait([worker] if client_gone else [worker, client])
+                if client in ready:
+                    try:
+                        m = client.recv()
+                    except (EOFError, OSError):
+                        m, client_gone = {"op": "cancel"}, True
+                    if m.get("op") == "cancel":
+                        worker.send(cancel)
+                    continue
+                reply = worker.recv()
+                if not client_gone:
+                    try:
+                        client.send(reply)
+                    except OSError:
+                        client_gone = True
+                        worker.send(cancel)
+                if "done" in reply or "error" in reply:
+                    return not client_gone
+        except (EOFError, OSError) as e:
+            # the worker process died (crash, OOM kill): the request fails, the slot is refilled
+            worker_ok = False
+            log(f"[ llm_server ] worker {self._slot.get(worker)} died ({type(e).__name__}); restarting it")
+            if not client_gone:
+                try:
+                    client.send({"error": "LLM worker stopped unexpectedly"})
+                except OSError:
+                    client_gone = True
+            return not client_gone
+        finally:
+            with self._busy_lock:
+                self.busy -= 1
+            if worker_ok:
+                self.idle.put(worker)
+            else:
+                self._replace(worker)
+
+    def _serve_client(self, client):
+        with client:
+            while True:
+                try:
+                    msg = client.recv()
+                except (EOFError, OSError):
+                    return
+                op = msg.get("op")
+                if op == "complete":
+                    if not self._relay(client, msg):
+                        return
+                elif op == "info":
+                    client.send({"workers": self.plans, "busy": self.busy})
+
+    def serve_forever(self):
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            if stat.S_ISSOCK(os.stat(self.address).st_mode):
+                os.unlink(self.address)  # left over from a previous run
+        self.start_workers()
+        # the socket is created 600 (only this user may connect), never briefly world-accessible
+        umask = os.umask(0o177) if isinstance(self.address, str) else None
+        try:
+            listener = Listener(self.address, authkey=LLM_SERVER_AUTHKEY)
+        finally:
+            if umask is not None:
+                os.umask(umask)
+        with listener:
+            log(f"[ llm_server ] {len(self.plans)} worker(s) listening on {self.address}")
+            while True:
+                try:
+                    client = listener.accept()
+                except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+                    log(f"[ llm_server ] rejected a connection: {e}")
+                    continue
+                threading.Thread(target=self._serve_client, args=(client,), daemon=True).start()
+
+    def shutdown(self):
+        for p in self.processes:
+            p.terminate()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+# -------------------------
+# Client (registered as the "llm" model in API workers)
+# -------------------------
+class RemoteLLM:
+    """
+    Stands in for llama_cpp.Llama in an API worker: completions run in the
+    inference server, tokenization runs here on a vocab-only copy of the
+    model (no weights loaded). The prompt-prefix KV cache lives in the
+    server's workers, so `remote` tells the generator not to manage one.
+
+    One connection per call, so it is safe to use from several threads.
+    """
+
+    remote = True
+
+    def __init__(self, address: str = LLM_SERVER_ADDRESS, model_path: Optional[str] = None):
+        from utils.model_registry import LLM_MODEL_PATH
+
+        self.address = parse_address(address)
+        self.model_path = model_path or LLM_MODEL_PATH
+        self._vocab = None
+        self._vocab_lock = threading.Lock()
+
+    # ---- tokenizer (local) ----
+    @property
+    def vocab(self):
+        if self._vocab is None:
+            with self._vocab_lock:
+                if self._vocab is None:
+                    from llama_cpp import Llama
+
+                    self._vocab = Llama(model_path=self.model_path, vocab_only=True, verbose=False)
+        return self._vocab
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False):
+        return self.vocab.tokenize(text, add_bos=add_bos, special=special)
+
+    def detokenize(self, tokens) -> bytes:
+        return self.vocab.detokenize(tokens)
+
+    # ---- generation (remote) ----
+    def _connect(self):
+        try:
+            return Client(self.address, authkey=LLM_SERVER_AUTHKEY)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise ConnectionError(
+                f"LLM server not reachable at {self.address}; start it with `python -m src.llm_server`"
+            ) from e
+
+    def _stream(self, prompt: str, kwargs: Dict):
+        conn = self._connect()
+        finished = False
+        try:
+            conn.send({"op": "complete", "prompt": prompt, "kwargs": kwargs})
+            while True:
+                reply = conn.recv()
+                if "chunk" in reply:
+                    yield reply["chunk"]
+                elif "error" in reply:
+                    finished = True
+                    raise RuntimeError(f"LLM server: {reply['error']}")
+                else:
+                    finished = True
+                    if reply.get("drafts"):
+                        record_draft_tokens(reply["drafts"]["drafted"], reply["drafts"]["accepted"])
+                    return
+        finally:
+            if not finished:
+                try:
+                    conn.send({"op": "cancel"})
+                except OSError:
+                    pass
+            conn.close()
+
+    def __call__(self, prompt: str, stream: bool = False, **kwargs):
+        chunks = self._stream(prompt, kwargs)
+        if stream:
+            return chunks
+        text = "".join(c["choices"][0]["text"] for c in chunks)
+        return {"choices": [{"text": text}]}
+
+    def info(self) -> Dict:
+        with self._connect() as conn:
+            conn.send({"op": "info"})
+            return conn.recv()
+
+
+if __name__ == "__main__":
+    # LLM_SERVER_ADDRESS=/tmp/curasense-llm.sock LLM_SERVER_WORKERS=2 python -m src.llm_server
+    server = LLMServer()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
@@ -0,0 +1,247 @@
+# name_index.py
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from utils.logger import log
+
+try:  # C implementation, if installed (pip install pyahocorasick)
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# -------------------------
+# CONFIG
+# -------------------------
+NAME_INDEX_PATH = os.getenv("NAME_INDEX_PATH", "cache/name_index.json")
+# KB categories whose names are worth spotting verbatim in uploaded documents
+NAME_INDEX_CATEGORIES = [c for c in os.getenv("NAME_INDEX_CATEGORIES", "medicine,lab_test").split(",") if c]
+MIN_PATTERN_CHARS = 4      # shorter names ("hb", "k") match everywhere
+MAX_IDS_PER_PATTERN = 2    # "augmentin" alone may stand for many products
+
+INDEX_FORMAT = 1
+
+# Dosage-form words that a prescription may omit ("Dolo 650" vs "Dolo 650 Tablet")
+FORM_WORDS = {
+    "tablet", "tablets", "tab", "capsule", "capsules", "cap", "syrup", "injection", "inj",
+    "suspension", "cream", "gel", "ointment", "drops", "drop", "solution", "lotion",
+    "powder", "sachet", "spray", "inhaler", "respules", "dt", "sr", "er", "xr", "cr", "mr",
+}
+
+
+# -------------------------
+# Normalization
+# Both KB names and document text go through fold(), so a name still
+# matches after typical OCR confusions and spelling slips.
+# -------------------------
+_OCR_FOLD = str.maketrans({
+    "0": "o", "1": "l", "i": "l", "|": "l", "!": "l",
+    "5": "s", "$": "s", "8": "b",
+})
+_MULTI_FOLD = [("rn", "m"), ("vv", "w"), ("cl", "d")]
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+_REPEATS = re.compile(r"(.)\1+")
+
+
+def fold(text: str) -> str:
+    """Lowercase ASCII, OCR look-alikes merged, doubled letters collapsed, words space-separated."""
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii").lower()
+    text = _NON_ALNUM.sub(" ", text)
+    text = text.translate(_OCR_FOLD)
+    for a, b in _MULTI_FOLD:
+        text = text.replace(a, b)
+    text = _REPEATS.sub(r"\1", text)
+    return " ".join(text.split())
+
+
+def name_variants(name: str) -> List[str]:
+    """Folded forms a KB name may appear under in a document."""
+    words = _NON_ALNUM.sub(" ", name.lower()).split()
+    variants = {" ".join(words)}
+
+    # without dosage-form words: "dolo 650 tablet" -> "dolo 650"
+    variants.add(" ".join(w for w in words if w not in FORM_WORDS))
+    # without parentheticals: "hemoglobin (hb)" -> "hemoglobin"
+    variants.add(re.sub(r"\(.*?\)", " ", name.lower()))
+    # brand alone: words before the first strength ("augmentin 625 duo" -> "augmentin")
+    brand = []
+    for w in words:
+        if any(ch.isdigit() for ch in w):
+            break
+        brand.append(w)
+    if brand and len(brand) < len(words):
+        variants.add(" ".join(brand))
+
+    folded = {fold(v) for v in variants}
+    return sorted(v for v in folded if len(v.replace(" ", "")) >= MIN_PATTERN_CHARS)
+
+
+# -------------------------
+# Multi-pattern matching
+# -------------------------
+class AhoCorasick:
+    """Pure-Python Aho–Corasick automaton: every pattern occurrence in one pass over the text."""
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = patterns
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+
+        for idx, pattern in enumerate(patterns):
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(idx)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Yield (end index, pattern index) for every occurrence."""
+        node = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for idx in out[node]:
+                yield i, idx
+
+
+class _PyAhoCorasick:
+    """Same interface as AhoCorasick, backed by pyahocorasick."""
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = patterns
+        self._automaton = ahocorasick.Automaton()
+        for idx, pattern in enumerate(patterns):
+            self._automaton.add_word(pattern, idx)
+        self._automaton.make_automaton()
+
+    def iter(self, text: str) -> Iterator[Tuple[int, int]]:
+        if not self.patterns:
+            return iter(())
+        return self._automaton.iter(text)
+
+
+def build_automaton(patterns: List[str]):
+    return _PyAhoCorasick(patterns) if ahocorasick is not None else AhoCorasick(patterns)
+
+
+# -------------------------
+# Index
+# -------------------------
+class NameIndex:
+    """
+    Lexical index of KB entry names, per category.
+
+    match() folds a document, runs it through the automaton once and
+    returns the point ids of the names found, leftmost-longest (so
+    "augmentin 625 duo" wins over "augmentin"), in document order.
+    """
+
+    def __init__(self, names: Dict[str, Dict[str, str]]):
+        self.automata = {}
+        self.targets: Dict[str, List[List[str]]] = {}
+        for cat, by_id in names.items():
+            ids_by_pattern: Dict[str, List[str]] = {}
+            for pid, name in sorted(by_id.items(), key=lambda kv: kv[1]):
+                for v in name_variants(name):
+                    ids = ids_by_pattern.setdefault(v, [])
+                    if len(ids) < MAX_IDS_PER_PATTERN:
+                        ids.append(pid)
+            # padded with spaces: matches only on whole words
+            patterns = sorted(ids_by_pattern)
+            self.automata[cat] = build_automaton([f" {p} " for p in patterns])
+            self.targets[cat] = [ids_by_pattern[p] for p in patterns]
+
+    def __len__(self) -> int:
+        return sum(len(t) for t in self.targets.values())
+
+    def match(self, text: str, category: str, limit: Optional[int] = None) -> List[str]:
+        automaton = self.automata.get(category)
+        if automaton is None:
+            return []
+
+        padded = f" {fold(text)} "
+        spans = []
+        for end, idx in automaton.iter(padded):
+            length = len(automaton.patterns[idx])
+            # inner span, without the padding spaces (neighbours may share them)
+            spans.append((end - length + 2, end, idx))
+        spans.sort(key=lambda s: (s[0], -(s[1] - s[0])))
+
+        ids, seen, last_end = [], set(), -1
+        for start, end, idx in spans:
+            if start < last_end:
+                continue  # inside a longer, earlier match
+            last_end = end
+            for pid in self.targets[category][idx]:
+                if pid not in seen:
+                    seen.add(pid)
+                    ids.append(pid)
+            if limit is not None and len(ids) >= limit:
+                return ids[:limit]
+        return ids
+
+
+def write_name_index(names: Dict[str, Dict[str, str]], path: str = NAME_INDEX_PATH):
+    """Persist {category: {point id: name}}; built at ingestion time."""
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": INDEX_FORMAT, "categories": names}, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def read_names(path: str = NAME_INDEX_PATH) -> Dict[str, Dict[str, str]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return data.get("categories", {}) if data.get("version") == INDEX_FORMAT else {}
+
+
+_index: Optional[NameIndex] = None
+_index_mtime = None
+_index_lock = threading.Lock()
+
+
+def get_name_index(path: str = NAME_INDEX_PATH) -> Optional[NameIndex]:
+    """The index built by the last ingestion run (None if there is none); rebuilt when the file changes."""
+    global _index, _index_mtime
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _index is not None and mtime == _index_mtime:
+        return _index
+
+    with _index_lock:
+        if _index is None or mtime != _index_mtime:
+            index = NameIndex(read_names(path))
+            log(f"[ name_index ] Loaded {len(index)} name patterns")
+            _index, _index_mtime = index, mtime
+        return _index
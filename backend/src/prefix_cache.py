@@ -0,0 +1,54 @@
+# prefix_cache.py
+import time
+from typing import Dict
+
+import numpy as np
+
+from utils.logger import log
+
+
+class PrefixCache:
+    """
+    Keeps the evaluated llama.cpp state of each fixed instruction prefix
+    (prompt_builder.PROMPT_PREFIXES) so a request only pays prompt
+    evaluation for the part that follows the prefix.
+
+    llama-cpp-python already skips the longest common token prefix with
+    whatever is currently in the KV cache, so restoring is only needed when
+    the previous request used a different template. Callers must hold the
+    lock that guards the Llama instance.
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.states: Dict[str, tuple] = {}  # name -> (prefix text, tokens, LlamaState)
+
+    def warm(self, prefixes: Dict[str, str]):
+        for name, text in prefixes.items():
+            if name in self.states and self.states[name][0] == text:
+                continue
+            start = time.perf_counter()
+            tokens = self.llm.tokenize(text.encode("utf-8"))
+            self.llm.reset()
+            self.llm.eval(tokens)
+            self.states[name] = (text, tokens, self.llm.save_state())
+            log(
+                f"[ prefix_cache ] '{name}' prefix: {len(tokens)} tokens "
+                f"evaluated in {time.perf_counter() - start:.2f}s"
+            )
+
+    def _kv_has(self, tokens) -> bool:
+        n = len(tokens)
+        if self.llm.n_tokens < n:
+            return False
+        return bool(np.array_equal(self.llm.input_ids[:n], np.asarray(tokens)))
+
+    def restore_for(self, prompt: str) -> bool:
+        """Load the saved state matching `prompt`'s prefix. Returns True on a cache hit."""
+        for text, tokens, state in self.states.values():
+            if not prompt.startswith(text):
+                continue
+            if not self._kv_has(tokens):
+                self.llm.load_state(state)
+            return True
+        return False
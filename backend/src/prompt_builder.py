@@ -2,15 +2,12 @@
 from typing import List, Dict
 
 # -------------------------
-# Prompt for General Q&A
+# Fixed instruction blocks
+# Every prompt starts with one of these, byte for byte, so llama.cpp can
+# reuse the evaluated KV state of the block (see src/prefix_cache.py).
+# Anything request-specific must go AFTER the prefix.
 # -------------------------
-def build_general_prompt(question: str, docs: List[Dict]) -> str:
-
-    context = ""
-    for d in docs:
-        context += f"- ({d['category']}) {d['name']}:\n{d['text']}\n\n"
-
-    prompt = f"""
+GENERAL_PREFIX = """
 You are an offline medical assistant.
 Answer ONLY using the information in the context.
 be particular about what is asked.
@@ -20,7 +17,111 @@ If the answer is not found in the context, say:
 "The context does not have enough information."
 
 ### CONTEXT:
-{context}
+"""
+
+REPORT_PREFIX = """
+You are an expert medical report analysis assistant.
+Use the PDF text AND retrieved medical knowledge to answer user question.
+Be accurate, avoid assumptions.
+
+### PDF EXTRACTED TEXT:
+"""
+
+PRESCRIPTION_PREFIX = """You are a prescription interpretation assistant.
+Use the prescription text + retrieved medicine knowledge.
+
+You must:
+- Identify medicines in the prescription.
+- Explain their uses.
+- Explain the dosage if present.
+- Warn the user to consult a doctor for any changes.
+- Do NOT infer dosage if not clearly written.
+
+### PRESCRIPTION PDF TEXT:
+"""
+
+SUMMARY_PREFIX = """You are a medical document summarization assistant.
+You will be given text extracted from multiple PDF files such as lab reports,
+prescriptions, and doctor's notes.
+
+Your task:
+- Provide a clean, organized medical summary.
+- Highlight key findings from each document.
+- Identify abnormal values in lab results.
+- Identify medicines and their uses in prescriptions.
+- Avoid guessing or adding extra information not present in the text.
+- Keep the summary short, structured, and medically useful.
+
+### EXTRACTED PDF TEXTS:
+"""
+
+# Map-reduce summarization (src/generator.py): one "map" prompt per document
+# chunk, then a "reduce" prompt over the per-document key points.
+DOC_SUMMARY_PREFIX = """You are a medical document summarization assistant.
+You will be given text extracted from one PDF file (or part of one), such as
+a lab report, a prescription, or a doctor's note.
+
+Your task:
+- List the key findings and diagnoses.
+- List abnormal lab values with their numbers and units.
+- List medicines with dose and frequency if written.
+- Avoid guessing or adding extra information not present in the text.
+- Use short bullet points only.
+
+### DOCUMENT TEXT:
+"""
+
+SUMMARY_REDUCE_PREFIX = """You are a medical document summarization assistant.
+You will be given key points already extracted from multiple PDF files such as
+lab reports, prescriptions, and doctor's notes.
+
+Your task:
+- Provide a clean, organized medical summary.
+- Highlight key findings from each document.
+- Identify abnormal values in lab results.
+- Identify medicines and their uses in prescriptions.
+- Avoid guessing or adding extra information not present in the key points.
+- Keep the summary short, structured, and medically useful.
+
+### KEY POINTS PER DOCUMENT:
+"""
+
+# intermediate reduce level, when the key points of all documents overflow one prompt
+SUMMARY_COMBINE_PREFIX = """You are a medical document summarization assistant.
+You will be given key points already extracted from several PDF files, each
+block starting with the file name in [brackets].
+
+Your task:
+- Condense the key points, keeping every [file name] header with its own points.
+- Keep abnormal lab values with their numbers and units.
+- Keep medicines with dose and frequency if written.
+- Drop repeated points; do not merge findings from different files.
+- Avoid guessing or adding extra information not present in the key points.
+- Use short bullet points only.
+
+### KEY POINTS PER DOCUMENT:
+"""
+
+PROMPT_PREFIXES = {
+    "general": GENERAL_PREFIX,
+    "report": REPORT_PREFIX,
+    "prescription": PRESCRIPTION_PREFIX,
+    "summary": SUMMARY_PREFIX,
+    "doc_summary": DOC_SUMMARY_PREFIX,
+    "summary_reduce": SUMMARY_REDUCE_PREFIX,
+    "summary_combine": SUMMARY_COMBINE_PREFIX,
+}
+
+# -------------------------
+# Prompt for General Q&A
+# -------------------------
+def build_general_prompt(question: str, docs: List[Dict]) -> str:
+
+    context = ""
+    for d in docs:
+        context += f"- ({d['category']}) {d['name']}:\n{d['text']}\n\n"
+
+    prompt = GENERAL_PREFIX + f"""{context}
 
 ### QUESTION:
 {question}
@@ -39,13 +140,7 @@ def build_report_prompt(question: str, pdf_text: str, docs: List[Dict]) -> str:
     for d in docs:
         retrieved_context += f"- ({d['category']}) {d['name']}:\n{d['text']}\n\n"
 
-    prompt = f"""
-You are an expert medical report analysis assistant.
-Use the PDF text AND retrieved medical knowledge to answer user question.
-Be accurate, avoid assumptions.
-
-### PDF EXTRACTED TEXT:
-{pdf_text}
+    prompt = REPORT_PREFIX + f"""{pdf_text}
 
 ### RETRIEVED CONTEXT:
 {retrieved_context}
@@ -62,19 +157,7 @@ def build_prescription_prompt(question: str, pdf_text: str, docs: List[Dict]) ->
     for d in docs:
         retrieved_context += f"- ({d['category']}) {d['name']}:\n{d['text']}\n\n"
 
-    prompt =  f"""
-You are a prescription interpretation assistant.
-Use the prescription text + retrieved medicine knowledge.
-
-You must:
-- Identify medicines in the prescription.
-- Explain their uses.
-- Explain the dosage if present.
-- Warn the user to consult a doctor for any changes.
-- Do NOT infer dosage if not clearly written.
-
-### PRESCRIPTION PDF TEXT:
-{pdf_text}
+    prompt = PRESCRIPTION_PREFIX + f"""{pdf_text}
 
 ### RELATED MEDICINE KNOWLEDGE:
 {retrieved_context}
@@ -83,7 +166,7 @@ You must:
 {question}
 
 ### INTERPRETATION:
-""".strip()
+""".rstrip()
     return prompt
 
 # -------------------------------------------------------------
@@ -94,23 +177,41 @@ def build_multi_pdf_summary_prompt(pdf_texts: str, question: str = None) -> str:
         f"\n### USER QUESTION:\n{question}\n" if question else ""
     )
 
-    return f"""
-You are a medical document summarization assistant.
-You will be given text extracted from multiple PDF files such as lab reports,
-prescriptions, and doctor's notes.
+    return SUMMARY_PREFIX + f"""{pdf_texts}
 
-Your task:
-- Provide a clean, organized medical summary.
-- Highlight key findings from each document.
-- Identify abnormal values in lab results.
-- Identify medicines and their uses in prescriptions.
-- Avoid guessing or adding extra information not present in the text.
-- Keep the summary short, structured, and medically useful.
+{question_part}
 
-### EXTRACTED PDF TEXTS:
-{pdf_texts}
+### SUMMARY:
+""".rstrip()
+
+
+# -------------------------------------------------------------
+# MAP-REDUCE SUMMARY PROMPTS
+# -------------------------------------------------------------
+def build_document_summary_prompt(doc_text: str) -> str:
+    # no file name in here: identical text gives an identical prompt, so its
+    # summary can be reused across uploads
+    return DOC_SUMMARY_PREFIX + f"""{doc_text}
+
+### KEY POINTS:
+"""
+
+
+def build_summary_combine_prompt(doc_summaries: str) -> str:
+    return SUMMARY_COMBINE_PREFIX + f"""{doc_summaries}
+
+### CONDENSED KEY POINTS:
+"""
+
+
+def build_summary_reduce_prompt(doc_summaries: str, question: str = None) -> str:
+    question_part = (
+        f"\n### USER QUESTION:\n{question}\n" if question else ""
+    )
+
+    return SUMMARY_REDUCE_PREFIX + f"""{doc_summaries}
 
 {question_part}
 
 ### SUMMARY:
-""".strip()
+""".rstrip()
@@ -0,0 +1,236 @@
+# prompt_packer.py
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.prompt_builder import (
+    build_document_summary_prompt,
+    build_general_prompt,
+    build_multi_pdf_summary_prompt,
+    build_prescription_prompt,
+    build_report_prompt,
+    build_summary_combine_prompt,
+    build_summary_reduce_prompt,
+)
+from utils.logger import log
+from utils.metrics import record_prompt_tokens, record_stage
+from utils.model_registry import LLM_N_CTX, registry
+
+# -------------------------
+# CONFIG
+# Every prompt must leave room for the answer inside the model context:
+#   prompt tokens <= LLM_N_CTX - LLM_MAX_TOKENS - PROMPT_SAFETY_TOKENS
+# -------------------------
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", 256))
+PROMPT_SAFETY_TOKENS = 16
+QUESTION_MAX_TOKENS = int(os.getenv("PROMPT_QUESTION_MAX_TOKENS", 128))
+# when the retrieved docs do not all fit, each one is still allowed this much
+# (more when its share of the docs budget is larger)
+DOC_MAX_TOKENS = int(os.getenv("PROMPT_DOC_MAX_TOKENS", 192))
+# when the PDF text alone would fill the prompt, retrieved docs still get this share
+DOCS_MIN_SHARE = float(os.getenv("PROMPT_DOCS_MIN_SHARE", 0.3))
+MIN_DOC_TOKENS = 32
+TRUNCATED = "\n[...]"
+
+
+class TokenCounter:
+    """Token counting / truncation with the LLM's own tokenizer (vocab only, no context)."""
+
+    def __init__(self, tokenizer_fn: Optional[Callable] = None):
+        self._tokenizer_fn = tokenizer_fn
+
+    @property
+    def llm(self):
+        return self._tokenizer_fn() if self._tokenizer_fn else registry.get("llm")
+
+    def tokens(self, text: str) -> List[int]:
+        return self.llm.tokenize(text.encode("utf-8"), add_bos=False)
+
+    def count(self, text: str) -> int:
+        return len(self.tokens(text)) if text else 0
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """`text` cut to at most max_tokens (marked with [...] when cut)."""
+        if max_tokens <= 0:
+            return ""
+        tokens = self.tokens(text)
+        if len(tokens) <= max_tokens:
+            return text
+        marker = self.count(TRUNCATED)
+        keep = max(max_tokens - marker, 0)
+        head = self.llm.detokenize(tokens[:keep]).decode("utf-8", errors="ignore")
+        return head.rstrip() + TRUNCATED
+
+
+class PromptStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds: Dict[str, Dict] = {}
+
+    def record(self, kind: str, tokens: int, trimmed: bool):
+        with self._lock:
+            s = self._kinds.setdefault(kind, {"prompts": 0, "tokens_total": 0, "tokens_max": 0, "trimmed": 0})
+            s["prompts"] += 1
+            s["tokens_total"] += tokens
+            s["tokens_max"] = max(s["tokens_max"], tokens)
+            s["trimmed"] += int(trimmed)
+
+    def info(self) -> Dict:
+        with self._lock:
+            return {
+                kind: {**s, "tokens_avg": round(s["tokens_total"] / s["prompts"], 1)}
+                for kind, s in self._kinds.items()
+            }
+
+
+class PromptPacker:
+    """
+    Fits a prompt into the context window.
+
+    The fixed parts (instruction prefix, section headers, question) are
+    measured first; what is left is shared between the PDF text and the
+    retrieved KB documents. Docs that fit the docs budget are kept whole;
+    otherwise each gets the larger of DOC_MAX_TOKENS and its share of what
+    is left, in rank order, and the lowest-ranked are dropped once the
+    budget is spent. The PDF text gets the rest and is cut at the end.
+    """
+
+    def __init__(self, counter: Optional[TokenCounter] = None, n_ctx: int = LLM_N_CTX,
+                 max_answer_tokens: int = LLM_MAX_TOKENS):
+        self.counter = counter or TokenCounter()
+        self.budget = n_ctx - max_answer_tokens - PROMPT_SAFETY_TOKENS
+        self.stats = PromptStats()
+
+    # ---- pieces ----
+    def _pack_docs(self, docs: List[Dict], budget: int) -> List[Dict]:
+        # header line "- (category) name:" costs a few tokens too
+        headers = [self.counter.count(f"- ({d['category']}) {d['name']}:\n") + 2 for d in docs]
+        sizes = [self.counter.count(d["text"]) for d in docs]
+        if sum(headers) + sum(sizes) <= budget:
+            return list(docs)
+
+        packed, left = [], budget
+        for i, d in enumerate(docs):
+            share = left // (len(docs) - i) - headers[i]
+            room = min(max(DOC_MAX_TOKENS, share), left - headers[i])
+            if room < min(MIN_DOC_TOKENS, sizes[i]):
+                break
+            text = self.counter.truncate(d["text"], room)
+            packed.append({**d, "text": text})
+            left -= headers[i] + self.counter.count(text)
+        return packed
+
+    def _docs_tokens(self, docs: List[Dict]) -> int:
+        return sum(self.counter.count(f"- ({d['category']}) {d['name']}:\n{d['text']}\n\n") for d in docs)
+
+    def _fit(self, kind: str, build: Callable[[str, List[Dict]], str], pdf_text: str,
+             docs: List[Dict]) -> Tuple[str, List[Dict]]:
+        start = time.perf_counter()
+        fixed = self.counter.count(build("", []))
+        available = max(self.budget - fixed, 0)
+
+        pdf_tokens = self.counter.count(pdf_text)
+        docs_budget = max(available - pdf_tokens, int(available * DOCS_MIN_SHARE)) if docs else 0
+        packed = self._pack_docs(docs, docs_budget)
+
+        pdf_budget = available - self._docs_tokens(packed)
+        packed_pdf = self.counter.truncate(pdf_text, pdf_budget) if pdf_tokens > pdf_budget else pdf_text
+
+        prompt = build(packed_pdf, packed)
+        total = self.counter.count(prompt)
+        # token boundaries between sections can add a few tokens; trim the PDF once more
+        if total > self.budget and packed_pdf:
+            packed_pdf = self.counter.truncate(packed_pdf, self.counter.count(packed_pdf) - (total - self.budget))
+            prompt = build(packed_pdf, packed)
+            total = self.counter.count(prompt)
+
+        trimmed = packed_pdf != pdf_text or len(packed) < len(docs) or any(
+            p["text"] != d["text"] for p, d in zip(packed, docs)
+        )
+        self.stats.record(kind, total, trimmed)
+        record_prompt_tokens(kind, total)
+        record_stage("prompt_pack", time.perf_counter() - start)
+        log(
+            f"[ prompt ] {kind}: {total} tokens (fixed {fixed}, pdf {self.counter.count(packed_pdf)}/{pdf_tokens}, "
+            f"docs {len(packed)}/{len(docs)}, budget {self.budget})"
+        )
+        return prompt, packed
+
+    def _question(self, question: Optional[str]) -> Optional[str]:
+        return self.counter.truncate(question, QUESTION_MAX_TOKENS) if question else question
+
+    # ---- one per prompt template ----
+    def general(self, question: str, docs: List[Dict]) -> Tuple[str, List[Dict]]:
+        question = self._question(question)
+        return self._fit("general", lambda _pdf, d: build_general_prompt(question, d), "", docs)
+
+    def report(self, question: str, pdf_text: str, docs: List[Dict]) -> Tuple[str, List[Dict]]:
+        question = self._question(question)
+        return self._fit("report", lambda pdf, d: build_report_prompt(question, pdf, d), pdf_text, docs)
+
+    def prescription(self, question: str, pdf_text: str, docs: List[Dict]) -> Tuple[str, List[Dict]]:
+        question = self._question(question)
+        return self._fit("prescription", lambda pdf, d: build_prescription_prompt(question, pdf, d), pdf_text, docs)
+
+    def summary(self, pdf_texts: str, question: Optional[str] = None) -> str:
+        question = self._question(question)
+        return self._fit("summary", lambda pdf, _d: build_multi_pdf_summary_prompt(pdf, question), pdf_texts, [])[0]
+
+    # ---- map-reduce summarization ----
+    def summary_fits(self, pdf_texts: str, question: Optional[str] = None) -> bool:
+        """True when the single-pass summary prompt needs no trimming."""
+        return self.counter.count(build_multi_pdf_summary_prompt(pdf_texts, self._question(question))) <= self.budget
+
+    def _room(self, build: Callable[[str], str]) -> int:
+        return max(self.budget - self.counter.count(build("")), MIN_DOC_TOKENS)
+
+    def split_for_map(self, text: str) -> List[str]:
+        """Cut a document into line-aligned chunks that each fit one map prompt."""
+        room = self._room(build_document_summary_prompt)
+        chunks, current, used = [], [], 0
+        for line in text.splitlines():
+            n = self.counter.count(line + "\n")
+            if n > room:
+                line, n = self.counter.truncate(line, room - 1), room
+            if current and used + n > room:
+                chunks.append("\n".join(current))
+                current, used = [], 0
+            current.append(line)
+            used += n
+        if current:
+            chunks.append("\n".join(current))
+        return [c for c in chunks if c.strip()]
+
+    def group_for_reduce(self, parts: List[str], question: Optional[str] = None) -> List[List[int]]:
+        """Consecutive groups of `parts` that each fit a reduce prompt (one group when all fit)."""
+        question = self._question(question)
+        room = self._room(lambda text: build_summary_reduce_prompt(text, question))
+        groups, current, used = [], [], 0
+        for i, part in enumerate(parts):
+            n = self.counter.count(part + "\n\n")
+            if current and used + n > room:
+                groups.append(current)
+                current, used = [], 0
+            current.append(i)
+            used += n
+        if current:
+            groups.append(current)
+        return groups
+
+    def doc_summary(self, text: str) -> str:
+        return self._fit("doc_summary", lambda pdf, _d: build_document_summary_prompt(pdf), text, [])[0]
+
+    def summary_combine(self, doc_summaries: str) -> str:
+        return self._fit(
+            "summary_combine", lambda pdf, _d: build_summary_combine_prompt(pdf), doc_summaries, []
+        )[0]
+
+    def summary_reduce(self, doc_summaries: str, question: Optional[str] = None) -> str:
+        question = self._question(question)
+        return self._fit(
+            "summary_reduce", lambda pdf, _d: build_summary_reduce_prompt(pdf, question), doc_summaries, []
+        )[0]
+
+
+packer = PromptPacker()
@@ -1,74 +1,244 @@
 # retriever.py
-import torch
-import numpy as np
-from typing import List, Dict, Optional
-from qdrant_client import QdrantClient
-from qdrant_client.models import Filter, FieldCondition, MatchValue
-from FlagEmbedding import BGEM3FlagModel
+import os
 
-QDRANT_PATH = "qdrant_local"
-COLLECTION_NAME = "medical_kb"
-TOP_K = 3
+import numpy as np
+from typing import List, Dict, Optional, Tuple
 
-# Load embedding model
-device = "cuda" if torch.cuda.is_available() else "cpu"
-use_fp16 = device == "cuda"
+from qdrant_client.models import QueryRequest
 
-bge_model = BGEM3FlagModel(
-    "BAAI/bge-small-en-v1.5",
-    device=device,
-    use_fp16=use_fp16
-)
+from src.embed_service import EmbeddingService
+from src.name_index import get_name_index
+from src.vector_index import leased_vector_index
+from utils.metrics import span
+from utils.model_registry import registry
+from utils.qdrant_layout import category_filter, search_params
 
-# Qdrant client
-client = QdrantClient(path=QDRANT_PATH)
+COLLECTION_NAME = "medical_kb"
+TOP_K = 3
+# KB entries taken from exact name matches in an uploaded document
+NAME_MATCH_MAX_DOCS = int(os.getenv("NAME_MATCH_MAX_DOCS", 8))
+# long documents: one query per line (or group of lines), merged under a doc budget
+MULTI_QUERY_MAX_QUERIES = int(os.getenv("MULTI_QUERY_MAX_QUERIES", 64))
+MULTI_QUERY_TOP_K = int(os.getenv("MULTI_QUERY_TOP_K", 2))
+MULTI_QUERY_MAX_DOCS = int(os.getenv("MULTI_QUERY_MAX_DOCS", 8))
+MIN_QUERY_LETTERS = 2   # "Hb 13.5" is a query, "12/03/2024" is not
+# "qdrant": query the collection   "numpy": exact search over the exported
+# memory-mapped index (src/vector_index.py), shareable by any number of workers
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "qdrant")
 
 
-# Embedding
-def embed(texts: List[str]) -> List[List[float]]:
-    out = bge_model.encode(texts, return_dense=True)
+# Embedding (BGE model and Qdrant client are shared through the registry)
+def _encode(texts: List[str]) -> np.ndarray:
+    with span("embed_batch"):
+        out = registry.get("bge").encode(texts, return_dense=True)
     vecs = out["dense_vecs"] if isinstance(out, dict) else out
 
     vecs = np.array(vecs, dtype=np.float32)
     norms = np.linalg.norm(vecs, axis=1, keepdims=True)
     norms[norms == 0] = 1.0
 
-    return (vecs / norms).tolist()
+    return vecs / norms
+
+
+# Shared by all request threads: caches query vectors and batches
+# concurrent cache misses into one encode() call.
+embed_service = EmbeddingService(_encode)
+
+
+def encode_queries(texts: List[str]) -> List[List[float]]:
+    """
+    All texts in one encode() call, skipping the query cache and the
+    micro-batcher: for bulk jobs that already hold the whole batch.
+    """
+    if not texts:
+        return []
+    with span("embed"):
+        return _encode(texts).tolist()
+
+
+def embed(texts: List[str]) -> List[List[float]]:
+    # includes cache lookups and the micro-batching wait; embed_batch is the model alone
+    with span("embed"):
+        return embed_service.embed(texts)
 
 
 # NEW: category-based retrieval
 def retrieve(query: str, top_k: int = TOP_K, category: Optional[str] = None) -> List[Dict]:
+    return retrieve_with_vector(query, top_k, category)[1]
+
+
+def retrieve_with_vector(query: str, top_k: int = TOP_K, category: Optional[str] = None) -> Tuple[List[float], List[Dict]]:
+    """Same as retrieve(), but also returns the normalized query vector."""
     vec = embed([query])[0]
+    return vec, search_vectors([vec], top_k, category)[0]
+
+
+def retrieve_many(queries: List[str], top_k: int = TOP_K, category: Optional[str] = None) -> List[List[Dict]]:
+    """retrieve() for several queries: one embedding batch, one search call."""
+    if not queries:
+        return []
+    return search_vectors(embed(queries), top_k, category)
+
+
+def _to_result(p) -> Dict:
+    return {
+        "id": str(p.id),
+        "score": p.score,
+        "text": p.payload.get("text", ""),
+        "category": p.payload.get("category", ""),
+        "name": p.payload.get("name", "")
+    }
+
 
+def search_vectors(vecs: List[List[float]], top_k: int = TOP_K, category: Optional[str] = None) -> List[List[Dict]]:
+    """Nearest KB entries for each normalized vector, on the configured backend."""
+    if RETRIEVAL_BACKEND == "numpy":
+        with span("numpy_search"), leased_vector_index() as index:
+            return index.search(vecs, top_k, category)
+    with span("qdrant_query"):
+        return _qdrant_search(vecs, top_k, [category] * len(vecs))
+
+
+def search_vectors_each(vecs: List[List[float]], categories: List[Optional[str]],
+                        top_k: int = TOP_K) -> List[List[Dict]]:
+    """search_vectors() with a category per vector (None = all), still one search call."""
+    if RETRIEVAL_BACKEND == "numpy":
+        results: List[List[Dict]] = [[] for _ in vecs]
+        with span("numpy_search"), leased_vector_index() as index:
+            for category in set(categories):
+                rows = [i for i, c in enumerate(categories) if c == category]
+                for i, hits in zip(rows, index.search([vecs[i] for i in rows], top_k, category)):
+                    results[i] = hits
+        return results
+    with span("qdrant_query"):
+        return _qdrant_search(vecs, top_k, categories)
+
+
+def _qdrant_search(vecs: List[List[float]], top_k: int, categories: List[Optional[str]]) -> List[List[Dict]]:
     # ----------------------
-    # Category filter
+    # Category filter (keyword-indexed payload field)
     # ----------------------
-    qdrant_filter = None
-    if category:
-        qdrant_filter = Filter(
-            must=[
-                FieldCondition(
-                    key="category",
-                    match=MatchValue(value=category)
-                )
-            ]
+    client = registry.get("qdrant")
+    if len(vecs) == 1:
+        resp = client.query_points(
+            collection_name=COLLECTION_NAME,
+            query=vecs[0],
+            limit=top_k,
+            with_payload=True,
+            query_filter=category_filter(categories[0]),
+            search_params=search_params(),
+        )
+        return [[_to_result(p) for p in resp.points]]
+
+    requests = [
+        QueryRequest(
+            query=vec,
+            limit=top_k,
+            with_payload=True,
+            filter=category_filter(category),
+            params=search_params(),
         )
+        for vec, category in zip(vecs, categories)
+    ]
+    responses = client.query_batch_points(collection_name=COLLECTION_NAME, requests=requests)
+    return [[_to_result(p) for p in resp.points] for resp in responses]
+
+
+def fetch_points(ids: List[str]) -> List[Dict]:
+    """KB entries by point id, in the order given (score 1.0: exact match)."""
+    if not ids:
+        return []
+    if RETRIEVAL_BACKEND == "numpy":
+        with leased_vector_index() as index:
+            found = index.fetch(ids)
+    else:
+        with span("qdrant_fetch"):
+            points = registry.get("qdrant").retrieve(
+                collection_name=COLLECTION_NAME, ids=ids, with_payload=True, with_vectors=False
+            )
+        by_id = {str(p.id): p for p in points}
+        found = [
+            {
+                "id": pid,
+                "text": by_id[pid].payload.get("text", ""),
+                "category": by_id[pid].payload.get("category", ""),
+                "name": by_id[pid].payload.get("name", ""),
+            }
+            for pid in ids if pid in by_id
+        ]
+    return [{**d, "score": 1.0} for d in found]
+
+
+def retrieve_by_name(text: str, category: str, limit: int = NAME_MATCH_MAX_DOCS) -> List[Dict]:
+    """KB entries of `category` whose names appear in `text` (see src/name_index.py)."""
+    index = get_name_index()
+    if index is None:
+        return []
+    with span("name_match"):
+        ids = index.match(text, category, limit=limit)
+    return fetch_points(ids)
+
+
+def split_queries(text: str, max_queries: int = MULTI_QUERY_MAX_QUERIES) -> List[str]:
+    """
+    Line-sized queries for a long document: one per distinct line with
+    some letters in it (a lab parameter, a prescription item), grouped
+    into consecutive runs when there are more than max_queries lines.
+    """
+    lines, seen = [], set()
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        key = line.lower()
+        if sum(ch.isalpha() for ch in line) < MIN_QUERY_LETTERS or key in seen:
+            continue
+        seen.add(key)
+        lines.append(line)
+
+    if len(lines) <= max_queries:
+        return lines
+    per_query = -(-len(lines) // max_queries)
+    return ["\n".join(lines[i:i + per_query]) for i in range(0, len(lines), per_query)]
+
+
+def merge_hits(hit_lists: List[List[Dict]], max_docs: int) -> List[Dict]:
+    """Union of several result lists: best score per point, highest first, at most max_docs."""
+    best: Dict[str, Dict] = {}
+    for hits in hit_lists:
+        for d in hits:
+            if d["id"] not in best or d["score"] > best[d["id"]]["score"]:
+                best[d["id"]] = d
+    return sorted(best.values(), key=lambda d: d["score"], reverse=True)[:max_docs]
+
+
+def retrieve_multi(text: str, category: Optional[str] = None, top_k: int = MULTI_QUERY_TOP_K,
+                   max_docs: int = MULTI_QUERY_MAX_DOCS) -> List[Dict]:
+    """
+    Dense retrieval that covers a whole document: one batched embedding
+    call for all its line queries, one batched search, merged hits.
+    """
+    queries = split_queries(text)
+    if len(queries) <= 1:
+        return retrieve(text, max(top_k, TOP_K), category)
+    return merge_hits(retrieve_many(queries, top_k, category), max_docs)
+
+
+def _unnamed_lines(text: str, category: str) -> str:
+    """The lines of `text` in which the name index finds no KB name."""
+    index = get_name_index()
+    if index is None:
+        return text
+    return "\n".join(line for line in text.splitlines() if not index.match(line, category, limit=1))
+
 
-    resp = client.query_points(
-        collection_name=COLLECTION_NAME,
-        query=vec,
-        limit=top_k,
-        with_payload=True,
-        query_filter=qdrant_filter  # 👈 apply filter here!
-    )
-
-    results = []
-    for p in resp.points:
-        results.append({
-            "score": p.score,
-            "text": p.payload.get("text", ""),
-            "category": p.payload.get("category", ""),
-            "name": p.payload.get("name", "")
-        })
-
-    return results
+def retrieve_for_document(text: str, category: str, max_docs: int = MULTI_QUERY_MAX_DOCS) -> List[Dict]:
+    """
+    Context for an uploaded document: the KB entries it names verbatim
+    (score 1.0, so they rank first) merged with multi-query dense search,
+    at most max_docs in total. Dense search covers every line no name
+    match explains, so a false-positive name match cannot crowd out the
+    semantic context of the rest of the document.
+    """
+    named = retrieve_by_name(text, category)
+    rest = _unnamed_lines(text, category) if named else text
+    dense = retrieve_multi(rest, category, max_docs=max_docs) if rest.strip() else []
+    return merge_hits([named, dense], max_docs)
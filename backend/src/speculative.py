@@ -0,0 +1,79 @@
+# speculative.py
+import os
+from contextlib import contextmanager
+from typing import Optional
+
+from utils.metrics import record_draft_tokens
+
+# -------------------------
+# CONFIG
+# Prompt-lookup decoding: draft tokens are the continuation of the latest
+# n-gram that already occurred in the prompt, verified by the model in one
+# batch. No second model, and at temperature 0 the output is unchanged.
+# Worth it where answers copy from the prompt (lab values, drug names).
+# -------------------------
+# endpoints that decode speculatively: general, lab, prescription, summary, batch.
+# Opt-in: listing any endpoint loads the model with logits_all, which slows
+# prompt evaluation for every endpoint (see bench/speculative.py)
+SPECULATIVE_ENDPOINTS = {e.strip() for e in os.getenv("SPECULATIVE_ENDPOINTS", "").split(",") if e.strip()}
+LLM_DRAFT_TOKENS = int(os.getenv("LLM_DRAFT_TOKENS", 10))    # tokens proposed per step
+LLM_DRAFT_NGRAM = int(os.getenv("LLM_DRAFT_NGRAM", 2))       # longest n-gram looked up
+
+
+def is_speculative(endpoint: str) -> bool:
+    return endpoint in SPECULATIVE_ENDPOINTS
+
+
+class DraftStats:
+    """What one generation drafted; `accepted` follows from how many tokens each step produced."""
+
+    def __init__(self):
+        self.steps = 0
+        self.drafted = 0
+
+    def accepted(self, generated: int) -> int:
+        # every verification step yields its accepted drafts + one sampled token;
+        # the first token comes from prompt evaluation
+        return max(min(generated - 1 - self.steps, self.drafted), 0)
+
+    def record(self, generated: int):
+        record_draft_tokens(self.drafted, self.accepted(generated))
+
+
+def _counting_draft_model(stats: DraftStats):
+    from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+    class CountingPromptLookup(LlamaPromptLookupDecoding):
+        def __call__(self, input_ids, **kwargs):
+            draft = super().__call__(input_ids, **kwargs)
+            stats.steps += 1
+            stats.drafted += len(draft)
+            return draft
+
+    return CountingPromptLookup(max_ngram_size=LLM_DRAFT_NGRAM, num_pred_tokens=LLM_DRAFT_TOKENS)
+
+
+def _verifies_drafts(llm) -> bool:
+    # draft verification reads the logits of every drafted position; only a
+    # context created with logits_all keeps them (see model_registry.load_llama)
+    params = getattr(llm, "context_params", None)
+    return params is not None and bool(params.logits_all)
+
+
+@contextmanager
+def speculative_decoding(llm, enabled: bool):
+    """
+    Attach a prompt-lookup draft model to `llm` (a llama_cpp.Llama) for the
+    duration of one generation; yields its DraftStats, or None when off.
+    The caller must hold the lock that guards `llm`.
+    """
+    if not enabled or not _verifies_drafts(llm):
+        yield None
+        return
+    previous: Optional[object] = getattr(llm, "draft_model", None)
+    stats = DraftStats()
+    llm.draft_model = _counting_draft_model(stats)
+    try:
+        yield stats
+    finally:
+        llm.draft_model = previous
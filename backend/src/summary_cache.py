@@ -0,0 +1,75 @@
+# summary_cache.py
+import hashlib
+import os
+import threading
+from typing import Dict, Optional
+
+from utils.disk_cache import DiskCache
+from utils.model_registry import LLM_MODEL_PATH
+
+# -------------------------
+# CONFIG
+# -------------------------
+# off by default: entries are summaries of patient documents kept on disk
+SUMMARY_CACHE_ENABLED = os.getenv("SUMMARY_CACHE", "0") == "1"
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", "cache/summary_cache.sqlite")
+SUMMARY_CACHE_MAX_BYTES = int(os.getenv("SUMMARY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# entries older than this are dropped (0 = keep until evicted for space)
+SUMMARY_CACHE_TTL_S = float(os.getenv("SUMMARY_CACHE_TTL_S", 24 * 3600))
+
+
+class SummaryCache:
+    """
+    Per-document (per-chunk) summaries of the map-reduce summarizer, keyed
+    by a hash of the map prompt, the model and the generation settings.
+    A document uploaded again, in any packet, is not summarized twice.
+    """
+
+    def __init__(self, path: str = SUMMARY_CACHE_PATH, max_bytes: int = SUMMARY_CACHE_MAX_BYTES,
+                 ttl_s: float = SUMMARY_CACHE_TTL_S):
+        self.store = DiskCache(path, max_bytes, ttl_s=ttl_s)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def key(prompt: str, max_tokens: int) -> str:
+        h = hashlib.sha256()
+        h.update(f"{os.path.basename(LLM_MODEL_PATH)}|{max_tokens}|".encode("utf-8"))
+        h.update(prompt.encode("utf-8"))
+        return "map:" + h.hexdigest()
+
+    def get(self, prompt: str, max_tokens: int) -> Optional[str]:
+        raw = self.store.get(self.key(prompt, max_tokens))
+        with self._lock:
+            self.stats["hits" if raw is not None else "misses"] += 1
+        return raw.decode("utf-8") if raw is not None else None
+
+    def set(self, prompt: str, max_tokens: int, summary: str):
+        self.store.set(self.key(prompt, max_tokens), summary.encode("utf-8"))
+
+    def info(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["entries"] = len(self.store)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_summary_cache() -> Optional[SummaryCache]:
+    """The process-wide cache, opened on first use (None when disabled)."""
+    global _cache
+    if not SUMMARY_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SummaryCache()
+    return _cache
+
+
+def open_summary_cache() -> Optional[SummaryCache]:
+    """The process-wide cache if something has opened it already (never opens it)."""
+    return _cache
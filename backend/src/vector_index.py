@@ -0,0 +1,306 @@
+# vector_index.py
+import json
+import mmap
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from utils.logger import log
+
+# -------------------------
+# CONFIG
+# -------------------------
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "cache/vector_index")
+# float16 halves the mapped size; scores are computed in float32 either way
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float32")
+# rows converted to float32 at a time when the index is stored as float16
+VECTOR_INDEX_BLOCK_ROWS = 16384
+# exported versions kept on disk (older ones may still be mapped by a worker)
+VECTOR_INDEX_KEEP = 2
+
+CURRENT_FILE = "CURRENT"
+PAYLOAD_FIELDS = ("id", "text", "category", "name")
+
+# Layout of one exported version, VECTOR_INDEX_DIR/<version>/:
+#   vectors.npy    (rows, dim) normalized vectors, rows grouped by category
+#   payloads.jsonl one JSON object per row ({id, text, category, name})
+#   offsets.npy    (rows + 1,) byte offsets of each row in payloads.jsonl
+#   meta.json      {version, rows, dim, dtype, categories: {cat: [start, end]}}
+# CURRENT names the live version and is replaced atomically, so workers
+# never see a half-written index.
+
+
+# -------------------------
+# Export (from Qdrant)
+# -------------------------
+def build_index(points: Iterable, version: str, root: str = VECTOR_INDEX_DIR,
+                dtype: str = VECTOR_INDEX_DTYPE) -> str:
+    """
+    Write `points` (objects with .id, .vector, .payload) as a new index
+    version and make it current. Returns the version directory.
+    """
+    by_category: Dict[str, list] = {}
+    dim = None
+    for p in points:
+        payload = p.payload or {}
+        vec = np.asarray(p.vector, dtype=np.float32)
+        dim = dim or vec.shape[0]
+        by_category.setdefault(payload.get("category", ""), []).append((str(p.id), vec, payload))
+
+    rows = sum(len(v) for v in by_category.values())
+    dim = dim or 0
+    out_dir = os.path.join(root, version)
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    vectors = np.lib.format.open_memmap(
+        os.path.join(tmp_dir, "vectors.npy"), mode="w+", dtype=np.dtype(dtype), shape=(rows, dim)
+    )
+    offsets = np.zeros(rows + 1, dtype=np.int64)
+    categories = {}
+
+    row = 0
+    with open(os.path.join(tmp_dir, "payloads.jsonl"), "wb") as f:
+        for cat in sorted(by_category):
+            start = row
+            for pid, vec, payload in by_category[cat]:
+                norm = np.linalg.norm(vec) or 1.0
+                vectors[row] = vec / norm
+                record = {"id": pid, **{k: payload.get(k, "") for k in PAYLOAD_FIELDS[1:]}}
+                f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+                offsets[row + 1] = f.tell()
+                row += 1
+            categories[cat] = [start, row]
+    vectors.flush()
+    del vectors
+    np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": version, "rows": rows, "dim": dim, "dtype": dtype, "categories": categories}, f)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    _set_current(root, version)
+    _prune(root, keep=VECTOR_INDEX_KEEP)
+    return out_dir
+
+
+def _set_current(root: str, version: str):
+    tmp = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+
+
+def _prune(root: str, keep: int):
+    versions = [
+        d for d in os.listdir(root)
+        if os.path.isdir(os.path.join(root, d)) and not d.endswith(".tmp")
+    ]
+    versions.sort(key=lambda d: os.path.getmtime(os.path.join(root, d)), reverse=True)
+    for d in versions[keep:]:
+        # workers that still map it keep their pages until they reload
+        shutil.rmtree(os.path.join(root, d), ignore_errors=True)
+
+
+def export_from_qdrant(version: str, root: str = VECTOR_INDEX_DIR) -> str:
+    from utils.embedding import scroll_points
+
+    start = time.perf_counter()
+    points = scroll_points(list(PAYLOAD_FIELDS[1:]), with_vectors=True)
+    out_dir = build_index(points, version, root)
+    log(f"[ vector_index ] Exported {out_dir} in {time.perf_counter() - start:.1f}s")
+    return out_dir
+
+
+def refresh_if_present(version: str, root: str = VECTOR_INDEX_DIR) -> Optional[str]:
+    """Re-export after ingestion, but only where an index has been built before."""
+    if _current_version(root) is None:
+        return None
+    return export_from_qdrant(version, root)
+
+
+# -------------------------
+# Search
+# -------------------------
+class VectorIndex:
+    """
+    Exact cosine search over a memory-mapped vector matrix.
+
+    The matrix and the payload store are mapped read-only, so every worker
+    process on the machine shares one copy through the page cache. Once
+    retired (a newer version was mapped), the maps are closed as soon as
+    the last search holding it is done.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.path = path
+        self.version = meta["version"]
+        self.rows = meta["rows"]
+        self.dim = meta["dim"]
+        self.categories = {k: tuple(v) for k, v in meta["categories"].items()}
+
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self._rows_by_id = None
+        self._payload_file = open(os.path.join(path, "payloads.jsonl"), "rb")
+        self._payloads = (
+            mmap.mmap(self._payload_file.fileno(), 0, access=mmap.ACCESS_READ) if self.rows else b""
+        )
+        self._lock = threading.Lock()
+        self._users = 0
+        self._retired = False
+
+    def _range(self, category: Optional[str]):
+        if not category:
+            return 0, self.rows
+        return self.categories.get(category, (0, 0))
+
+    def _scores(self, queries: np.ndarray, start: int, end: int) -> np.ndarray:
+        block = self.vectors[start:end]
+        if block.dtype == np.float32:
+            return queries @ block.T
+        # float16 storage: convert one block at a time (numpy has no fp16 BLAS)
+        out = np.empty((queries.shape[0], end - start), dtype=np.float32)
+        for i in range(0, end - start, VECTOR_INDEX_BLOCK_ROWS):
+            part = np.asarray(block[i:i + VECTOR_INDEX_BLOCK_ROWS], dtype=np.float32)
+            out[:, i:i + part.shape[0]] = queries @ part.T
+        return out
+
+    def fetch(self, ids: Sequence[str]) -> List[Dict]:
+        """Payloads of the given point ids (unknown ids are skipped), in the order asked."""
+        if self._rows_by_id is None:
+            self._rows_by_id = {self.payload(r)["id"]: r for r in range(self.rows)}
+        return [self.payload(self._rows_by_id[pid]) for pid in ids if pid in self._rows_by_id]
+
+    def payload(self, row: int) -> Dict:
+        raw = self._payloads[int(self.offsets[row]):int(self.offsets[row + 1])]
+        return json.loads(raw)
+
+    def search(self, queries: Sequence[Sequence[float]], top_k: int, category: Optional[str] = None) -> List[List[Dict]]:
+        """
+        Top-k rows for each query (normalized vectors), best first. One
+        matrix multiply for the whole batch.
+        """
+        start, end = self._range(category)
+        n = end - start
+        q = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        if n == 0 or top_k <= 0:
+            return [[] for _ in range(q.shape[0])]
+
+        scores = self._scores(q, start, end)
+        k = min(top_k, n)
+        if k < n:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(n), (q.shape[0], 1))
+
+        results = []
+        for qi in range(q.shape[0]):
+            cand = top[qi]
+            order = cand[np.argsort(-scores[qi, cand], kind="stable")]
+            results.append([
+                {**self.payload(start + int(j)), "score": float(scores[qi, j])}
+                for j in order
+            ])
+        return results
+
+    # ---- lifetime ----
+    def acquire(self) -> bool:
+        """Hold the maps open until release(); False once the index is retired."""
+        with self._lock:
+            if self._retired:
+                return False
+            self._users += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            done = self._retired and self._users == 0
+        if done:
+            self.close()
+
+    def retire(self):
+        """Close now, or when the last holder releases it."""
+        with self._lock:
+            self._retired = True
+            done = self._users == 0
+        if done:
+            self.close()
+
+    def close(self):
+        if self.rows:
+            self._payloads.close()
+        self._payload_file.close()
+        self.vectors = self.offsets = None
+        self._rows_by_id = None
+
+
+_index: Optional[VectorIndex] = None
+_index_lock = threading.Lock()
+_checked = {"at": 0.0, "current": None}
+
+
+def _current_version(root: str) -> Optional[str]:
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def get_vector_index(root: str = VECTOR_INDEX_DIR) -> VectorIndex:
+    """
+    The live index, (re)mapped when ingestion publishes a new version.
+    CURRENT is re-read at most once a second.
+    """
+    global _index
+    now = time.monotonic()
+    if _index is not None and now - _checked["at"] < 1.0:
+        return _index
+
+    with _index_lock:
+        _checked["at"] = now
+        version = _current_version(root)
+        if version is None:
+            if _index is None:
+                raise FileNotFoundError(
+                    f"No vector index in {root}; build one with `python -m src.vector_index`"
+                )
+            return _index
+        if _index is None or _index.version != version:
+            log(f"[ vector_index ] Mapping version {version}")
+            previous, _index = _index, VectorIndex(os.path.join(root, version))
+            if previous is not None:
+                # searches still holding it (leased_vector_index) close it when they finish
+                previous.retire()
+        return _index
+
+
+@contextmanager
+def leased_vector_index(root: str = VECTOR_INDEX_DIR) -> Iterator[VectorIndex]:
+    """The live index, kept open for the whole block even if a newer version is mapped meanwhile."""
+    index = get_vector_index(root)
+    while not index.acquire():
+        # retired between the lookup and the acquire: the new one is already live
+        index = get_vector_index(root)
+    try:
+        yield index
+    finally:
+        index.release()
+
+
+if __name__ == "__main__":
+    # python -m src.vector_index  -> export the Qdrant collection as a new index version
+    from utils.kb_version import read_kb_version
+
+    export_from_qdrant(read_kb_version() or str(int(time.time())))
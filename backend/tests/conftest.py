@@ -0,0 +1,6 @@
+# conftest.py
+import os
+import sys
+
+# the backend modules import each other as src.* / utils.*, relative to backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,120 @@
+# test_disk_cache.py
+import sqlite3
+import time
+
+import pytest
+
+from utils.disk_cache import DiskCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    c = DiskCache(str(tmp_path / "cache.sqlite"), max_bytes=1000)
+    yield c
+    c.close()
+
+
+def stored_size(cache: DiskCache) -> int:
+    return cache._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+
+def test_get_set_delete(cache):
+    assert cache.get("a") is None
+    cache.set("a", b"xyz")
+    assert cache.get("a") == b"xyz"
+    cache.delete("a")
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_total_follows_insert_update_delete(cache):
+    cache.set("a", b"x" * 100)
+    cache.set("b", b"x" * 50)
+    cache.set("a", b"x" * 10)  # overwrite with a smaller value
+    assert cache.total_bytes() == stored_size(cache) == 60
+    cache.delete("b")
+    assert cache.total_bytes() == stored_size(cache) == 10
+    cache.clear()
+    assert cache.total_bytes() == 0
+
+
+def test_eviction_drops_least_recently_accessed_below_90_percent(cache):
+    for i in range(9):
+        cache.set(f"k{i}", bytes(100))
+        time.sleep(0.002)
+    cache.get("k0")  # k0 is now the most recently used
+    cache.set("k9", bytes(300))
+
+    assert cache.total_bytes() == stored_size(cache) <= 900
+    assert cache.get("k0") is not None
+    assert cache.get("k9") is not None
+    assert cache.get("k1") is None
+    assert cache.get("k2") is None
+
+
+def test_no_eviction_at_the_limit(cache):
+    for i in range(10):
+        cache.set(f"k{i}", bytes(100))
+    assert len(cache) == 10
+    assert cache.total_bytes() == 1000
+
+
+def test_expired_entries_are_not_returned(tmp_path):
+    cache = DiskCache(str(tmp_path / "ttl.sqlite"), ttl_s=60)
+    cache.set("old", b"1")
+    cache.set("new", b"2")
+    cache._conn.execute("UPDATE entries SET created = created - 120 WHERE key = 'old'")
+
+    assert cache.get("old") is None
+    assert [key for key, _, _ in cache.recent(10)] == ["new"]
+    assert cache.get("new") == b"2"
+    cache.close()
+
+
+def test_expired_entries_are_deleted_on_write(tmp_path):
+    cache = DiskCache(str(tmp_path / "ttl.sqlite"), ttl_s=60)
+    cache.set("old", b"x" * 10)
+    cache._conn.execute("UPDATE entries SET created = created - 120")
+    cache.set("new", b"y")
+    assert len(cache) == 1
+    assert cache.total_bytes() == 1
+    cache.close()
+
+
+def test_total_shared_between_connections(tmp_path):
+    path = str(tmp_path / "shared.sqlite")
+    a, b = DiskCache(path), DiskCache(path)
+    a.set("k", b"x" * 40)
+    b.set("j", b"x" * 2)
+    assert a.total_bytes() == b.total_bytes() == 42
+    a.close()
+    b.close()
+
+
+def test_old_cache_file_is_summed_once(tmp_path):
+    path = str(tmp_path / "old.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+        "created REAL NOT NULL, accessed REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO entries VALUES ('a', x'00', 7, 0, 0)")
+    conn.commit()
+    conn.close()
+
+    cache = DiskCache(path)
+    assert cache.total_bytes() == 7
+    cache.set("b", b"12")
+    assert cache.total_bytes() == 9
+    cache.close()
+    assert DiskCache(path).total_bytes() == 9
+
+
+def test_reset_if_meta_changed(cache):
+    assert cache.reset_if_meta_changed("kb", "v1")
+    cache.set("a", b"1")
+    assert not cache.reset_if_meta_changed("kb", "v1")
+    assert cache.get("a") == b"1"
+    assert cache.reset_if_meta_changed("kb", "v2")
+    assert len(cache) == 0
+    assert cache.total_bytes() == 0
@@ -0,0 +1,64 @@
+# test_name_index.py
+from src.name_index import AhoCorasick, NameIndex, fold, name_variants
+
+
+def test_fold_merges_ocr_lookalikes_and_case():
+    assert fold("Dolo 650") == fold("DOLO 65O")
+    assert fold("Augmentin") == fold("Augrnentin")
+    assert fold("Hemoglobin") == fold("Hemog1obin")
+
+
+def test_fold_collapses_repeats_and_punctuation():
+    assert fold("Pan-40,  Tablet") == "pan 4o tablet"
+    assert fold("Teelmma") == fold("Telma")
+    assert fold("") == ""
+    assert fold(None) == ""
+
+
+def test_name_variants_drop_form_words_parentheticals_and_strength():
+    assert fold("dolo 650") in name_variants("Dolo 650 Tablet")
+    assert fold("hemoglobin") in name_variants("Hemoglobin (Hb)")
+    assert fold("augmentin") in name_variants("Augmentin 625 Duo Tablet")
+
+
+def test_name_variants_skip_short_patterns():
+    # "hb" alone would match all over a document
+    assert name_variants("Hb") == []
+    assert name_variants("K (Potassium)") == [fold("k potassium")]
+
+
+def test_aho_corasick_reports_every_occurrence():
+    automaton = AhoCorasick(["he", "she", "his", "hers"])
+    found = sorted((end, automaton.patterns[idx]) for end, idx in automaton.iter("ushers"))
+    assert found == [(3, "he"), (3, "she"), (5, "hers")]
+
+
+def _index():
+    return NameIndex({
+        "medicine": {
+            "1": "Augmentin 625 Duo Tablet",
+            "2": "Augmentin 375 Tablet",
+            "3": "Dolo 650 Tablet",
+        },
+    })
+
+
+def test_match_prefers_leftmost_longest():
+    # the full name wins over the brand-alone variant it contains
+    assert _index().match("Tab Augmentin 625 Duo 1-0-1", "medicine") == ["1"]
+
+
+def test_match_brand_alone_maps_to_its_products():
+    assert sorted(_index().match("continue augmentin for 5 days", "medicine")) == ["1", "2"]
+
+
+def test_match_whole_words_in_document_order():
+    index = _index()
+    assert index.match("Dolo 650 then Augmentin 625 Duo", "medicine") == ["3", "1"]
+    assert index.match("dolo6500", "medicine") == []
+
+
+def test_match_limit_and_unknown_category():
+    index = _index()
+    assert index.match("Dolo 650 then Augmentin 625 Duo", "medicine", limit=1) == ["3"]
+    assert index.match("Dolo 650", "lab_test") == []
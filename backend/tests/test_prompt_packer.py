@@ -0,0 +1,87 @@
+# test_prompt_packer.py
+import pytest
+
+from bench.stubs import StubLLM
+from src.prompt_packer import DOC_MAX_TOKENS, TRUNCATED, PromptPacker, TokenCounter
+
+N_CTX = 1024
+ANSWER_TOKENS = 128
+
+
+@pytest.fixture
+def packer():
+    llm = StubLLM()  # one token per word
+    return PromptPacker(TokenCounter(lambda: llm), n_ctx=N_CTX, max_answer_tokens=ANSWER_TOKENS)
+
+
+def words(n: int, tag: str = "w") -> str:
+    return " ".join(f"{tag}{i}" for i in range(n))
+
+
+def docs(sizes, tag: str = "d"):
+    return [
+        {"category": "lab_test", "name": f"{tag} {i}", "text": words(n, f"{tag}{i}x")}
+        for i, n in enumerate(sizes)
+    ]
+
+
+def test_budget_leaves_room_for_the_answer(packer):
+    assert packer.budget < N_CTX - ANSWER_TOKENS
+
+
+@pytest.mark.parametrize("pdf_words", [0, 50, 400, 5000])
+@pytest.mark.parametrize("doc_sizes", [[], [20, 20], [300, 300, 300], [40] * 30, [2000]])
+def test_report_prompt_never_exceeds_budget(packer, pdf_words, doc_sizes):
+    prompt, packed = packer.report("what is abnormal?", words(pdf_words, "p"), docs(doc_sizes))
+    assert packer.counter.count(prompt) <= packer.budget
+    assert len(packed) <= len(doc_sizes)
+
+
+def test_docs_that_fit_are_kept_whole(packer):
+    retrieved = docs([30, 30, 30])
+    prompt, packed = packer.report("q", words(100, "p"), retrieved)
+    assert packed == retrieved
+    assert words(100, "p") in prompt
+
+
+def test_docs_are_cut_and_dropped_in_rank_order(packer):
+    retrieved = docs([400] * 6)
+    _, packed = packer.general("q", retrieved)
+    assert 0 < len(packed) < len(retrieved)
+    # only the lowest-ranked docs are dropped
+    assert [d["name"] for d in packed] == [d["name"] for d in retrieved[: len(packed)]]
+    for d in packed:
+        assert d["text"].endswith(TRUNCATED)
+        assert packer.counter.count(d["text"]) <= max(DOC_MAX_TOKENS, packer.budget // len(retrieved))
+
+
+def test_long_pdf_still_leaves_a_share_for_docs(packer):
+    pdf = words(5000, "p")
+    prompt, packed = packer.report("q", pdf, docs([100, 100]))
+    assert packed
+    assert TRUNCATED in prompt
+    assert pdf not in prompt
+
+
+def test_short_docs_are_not_dropped_for_being_under_the_minimum(packer):
+    # a tiny doc after a large one still goes in whole
+    retrieved = docs([2000, 5])
+    _, packed = packer.general("q", retrieved)
+    assert [d["name"] for d in packed] == ["d 0", "d 1"]
+    assert packed[1]["text"] == retrieved[1]["text"]
+
+
+def test_summary_prompts_fit(packer):
+    text = words(3000, "s")
+    assert not packer.summary_fits(text)
+    for prompt in (packer.summary(text), packer.doc_summary(text), packer.summary_combine(text),
+                   packer.summary_reduce(text, "anything urgent?")):
+        assert packer.counter.count(prompt) <= packer.budget
+
+
+def test_split_for_map_chunks_fit_a_map_prompt(packer):
+    text = "\n".join(words(30, f"l{i}x") for i in range(100))
+    chunks = packer.split_for_map(text)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert packer.doc_summary(chunk).count(TRUNCATED) == 0
@@ -0,0 +1,154 @@
+# test_vector_index.py
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from src import vector_index
+from src.vector_index import VectorIndex, build_index, get_vector_index, leased_vector_index
+
+DIM = 16
+CATEGORIES = ["medicine", "lab_test", "disease"]
+
+
+def make_points(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return [
+        SimpleNamespace(
+            id=f"p{i}",
+            vector=rng.normal(size=DIM).astype(np.float32),
+            payload={"category": CATEGORIES[i % len(CATEGORIES)], "name": f"name {i}", "text": f"text {i}"},
+        )
+        for i in range(n)
+    ]
+
+
+def normalized(points):
+    vecs = np.stack([p.vector for p in points])
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def open_index(tmp_path, points, dtype="float32", version="v1"):
+    return VectorIndex(build_index(points, version, root=str(tmp_path), dtype=dtype))
+
+
+@pytest.fixture(autouse=True)
+def fresh_live_index(monkeypatch):
+    monkeypatch.setattr(vector_index, "_index", None)
+    monkeypatch.setattr(vector_index, "_checked", {"at": 0.0, "current": None})
+
+
+def test_rows_are_grouped_by_category(tmp_path):
+    points = make_points(30)
+    index = open_index(tmp_path, points)
+    assert index.rows == 30
+    assert sorted(index.categories) == sorted(CATEGORIES)
+
+    covered = []
+    for cat, (start, end) in index.categories.items():
+        assert {index.payload(r)["category"] for r in range(start, end)} == {cat}
+        covered.extend(range(start, end))
+    assert sorted(covered) == list(range(30))
+    index.close()
+
+
+@pytest.mark.parametrize("category", [None, "lab_test"])
+def test_search_matches_brute_force(tmp_path, category):
+    points = make_points(60)
+    index = open_index(tmp_path, points)
+    vecs = normalized(points)
+    query = vecs[7] + 0.1 * vecs[8]
+    query /= np.linalg.norm(query)
+
+    candidates = [i for i, p in enumerate(points) if category is None or p.payload["category"] == category]
+    scores = vecs[candidates] @ query
+    expected = [points[candidates[i]].id for i in np.argsort(-scores)[:5]]
+
+    hits = index.search([query.tolist()], top_k=5, category=category)[0]
+    assert [h["id"] for h in hits] == expected
+    assert [h["score"] for h in hits] == sorted((h["score"] for h in hits), reverse=True)
+    assert np.allclose([h["score"] for h in hits], np.sort(scores)[::-1][:5], atol=1e-5)
+    index.close()
+
+
+def test_float16_ranks_like_float32(tmp_path, monkeypatch):
+    points = make_points(50)
+    full = open_index(tmp_path / "f32", points)
+    monkeypatch.setattr(vector_index, "VECTOR_INDEX_BLOCK_ROWS", 7)  # several conversion blocks
+    half = open_index(tmp_path / "f16", points, dtype="float16")
+    assert half.vectors.dtype == np.float16
+
+    query = normalized(points)[3]
+    a = full.search([query], top_k=10)[0]
+    b = half.search([query], top_k=10)[0]
+    assert [h["id"] for h in a][:3] == [h["id"] for h in b][:3]
+    assert np.allclose([h["score"] for h in a], [h["score"] for h in b], atol=1e-2)
+    full.close()
+    half.close()
+
+
+def test_batched_queries_match_single_queries(tmp_path):
+    points = make_points(40)
+    index = open_index(tmp_path, points)
+    queries = normalized(points)[:4]
+    batched = index.search(queries, top_k=3, category="medicine")
+    single = [index.search([q], top_k=3, category="medicine")[0] for q in queries]
+    assert len(batched) == 4
+    for b, s in zip(batched, single):
+        assert [h["id"] for h in b] == [h["id"] for h in s]
+        assert np.allclose([h["score"] for h in b], [h["score"] for h in s], atol=1e-6)
+    index.close()
+
+
+def test_search_edge_cases(tmp_path):
+    points = make_points(9)
+    index = open_index(tmp_path, points)
+    query = normalized(points)[0]
+    assert len(index.search([query], top_k=100, category="medicine")[0]) == 3
+    assert index.search([query, query], top_k=3, category="unknown") == [[], []]
+    assert index.search([query], top_k=0) == [[]]
+    index.close()
+
+
+def test_fetch_in_requested_order(tmp_path):
+    index = open_index(tmp_path, make_points(12))
+    found = index.fetch(["p5", "missing", "p0"])
+    assert [d["id"] for d in found] == ["p5", "p0"]
+    assert found[0] == {"id": "p5", "text": "text 5", "category": "disease", "name": "name 5"}
+    index.close()
+
+
+def test_get_vector_index_follows_current(tmp_path):
+    root = str(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        get_vector_index(root)
+
+    build_index(make_points(6), "v1", root=root)
+    first = get_vector_index(root)
+    assert first.version == "v1"
+    assert get_vector_index(root) is first
+
+    build_index(make_points(8, seed=1), "v2", root=root)
+    vector_index._checked["at"] = 0.0  # skip the once-a-second check
+    second = get_vector_index(root)
+    assert second.version == "v2"
+    assert second.rows == 8
+    # the replaced index is closed once nothing holds it
+    assert first._payload_file.closed
+    second.close()
+
+
+def test_leased_index_stays_open_until_released(tmp_path):
+    root = str(tmp_path)
+    build_index(make_points(6), "v1", root=root)
+    with leased_vector_index(root) as old:
+        build_index(make_points(6, seed=1), "v2", root=root)
+        vector_index._checked["at"] = 0.0
+        assert get_vector_index(root).version == "v2"
+        assert not old._payload_file.closed
+        assert old.fetch(["p1"])[0]["id"] == "p1"
+    assert old._payload_file.closed
+
+    with leased_vector_index(root) as current:
+        assert current.version == "v2"
+    current.close()
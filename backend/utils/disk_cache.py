@@ -0,0 +1,183 @@
+# disk_cache.py
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterator, Optional, Tuple
+
+
+class DiskCache:
+    """
+    Small size-bounded key/value store on top of SQLite.
+
+    - Values are raw bytes; callers choose the serialization.
+    - Safe to share between threads and between worker processes
+      (WAL journal + busy timeout).
+    - When the total stored size exceeds max_bytes, the least recently
+      accessed entries are evicted until it drops below 90% of the limit.
+    - With ttl_s > 0, entries older than ttl_s seconds are never returned
+      and are deleted on the next write.
+    - The total size is kept in a one-row table by triggers, so a write
+      costs the same however large the cache is, and every process sees
+      the same total.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, ttl_s: float = 0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries(created)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._create_totals()
+
+    def _create_totals(self):
+        # one transaction: a cache file from before the triggers existed is
+        # summed once, and no write can slip in between the sum and the triggers
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO totals (id, bytes) SELECT 0, COALESCE(SUM(size), 0) FROM entries"
+            )
+            for name, event, delta in (
+                ("entries_size_insert", "INSERT", "NEW.size"),
+                ("entries_size_delete", "DELETE", "-OLD.size"),
+                ("entries_size_update", "UPDATE OF size", "NEW.size - OLD.size"),
+            ):
+                self._conn.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON entries "
+                    f"BEGIN UPDATE totals SET bytes = bytes + {delta} WHERE id = 0; END"
+                )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    # -------------------------
+    # Entries
+    # -------------------------
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if self.ttl_s and row[1] < now - self.ttl_s:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: bytes):
+        now = time.time()
+        with self._lock:
+            # an upsert, not INSERT OR REPLACE: REPLACE's implicit delete skips the size triggers
+            self._conn.execute(
+                "INSERT INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                "created = excluded.created, accessed = excluded.accessed",
+                (key, value, len(value), now, now),
+            )
+            self._evict()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+
+    def recent(self, limit: int) -> Iterator[Tuple[str, bytes, float]]:
+        """Yield (key, value, created) for the most recently accessed entries."""
+        with self._lock:
+            oldest = time.time() - self.ttl_s if self.ttl_s else 0
+            rows = self._conn.execute(
+                "SELECT key, value, created FROM entries WHERE created >= ? ORDER BY accessed DESC LIMIT ?",
+                (oldest, limit),
+            ).fetchall()
+        yield from rows
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._total()
+
+    def _total(self) -> int:
+        return self._conn.execute("SELECT bytes FROM totals WHERE id = 0").fetchone()[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def _evict(self):
+        if self.ttl_s:
+            self._conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl_s,))
+        total = self._total()
+        if total <= self.max_bytes:
+            return
+
+        target = int(self.max_bytes * 0.9)
+        # oldest first, read lazily: only as many rows as need to go
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC")
+        doomed = []
+        for key, size in rows:
+            if total <= target:
+                break
+            doomed.append((key,))
+            total -= size
+        rows.close()
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+
+    # -------------------------
+    # Meta (e.g. KB version stamps)
+    # -------------------------
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def reset_if_meta_changed(self, key: str, value: str) -> bool:
+        """Atomically clear all entries if meta[key] != value. Returns True if cleared."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+                changed = row is None or row[0] != value
+                if changed:
+                    self._conn.execute("DELETE FROM entries")
+                    self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return changed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
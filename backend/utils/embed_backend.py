@@ -0,0 +1,269 @@
+# embed_backend.py
+import os
+import sys
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from utils.logger import log
+
+# -------------------------
+# CONFIG
+# -------------------------
+# "torch": FlagEmbedding / PyTorch (reference)   "onnx": ONNX Runtime on CPU
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+EMBED_MAX_LENGTH = int(os.getenv("EMBED_MAX_LENGTH", 512))
+# padded tokens per forward pass (batch size x longest text in the batch)
+EMBED_TOKEN_BUDGET = int(os.getenv("EMBED_TOKEN_BUDGET", 16384))
+EMBED_MAX_BATCH_ITEMS = int(os.getenv("EMBED_MAX_BATCH_ITEMS", 256))
+EMBED_ONNX_DIR = os.getenv("EMBED_ONNX_DIR", "../models/bge-small-onnx")
+EMBED_ONNX_INT8 = os.getenv("EMBED_ONNX_INT8", "1") == "1"
+EMBED_ONNX_THREADS = int(os.getenv("EMBED_ONNX_THREADS", 0))  # 0 = onnxruntime default
+# mean cosine vs. the reference model below which `check` fails
+EMBED_AGREEMENT_MIN = float(os.getenv("EMBED_AGREEMENT_MIN", 0.99))
+
+
+def token_budget_batches(lengths: Sequence[int], budget: int = EMBED_TOKEN_BUDGET,
+                         max_items: int = EMBED_MAX_BATCH_ITEMS) -> List[List[int]]:
+    """
+    Group text indices into batches of similar length.
+
+    Indices are sorted by token length, then cut whenever adding the next
+    text would push (items x longest length) past `budget`, so short
+    texts are never padded up to a long one and every forward pass costs
+    about the same.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches, current = [], []
+    for i in order:
+        longest = max(lengths[i], 1)  # sorted: the newcomer is the longest
+        if current and ((len(current) + 1) * longest > budget or len(current) >= max_items):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _normalize(vecs: np.ndarray) -> np.ndarray:
+    vecs = np.asarray(vecs, dtype=np.float32)
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vecs / norms
+
+
+class EmbeddingBackend:
+    """
+    Dense BGE embeddings with length-bucketed batching.
+
+    encode() keeps the FlagEmbedding call shape used across the codebase
+    (`encode(texts, return_dense=True)` -> {"dense_vecs": ...}), so it can
+    be registered as the "bge" model. Vectors are L2-normalized and come
+    back in input order.
+    """
+
+    name = "base"
+
+    def __init__(self, tokenizer, max_length: int = EMBED_MAX_LENGTH,
+                 token_budget: int = EMBED_TOKEN_BUDGET, max_items: int = EMBED_MAX_BATCH_ITEMS):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.token_budget = token_budget
+        self.max_items = max_items
+
+    def token_lengths(self, texts: List[str]) -> List[int]:
+        enc = self.tokenizer(texts, truncation=True, max_length=self.max_length, add_special_tokens=True)
+        return [len(ids) for ids in enc["input_ids"]]
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def encode(self, texts, return_dense: bool = True, **kwargs) -> Dict[str, np.ndarray]:
+        if isinstance(texts, str):
+            texts = [texts]
+        out = np.zeros((len(texts), 0), dtype=np.float32)
+        if texts:
+            batches = token_budget_batches(self.token_lengths(texts), self.token_budget, self.max_items)
+            for idx in batches:
+                vecs = self._encode_batch([texts[i] for i in idx])
+                if out.shape[1] == 0:
+                    out = np.zeros((len(texts), vecs.shape[1]), dtype=np.float32)
+                out[idx] = vecs
+        return {"dense_vecs": _normalize(out)}
+
+
+class TorchBGEBackend(EmbeddingBackend):
+    """The reference: FlagEmbedding's BGEM3FlagModel, fed one length bucket at a time."""
+
+    name = "torch"
+
+    def __init__(self, model_name: str, **kwargs):
+        import torch
+        from FlagEmbedding import BGEM3FlagModel
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model = BGEM3FlagModel(
+            model_name,
+            device=device,
+            use_fp16=device == "cuda"
+        )
+        super().__init__(self.model.tokenizer, **kwargs)
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        out = self.model.encode(texts, batch_size=len(texts), max_length=self.max_length, return_dense=True)
+        return np.asarray(out["dense_vecs"] if isinstance(out, dict) else out, dtype=np.float32)
+
+
+class OnnxBGEBackend(EmbeddingBackend):
+    """
+    BGE exported to ONNX (optionally int8-quantized) on ONNX Runtime's CPU
+    provider. CLS pooling, like the reference dense output.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_dir: str = EMBED_ONNX_DIR, int8: bool = EMBED_ONNX_INT8,
+                 threads: int = EMBED_ONNX_THREADS, **kwargs):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        path = os.path.join(model_dir, "model_int8.onnx" if int8 else "model.onnx")
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"{path} not found; create it with `python -m utils.embed_backend export`"
+            )
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.name = "onnx-int8" if int8 else "onnx"
+        super().__init__(AutoTokenizer.from_pretrained(model_dir), **kwargs)
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        enc = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+        feed = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+        last_hidden = self.session.run(None, feed)[0]
+        return last_hidden[:, 0]
+
+
+def backend_id(kind: str = EMBED_BACKEND) -> str:
+    """Identifies which model/runtime produced a vector; part of each KB point's content hash."""
+    from utils.model_registry import BGE_MODEL_NAME
+
+    if kind == "onnx":
+        return f"onnx{'-int8' if EMBED_ONNX_INT8 else ''}:{BGE_MODEL_NAME}"
+    return f"{kind}:{BGE_MODEL_NAME}"
+
+
+def load_backend(kind: str = EMBED_BACKEND):
+    from utils.model_registry import BGE_MODEL_NAME
+
+    if kind == "torch":
+        return TorchBGEBackend(BGE_MODEL_NAME)
+    if kind == "onnx":
+        return OnnxBGEBackend()
+    raise ValueError(f"Unknown EMBED_BACKEND '{kind}' (expected 'torch' or 'onnx')")
+
+
+# -------------------------
+# Export + agreement check
+# -------------------------
+def export_onnx(model_name: str, out_dir: str = EMBED_ONNX_DIR, int8: bool = True):
+    """Export the BGE encoder to ONNX (+ a dynamically int8-quantized copy)."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(out_dir)
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    names = list(sample.keys())
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    with torch.inference_mode():
+        torch.onnx.export(
+            model,
+            tuple(sample[n] for n in names),
+            fp32_path,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={**{n: {0: "batch", 1: "seq"} for n in names},
+                          "last_hidden_state": {0: "batch", 1: "seq"}},
+            opset_version=17,
+        )
+    log(f"[ embed ] Exported {fp32_path}")
+
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = os.path.join(out_dir, "model_int8.onnx")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        log(f"[ embed ] Quantized {int8_path}")
+
+
+def agreement_report(texts: List[str], reference: EmbeddingBackend, candidate: EmbeddingBackend) -> Dict:
+    """Per-text cosine between two backends' vectors (both are normalized)."""
+    import time
+
+    start = time.perf_counter()
+    ref = reference.encode(texts)["dense_vecs"]
+    ref_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cand = candidate.encode(texts)["dense_vecs"]
+    cand_s = time.perf_counter() - start
+
+    cos = (ref * cand).sum(axis=1)
+    return {
+        "texts": len(texts),
+        "reference": reference.name,
+        "candidate": candidate.name,
+        "cosine_mean": round(float(cos.mean()), 5),
+        "cosine_min": round(float(cos.min()), 5),
+        "cosine_p05": round(float(np.percentile(cos, 5)), 5),
+        "reference_texts_per_s": round(len(texts) / ref_s, 1) if ref_s else 0.0,
+        "candidate_texts_per_s": round(len(texts) / cand_s, 1) if cand_s else 0.0,
+    }
+
+
+def _sample_kb_texts(limit: int) -> List[str]:
+    # the first rows of every ingestion source: realistic lengths and vocabulary
+    from utils.ingest_kb import INGEST_CHUNK_ROWS, READERS, SOURCES, build_documents
+
+    texts = []
+    per_source = max(limit // len(SOURCES), 1)
+    for source in SOURCES:
+        if not os.path.exists(source["path"]):
+            continue
+        for df in READERS[source["reader"]](source["path"], min(per_source, INGEST_CHUNK_ROWS)):
+            texts.extend(build_documents(df, source)[0][:per_source])
+            break
+    return texts
+
+
+if __name__ == "__main__":
+    # python -m utils.embed_backend export       -> write EMBED_ONNX_DIR
+    # python -m utils.embed_backend check [N]    -> compare onnx vs torch on N KB texts
+    import json
+
+    from utils.model_registry import BGE_MODEL_NAME
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if cmd == "export":
+        export_onnx(BGE_MODEL_NAME)
+    elif cmd == "check":
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+        texts = _sample_kb_texts(n)
+        if not texts:
+            sys.exit("No KB source files found to sample from.")
+        report = agreement_report(texts, TorchBGEBackend(BGE_MODEL_NAME), OnnxBGEBackend())
+        print(json.dumps(report, indent=2))
+        if report["cosine_mean"] < EMBED_AGREEMENT_MIN:
+            sys.exit(f"Mean cosine {report['cosine_mean']} is below EMBED_AGREEMENT_MIN={EMBED_AGREEMENT_MIN}")
+    else:
+        sys.exit(f"Unknown command '{cmd}' (expected 'export' or 'check')")
@@ -2,15 +2,14 @@
 import os
 import uuid
 import warnings
-from typing import List, Dict, Set, Tuple
+from typing import List, Dict
 
 import numpy as np
-import torch
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+from qdrant_client.models import PointStruct, PointIdsList
 
-# Replace with your real FlagEmbedding import
-from FlagEmbedding import BGEM3FlagModel
+from utils.metrics import span
+from utils.model_registry import registry
+from utils.qdrant_layout import create_collection, ensure_payload_indexes
 
 # Optional: suppress local-mode warning noise (remove if you want to see it)
 warnings.filterwarnings("ignore", message="Local mode is not recommended*")
@@ -18,42 +17,30 @@ warnings.filterwarnings("ignore", message="Local mode is not recommended*")
 # -------------------------
 # CONFIG
 # -------------------------
-QDRANT_PATH = os.getenv("QDRANT_PATH", "qdrant_local")
 COLLECTION_NAME = os.getenv("QDRANT_COLLECTION", "medical_kb")
 EMBEDDING_DIM = 384
 BATCH_SIZE = int(os.getenv("EMBED_BATCH", 256))
 
 # -------------------------
-# GPU / model loading
+# Models
+# The BGE model and the Qdrant client come from the shared registry, so a
+# process that both retrieves and ingests holds a single copy of each.
 # -------------------------
-device = "cuda" if torch.cuda.is_available() else "cpu"
-use_fp16 = True if device == "cuda" else False
-print(f"[ embeddings ] Loading BGE-small on {device} (fp16={use_fp16}) ...")
-
-# instantiate your embedding model (FlagEmbedding wrapper)
-bge_model = BGEM3FlagModel(
-    "BAAI/bge-small-en-v1.5",
-    device=device,
-    use_fp16=use_fp16
-)
-
-# -------------------------
-# Qdrant client
-# -------------------------
-client = QdrantClient(path=QDRANT_PATH)
+def _client():
+    return registry.get("qdrant")
 
 
 def ensure_collection():
     """Ensure the qdrant collection exists (create if missing)."""
     try:
-        client.get_collection(COLLECTION_NAME)
+        _client().get_collection(COLLECTION_NAME)
         print(f"[ embeddings ] Collection '{COLLECTION_NAME}' exists.")
     except Exception:
         print(f"[ embeddings ] Creating collection '{COLLECTION_NAME}' ...")
-        client.recreate_collection(
-            collection_name=COLLECTION_NAME,
-            vectors_config=VectorParams(size=EMBEDDING_DIM, distance=Distance.COSINE),
-        )
+        # HNSW / quantization / on-disk payload settings: see utils/qdrant_layout.py
+        create_collection(_client(), COLLECTION_NAME, EMBEDDING_DIM)
+        return
+    ensure_payload_indexes(_client(), COLLECTION_NAME)
 
 
 # -------------------------
@@ -72,47 +59,34 @@ def make_uuid(text: str) -> str:
 # -------------------------
 # Load existing entries from Qdrant (category + name)
 # -------------------------
-def load_existing_entries() -> Set[Tuple[str, str]]:
-    """
-    Returns a set of (category, name) tuples already present in the collection.
-    Uses payload fields 'category' and 'name' (case-insensitive).
-    This works even if IDs were random UUIDs previously.
-    """
-    print("[ embeddings ] Loading existing entries from Qdrant...")
-    existing = set()
-
-    # scroll returns (points, next_page) where points have .payload
-    scroll = client.scroll(
-        collection_name=COLLECTION_NAME,
-        limit=1000,
-        with_vectors=False,
-        with_payload=True,
-    )
-
-    points, next_page = scroll
-
-    while points:
-        for p in points:
-            payload = p.payload or {}
-            cat = payload.get("category") or payload.get("Category") or ""
-            name = payload.get("name") or payload.get("Name") or ""
-            if cat and name:
-                existing.add((cat.strip().lower(), name.strip().lower()))
-
-        if not next_page:
+def scroll_points(payload_fields: List[str], batch: int = 1000, with_vectors: bool = False):
+    """Yield every point of the collection with just `payload_fields` (and vectors if asked)."""
+    offset = None
+    while True:
+        points, offset = _client().scroll(
+            collection_name=COLLECTION_NAME,
+            limit=batch,
+            with_vectors=with_vectors,
+            with_payload=payload_fields,
+            offset=offset,
+        )
+        yield from points
+        if not offset:
             break
 
-        points, next_page = client.scroll(
+
+def count_points() -> int:
+    return _client().count(collection_name=COLLECTION_NAME, exact=True).count
+
+
+def delete_points(ids: List[str], batch: int = 1000):
+    for i in range(0, len(ids), batch):
+        _client().delete(
             collection_name=COLLECTION_NAME,
-            limit=1000,
-            with_vectors=False,
-            with_payload=True,
-            offset=next_page,
+            points_selector=PointIdsList(points=ids[i:i + batch]),
+            wait=True,
         )
 
-    print(f"[ embeddings ] Found {len(existing)} existing rows (category,name).")
-    return existing
-
 
 # -------------------------
 # Embedding function
@@ -120,10 +94,11 @@ def load_existing_entries() -> Set[Tuple[str, str]]:
 def embed_texts(texts: List[str]) -> List[List[float]]:
     """
     Returns normalized dense vectors (list of lists).
-    Uses the loaded bge_model; supports GPU if available.
+    Uses the shared BGE model; supports GPU if available.
     """
     # model wrapper returns dense vectors (some wrappers return dict)
-    out = bge_model.encode(texts, return_dense=True)
+    with span("embed_batch"):
+        out = registry.get("bge").encode(texts, return_dense=True)
     vectors = out["dense_vecs"] if isinstance(out, dict) else out
 
     vectors = np.array(vectors, dtype=np.float32)
@@ -136,21 +111,17 @@ def embed_texts(texts: List[str]) -> List[List[float]]:
 # -------------------------
 # Add KB chunks (skip existing by (category,name))
 # -------------------------
-def add_kb_chunks(texts: List[str], metas: List[Dict], existing_entries: Set[Tuple[str, str]]):
+def prepare_items(texts: List[str], metas: List[Dict]) -> List[Dict]:
     """
-    Insert embeddings + payload into Qdrant while skipping rows already in existing_entries.
-    Meta must include: 'category' and 'name' fields (string).
+    Pair texts with their metas, making sure every meta has a valid UUID id
+    (which rows are new is decided by the ingestion manifest, not here).
+    Returns [{"text": ..., "meta": ...}, ...].
     """
-
     items = []
     for text, meta in zip(texts, metas):
         cat = (meta.get("category") or "").strip().lower()
         name = (meta.get("name") or "").strip().lower()
 
-        if (cat, name) in existing_entries:
-            # skip already present
-            continue
-
         # ensure meta.id is a valid UUID (if not present we create deterministic one)
         mid = meta.get("id")
         if not mid:
@@ -164,7 +135,32 @@ def add_kb_chunks(texts: List[str], metas: List[Dict], existing_entries: Set[Tup
                 meta["id"] = make_uuid(f"{cat}-{name}")
 
         items.append({"text": text, "meta": meta})
+    return items
+
+
+def build_points(items: List[Dict], vectors: List[List[float]]) -> List[PointStruct]:
+    return [
+        PointStruct(
+            id=it["meta"]["id"],
+            vector=vec,
+            payload={**it["meta"], "text": it["text"]},
+        )
+        for it, vec in zip(items, vectors)
+    ]
+
+
+def upsert_points(points: List[PointStruct], wait: bool = True):
+    _client().upsert(collection_name=COLLECTION_NAME, points=points, wait=wait)
+
 
+def add_kb_chunks(texts: List[str], metas: List[Dict]):
+    """
+    Insert embeddings + payload into Qdrant (upsert by id).
+    Meta must include: 'category' and 'name' fields (string).
+    Serial version; bulk ingestion goes through utils/ingest_pipeline.py.
+    """
+
+    items = prepare_items(texts, metas)
     if not items:
         print("[ embeddings ] No new items to insert — skipping.")
         return
@@ -172,20 +168,6 @@ def add_kb_chunks(texts: List[str], metas: List[Dict], existing_entries: Set[Tup
     # batch upsert
     for i in range(0, len(items), BATCH_SIZE):
         batch = items[i : i + BATCH_SIZE]
-        batch_texts = [it["text"] for it in batch]
-        batch_meta = [it["meta"] for it in batch]
-
-        vectors = embed_texts(batch_texts)
-
-        points = [
-            PointStruct(
-                id=meta["id"],
-                vector=vec,
-                payload={**meta, "text": text},
-            )
-            for vec, meta, text in zip(vectors, batch_meta, batch_texts)
-        ]
-
-        client.upsert(collection_name=COLLECTION_NAME, points=points)
+        vectors = embed_texts([it["text"] for it in batch])
+        upsert_points(build_points(batch, vectors))
         print(f"[ embeddings ] Inserted batch {i} → {i + len(batch)}")
-
@@ -0,0 +1,126 @@
+# extract_cache.py
+import hashlib
+import os
+import threading
+from typing import Dict, Optional
+
+from utils.disk_cache import DiskCache
+
+# -------------------------
+# CONFIG
+# -------------------------
+# off by default: entries are patient report text kept on disk
+EXTRACT_CACHE_ENABLED = os.getenv("EXTRACT_CACHE", "0") == "1"
+EXTRACT_CACHE_PATH = os.getenv("EXTRACT_CACHE_PATH", "cache/extract_cache.sqlite")
+EXTRACT_CACHE_MAX_BYTES = int(os.getenv("EXTRACT_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+# entries older than this are dropped (0 = keep until evicted for space)
+EXTRACT_CACHE_TTL_S = float(os.getenv("EXTRACT_CACHE_TTL_S", 24 * 3600))
+# bump when the extraction / OCR pipeline changes output, so old entries stop matching
+EXTRACT_CACHE_VERSION = "2"
+
+
+def document_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def extraction_settings() -> str:
+    """Every setting besides the PDF itself that shapes extracted text; part of each key."""
+    from utils.handwriting import TROCR_MAX_NEW_TOKENS, TROCR_NUM_BEAMS
+    from utils.model_registry import TROCR_INT8, TROCR_MODEL_NAME
+    from utils.pdf_reader import OCR_DPI, TESSERACT_CONFIG
+
+    return (
+        f"dpi={OCR_DPI}|tesseract={TESSERACT_CONFIG}|trocr={TROCR_MODEL_NAME}|int8={TROCR_INT8}"
+        f"|beams={TROCR_NUM_BEAMS}|max_new_tokens={TROCR_MAX_NEW_TOKENS}"
+    )
+
+
+def page_hash(pdf, page_index: int) -> str:
+    """
+    Fingerprint of what a page draws: its content stream plus the raw bytes
+    of every image it references. Identical scanned pages in different
+    documents get the same hash.
+    """
+    page = pdf.load_page(page_index)
+    h = hashlib.sha256()
+    h.update(f"{page.rect}|{page.rotation}".encode("utf-8"))
+    h.update(page.read_contents() or b"")
+    for img in page.get_images(full=True):
+        h.update(pdf.xref_stream_raw(img[0]) or b"")
+    return h.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache of extracted PDF text, shared by all workers
+    through one SQLite file.
+    - doc:<sha256 of PDF bytes>  -> text of the whole document
+    - page:<page fingerprint>    -> OCR text of one scanned page
+    Keys are prefixed with the cache version and a digest of the OCR
+    settings, so changing the engine, DPI or TrOCR model misses cleanly.
+    """
+
+    def __init__(
+        self,
+        path: str = EXTRACT_CACHE_PATH,
+        max_bytes: int = EXTRACT_CACHE_MAX_BYTES,
+        ttl_s: float = EXTRACT_CACHE_TTL_S,
+        settings: Optional[str] = None,
+    ):
+        self.store = DiskCache(path, max_bytes, ttl_s=ttl_s)
+        settings = extraction_settings() if settings is None else settings
+        self.prefix = f"v{EXTRACT_CACHE_VERSION}:{hashlib.sha256(settings.encode('utf-8')).hexdigest()[:16]}"
+        self._lock = threading.Lock()
+        self.stats = {"doc_hits": 0, "doc_misses": 0, "page_hits": 0, "page_misses": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _get(self, kind: str, digest: str) -> Optional[str]:
+        raw = self.store.get(f"{self.prefix}:{kind}:{digest}")
+        self._count(f"{kind}_hits" if raw is not None else f"{kind}_misses")
+        return raw.decode("utf-8") if raw is not None else None
+
+    def _set(self, kind: str, digest: str, text: str):
+        self.store.set(f"{self.prefix}:{kind}:{digest}", (text or "").encode("utf-8"))
+
+    def get_document(self, digest: str) -> Optional[str]:
+        return self._get("doc", digest)
+
+    def set_document(self, digest: str, text: str):
+        self._set("doc", digest, text)
+
+    def get_page(self, digest: str) -> Optional[str]:
+        return self._get("page", digest)
+
+    def set_page(self, digest: str, text: str):
+        self._set("page", digest, text)
+
+    def info(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["entries"] = len(self.store)
+        stats["bytes"] = self.store.total_bytes()
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_extract_cache() -> Optional[ExtractionCache]:
+    """The process-wide cache, opened on first use (None when disabled)."""
+    global _cache
+    if not EXTRACT_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExtractionCache()
+    return _cache
+
+
+def open_extract_cache() -> Optional[ExtractionCache]:
+    """The process-wide cache if something has opened it already (never opens it)."""
+    return _cache
@@ -0,0 +1,125 @@
+# handwriting.py
+import os
+import time
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from utils.logger import log
+from utils.model_registry import registry
+
+# -------------------------
+# CONFIG
+# -------------------------
+TROCR_BATCH_SIZE = int(os.getenv("TROCR_BATCH_SIZE", 8))
+TROCR_NUM_BEAMS = int(os.getenv("TROCR_NUM_BEAMS", 1))
+TROCR_MAX_NEW_TOKENS = int(os.getenv("TROCR_MAX_NEW_TOKENS", 48))
+# wall-clock budget for one page; remaining lines are skipped once exceeded
+TROCR_PAGE_BUDGET_S = float(os.getenv("TROCR_PAGE_BUDGET_S", 30))
+
+MIN_LINE_HEIGHT = 12   # px at 300 dpi; shorter runs are specks/rules
+LINE_GAP = 6           # px; gaps smaller than this don't split a line
+LINE_PAD = 8           # px of margin kept around each crop
+
+
+def _ink_mask(gray: np.ndarray) -> np.ndarray:
+    # dark ink on light paper -> 255 where there is ink
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    # join the strokes of a word / line horizontally
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (25, 3))
+    return cv2.dilate(mask, kernel, iterations=1)
+
+
+def segment_lines(gray: np.ndarray) -> List[np.ndarray]:
+    """
+    Split a page into text-line crops using the horizontal ink profile.
+    Returns crops top-to-bottom (grayscale).
+    """
+    mask = _ink_mask(gray)
+    h, w = mask.shape
+
+    # rows with more than ~0.5% ink belong to a line
+    profile = (mask > 0).sum(axis=1)
+    rows = profile > max(2, int(w * 0.005))
+
+    runs = []
+    start = None
+    for y, on in enumerate(rows):
+        if on and start is None:
+            start = y
+        elif not on and start is not None:
+            runs.append([start, y])
+            start = None
+    if start is not None:
+        runs.append([start, h])
+
+    merged = []
+    for run in runs:
+        if merged and run[0] - merged[-1][1] < LINE_GAP:
+            merged[-1][1] = run[1]
+        else:
+            merged.append(run)
+
+    crops = []
+    for y0, y1 in merged:
+        if y1 - y0 < MIN_LINE_HEIGHT:
+            continue
+        cols = np.where(mask[y0:y1].any(axis=0))[0]
+        if cols.size == 0:
+            continue
+        x0, x1 = cols[0], cols[-1] + 1
+        crops.append(gray[
+            max(y0 - LINE_PAD, 0):min(y1 + LINE_PAD, h),
+            max(x0 - LINE_PAD, 0):min(x1 + LINE_PAD, w),
+        ])
+    return crops
+
+
+def recognize_lines(crops: List[np.ndarray], budget_s: float = TROCR_PAGE_BUDGET_S) -> Tuple[List[str], bool]:
+    """
+    Run TrOCR over line crops in batches. Stops early once budget_s is spent;
+    the flag says whether every line was read.
+    """
+    import torch
+
+    processor, model = registry.get("trocr")
+    start = time.perf_counter()
+    texts = []
+    complete = True
+
+    for i in range(0, len(crops), TROCR_BATCH_SIZE):
+        if time.perf_counter() - start > budget_s:
+            log(f"[ handwriting ] Page budget of {budget_s}s spent; skipped {len(crops) - i} line(s).")
+            complete = False
+            break
+
+        batch = [Image.fromarray(c).convert("RGB") for c in crops[i:i + TROCR_BATCH_SIZE]]
+        pixel_values = processor(images=batch, return_tensors="pt").pixel_values
+        with torch.inference_mode():
+            generated_ids = model.generate(
+                pixel_values,
+                num_beams=TROCR_NUM_BEAMS,
+                max_new_tokens=TROCR_MAX_NEW_TOKENS,
+            )
+        texts.extend(processor.batch_decode(generated_ids, skip_special_tokens=True))
+
+    return [t.strip() for t in texts if t.strip()], complete
+
+
+def read_handwritten_page(image: np.ndarray) -> Tuple[str, bool]:
+    """
+    Handwritten OCR for a full page (gray or RGB array): segment into lines,
+    batch through TrOCR. Returns (text, complete); complete is False when
+    the page budget cut recognition short.
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+    crops = segment_lines(gray)
+    if not crops:
+        # nothing line-like found: fall back to the whole page as one "line"
+        crops = [gray]
+
+    lines, complete = recognize_lines(crops)
+    return "\n".join(lines), complete
@@ -1,219 +1,299 @@
 # ingest_kb.py
 import os
+from typing import Dict, List, Tuple
+
 import pandas as pd
 from tqdm import tqdm
 
 from utils.embedding import (
     ensure_collection,
-    load_existing_entries,
-    add_kb_chunks,
+    count_points,
+    delete_points,
+    scroll_points,
+    prepare_items,
     make_uuid,
 )
+from utils.embed_backend import backend_id
+from utils.ingest_pipeline import IngestPipeline, format_stats
+from utils.kb_manifest import KBManifest, content_hash
+from src.name_index import NAME_INDEX_CATEGORIES, read_names, write_name_index
+from utils.kb_version import bump_kb_version
 
 DATA_DIR = "./data"
 MEDICINE_FILE = os.path.join(DATA_DIR, "MID.xlsx")
 REMEDY_FILE = os.path.join(DATA_DIR, "home_remedies.csv")
 LAB_FILE = os.path.join(DATA_DIR, "lab_report_master.csv")
 DISEASE_DIR = os.path.join(DATA_DIR, "diseases")
-
-
-def safe(row, col):
-    """
-    Safe getter supporting both pandas Series and dict-like rows.
-    """
-    try:
-        return row[col] if col in row and pd.notna(row[col]) else ""
-    except Exception:
-        # for namedtuples / itertuples
-        val = getattr(row, col, "")
-        return val if pd.notna(val) else ""
-
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", 1000))
 
 # -------------------------
-# Ingest medicines
+# Sources
+# Each KB source is pure config:
+#   path         file or directory to read
+#   reader       key into READERS (csv / xlsx / text_dir)
+#   category     payload category of every row
+#   name_column  column holding the entry name (rows without one are skipped)
+#   template     [(label, column), ...] -> "label: value" lines of the document
+#   text_column  alternative to template: use this column verbatim
+# Adding a source means adding an entry here.
 # -------------------------
-def ingest_medicine(existing_entries):
-    if not os.path.exists(MEDICINE_FILE):
-        print(f"[ ingest ] Medicine file not found: {MEDICINE_FILE}")
-        return
-
-    df = pd.read_excel(MEDICINE_FILE, dtype=str).fillna("")
-    texts, metas = [], []
-
-    for _, row in tqdm(df.iterrows(), total=len(df), desc="Medicine rows"):
-        name = safe(row, "Name").strip()
-        if not name:
-            continue
-
-        cat = "medicine"
-        cid = make_uuid(f"{cat}-{name.strip().lower()}")
-
-        text = f"""
-Name: {name}
-Contains: {safe(row,'Contains')}
-ProductIntroduction: {safe(row,'ProductIntroduction')}
-ProductBenefits: {safe(row,'ProductBenefits')}
-SideEffect: {safe(row,'SideEffect')}
-HowToUse: {safe(row,'HowToUse')}
-HowWorks: {safe(row,'HowWorks')}
-QuickTips: {safe(row,'QuickTips')}
-SafetyAdvice: {safe(row,'SafetyAdvice')}
-Chemical_Class: {safe(row,'Chemical_Class')}
-Habit_Forming: {safe(row,'Habit_Forming')}
-Therapeutic_Class: {safe(row,'Therapeutic_Class')}
-Action_Class: {safe(row,'Action_Class')}
-""".strip()
-
-        metas.append({"id": cid, "category": cat, "name": name})
-        texts.append(text)
-
-        # flush in chunks if large to limit memory usage
-        if len(texts) >= 1000:
-            add_kb_chunks(texts, metas, existing_entries)
-            # after insertion, extend existing_entries to include these so subsequent runs skip them
-            for m in metas:
-                existing_entries.add((m["category"].lower(), m["name"].strip().lower()))
-            texts, metas = [], []
-
-    if texts:
-        add_kb_chunks(texts, metas, existing_entries)
-        for m in metas:
-            existing_entries.add((m["category"].lower(), m["name"].strip().lower()))
-
-    print("[ ingest ] Medicines done.")
+SOURCES = [
+    {
+        "label": "Medicine",
+        "path": MEDICINE_FILE,
+        "reader": "xlsx",
+        "category": "medicine",
+        "name_column": "Name",
+        "template": [
+            ("Name", "Name"),
+            ("Contains", "Contains"),
+            ("ProductIntroduction", "ProductIntroduction"),
+            ("ProductBenefits", "ProductBenefits"),
+            ("SideEffect", "SideEffect"),
+            ("HowToUse", "HowToUse"),
+            ("HowWorks", "HowWorks"),
+            ("QuickTips", "QuickTips"),
+            ("SafetyAdvice", "SafetyAdvice"),
+            ("Chemical_Class", "Chemical_Class"),
+            ("Habit_Forming", "Habit_Forming"),
+            ("Therapeutic_Class", "Therapeutic_Class"),
+            ("Action_Class", "Action_Class"),
+        ],
+    },
+    {
+        "label": "Home remedies",
+        "path": REMEDY_FILE,
+        "reader": "csv",
+        "category": "remedy",
+        "name_column": "Name of Item",
+        "template": [
+            ("Name", "Name of Item"),
+            ("Health Issue", "Health Issue"),
+            ("Remedy", "Home Remedy"),
+            ("Yogasan", "Yogasan"),
+        ],
+    },
+    {
+        "label": "Lab master",
+        "path": LAB_FILE,
+        "reader": "csv",
+        "category": "lab_test",
+        "name_column": "Parameter",
+        "template": [
+            ("Category", "Category"),
+            ("Parameter", "Parameter"),
+            ("Male Range", "Male Range"),
+            ("Female Range", "Female Range"),
+            ("Child Range", "Child Range"),
+            ("Neonate Range", "Neonate Range"),
+            ("SI Unit", "SI Unit"),
+            ("Conventional Unit", "Conventional Unit"),
+            ("Interpretation", "Interpretation"),
+        ],
+    },
+    # 1 file -> 1 chunk
+    {
+        "label": "Disease files",
+        "path": DISEASE_DIR,
+        "reader": "text_dir",
+        "category": "disease",
+        "name_column": "name",
+        "text_column": "text",
+        "chunk_rows": 500,
+    },
+]
 
 
 # -------------------------
-# Ingest home remedies
+# Readers: yield DataFrames of at most `chunk_rows` string rows
 # -------------------------
-def ingest_home_remedies(existing_entries):
-    if not os.path.exists(REMEDY_FILE):
-        print(f"[ ingest ] Remedies file not found: {REMEDY_FILE}")
-        return
-
-    df = pd.read_csv(REMEDY_FILE, dtype=str).fillna("")
-    texts, metas = [], []
-
-    for _, row in tqdm(df.iterrows(), total=len(df), desc="Remedy rows"):
-        name = safe(row, "Name of Item").strip()
-        if not name:
-            continue
-
-        cat = "remedy"
-        cid = make_uuid(f"{cat}-{name.strip().lower()}")
-
-        text = f"""
-Name: {name}
-Health Issue: {safe(row,'Health Issue')}
-Remedy: {safe(row,'Home Remedy')}
-Yogasan: {safe(row,'Yogasan')}
-""".strip()
+def read_csv_chunks(path, chunk_rows):
+    # streamed: only one chunk of the CSV is in memory at a time
+    for chunk in pd.read_csv(path, dtype=str, chunksize=chunk_rows):
+        yield chunk.fillna("")
 
-        metas.append({"id": cid, "category": cat, "name": name})
-        texts.append(text)
 
-        if len(texts) >= 1000:
-            add_kb_chunks(texts, metas, existing_entries)
-            for m in metas:
-                existing_entries.add((m["category"].lower(), m["name"].strip().lower()))
-            texts, metas = [], []
+def read_xlsx_chunks(path, chunk_rows):
+    # pandas cannot chunk Excel files; openpyxl's read-only mode streams rows
+    from openpyxl import load_workbook
 
-    if texts:
-        add_kb_chunks(texts, metas, existing_entries)
-        for m in metas:
-            existing_entries.add((m["category"].lower(), m["name"].strip().lower()))
-
-    print("[ ingest ] Home remedies done.")
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = ["" if h is None else str(h) for h in header]
+        width = len(columns)
+
+        batch = []
+        for row in rows:
+            row = tuple(row[:width]) + (None,) * (width - len(row))
+            batch.append(["" if v is None else str(v) for v in row])
+            if len(batch) >= chunk_rows:
+                yield pd.DataFrame(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        wb.close()
+
+
+def read_text_dir_chunks(path, chunk_rows):
+    files = sorted(f for f in os.listdir(path) if f.endswith(".txt"))
+    for i in range(0, len(files), chunk_rows):
+        batch = []
+        for fname in files[i:i + chunk_rows]:
+            with open(os.path.join(path, fname), "r", encoding="utf-8") as f:
+                batch.append({"name": fname.replace(".txt", ""), "text": f.read()})
+        yield pd.DataFrame(batch, columns=["name", "text"])
+
+
+READERS = {
+    "csv": read_csv_chunks,
+    "xlsx": read_xlsx_chunks,
+    "text_dir": read_text_dir_chunks,
+}
 
 
 # -------------------------
-# Ingest lab master
+# Vectorized document building
 # -------------------------
-def ingest_lab_master(existing_entries):
-    if not os.path.exists(LAB_FILE):
-        print(f"[ ingest ] Lab file not found: {LAB_FILE}")
-        return
-
-    df = pd.read_csv(LAB_FILE, dtype=str).fillna("")
-    texts, metas = [], []
-
-    for _, row in tqdm(df.iterrows(), total=len(df), desc="Lab rows"):
-        param = safe(row, "Parameter").strip()
-        if not param:
-            continue
-
-        cat = "lab_test"
-        cid = make_uuid(f"{cat}-{param.strip().lower()}")
-
-        text = f"""
-Category: {safe(row,'Category')}
-Parameter: {param}
-Male Range: {safe(row,'Male Range')}
-Female Range: {safe(row,'Female Range')}
-Child Range: {safe(row,'Child Range')}
-Neonate Range: {safe(row,'Neonate Range')}
-SI Unit: {safe(row,'SI Unit')}
-Conventional Unit: {safe(row,'Conventional Unit')}
-Interpretation: {safe(row,'Interpretation')}
-""".strip()
-
-        metas.append({"id": cid, "category": cat, "name": param})
-        texts.append(text)
-
-        if len(texts) >= 1000:
-            add_kb_chunks(texts, metas, existing_entries)
-            for m in metas:
-                existing_entries.add((m["category"].lower(), m["name"].strip().lower()))
-            texts, metas = [], []
-
-    if texts:
-        add_kb_chunks(texts, metas, existing_entries)
-        for m in metas:
-            existing_entries.add((m["category"].lower(), m["name"].strip().lower()))
-
-    print("[ ingest ] Lab master done.")
+def _column(df: pd.DataFrame, col: str) -> pd.Series:
+    if col not in df.columns:
+        return pd.Series("", index=df.index, dtype=object)
+    return df[col].fillna("").astype(str)
+
+
+def build_documents(df: pd.DataFrame, source: dict) -> Tuple[List[str], List[Dict]]:
+    """Turn one chunk of rows into (texts, metas) with column-wise string ops."""
+    names = _column(df, source["name_column"]).str.strip()
+    keep = names != ""
+
+    if "text_column" in source:
+        texts = _column(df, source["text_column"]).str.strip()
+        keep &= texts != ""
+    else:
+        texts = None
+        for label, col in source["template"]:
+            values = names if col == source["name_column"] else _column(df, col)
+            line = label + ": " + values
+            texts = line if texts is None else texts + "\n" + line
+        texts = texts.str.strip()
+
+    names, texts = names[keep], texts[keep]
+
+    cat = source["category"]
+    metas = [
+        {"id": make_uuid(f"{cat}-{name.lower()}"), "category": cat, "name": name}
+        for name in names.tolist()
+    ]
+    return texts.tolist(), metas
 
 
 # -------------------------
-# Ingest disease txt files (1 file -> 1 chunk)
+# Generic ingestion
+# Every run diffs the sources against the manifest (point id -> content
+# hash): new and edited rows are embedded, unchanged rows are skipped,
+# rows that disappeared from a source are deleted.
 # -------------------------
-def ingest_disease_files(existing_entries):
-    if not os.path.isdir(DISEASE_DIR):
-        print(f"[ ingest ] Disease dir not found: {DISEASE_DIR}")
-        return
-
-    texts, metas = [], []
-    files = [f for f in os.listdir(DISEASE_DIR) if f.endswith(".txt")]
-
-    for fname in tqdm(files, desc="Disease files"):
-        name = fname.replace(".txt", "").strip()
-        if not name:
-            continue
-
-        cat = "disease"
-        cid = make_uuid(f"{cat}-{name.strip().lower()}")
-
-        with open(os.path.join(DISEASE_DIR, fname), "r", encoding="utf-8") as f:
-            content = f.read().strip()
-            if not content:
+class IngestRun:
+    def __init__(self, manifest: KBManifest):
+        self.manifest = manifest
+        # switching embedding backend/model changes every hash -> full re-embed
+        self.model_id = backend_id()
+        self.seen: Dict[str, set] = {}          # category -> ids present in the sources
+        self.updates: List[Tuple[str, str, str]] = []
+        self.missing_categories = set()         # a source of this category could not be read
+        self.names: Dict[str, Dict[str, str]] = {}  # category -> {id: name}, for the name index
+        self.counts = {"new": 0, "changed": 0, "unchanged": 0, "deleted": 0}
+
+    def source_items(self, source: dict):
+        """
+        Build stage for one source: yields lists of new or edited
+        {"text", "meta"} items, one per chunk of rows.
+        """
+        path = source["path"]
+        cat = source["category"]
+        exists = os.path.isdir(path) if source["reader"] == "text_dir" else os.path.exists(path)
+        if not exists:
+            print(f"[ ingest ] {source['label']} not found: {path}")
+            # keep its points: a missing file is not the same as an empty one
+            self.missing_categories.add(cat)
+            return
+
+        reader = READERS[source["reader"]]
+        chunk_rows = source.get("chunk_rows", INGEST_CHUNK_ROWS)
+        seen = self.seen.setdefault(cat, set())
+
+        rows = 0
+        with tqdm(desc=f"{source['label']} rows", unit="row") as bar:
+            for df in reader(path, chunk_rows):
+                texts, metas = build_documents(df, source)
+                items = []
+                for it in prepare_items(texts, metas):
+                    pid = it["meta"]["id"]
+                    if pid in seen:
+                        # same (category, name) twice: the first row wins
+                        continue
+                    seen.add(pid)
+                    if cat in NAME_INDEX_CATEGORIES:
+                        self.names.setdefault(cat, {})[pid] = it["meta"]["name"]
+
+                    digest = content_hash(it["text"], it["meta"], self.model_id)
+                    previous = self.manifest.get(cat, pid)
+                    if previous == digest:
+                        self.counts["unchanged"] += 1
+                        continue
+                    self.counts["new" if previous is None else "changed"] += 1
+                    it["meta"]["content_hash"] = digest
+                    self.updates.append((cat, pid, digest))
+                    items.append(it)
+                if items:
+                    yield items
+                rows += len(df)
+                bar.update(len(df))
+
+        print(f"[ ingest ] {source['label']} scanned ({rows} rows).")
+
+    def all_source_items(self):
+        # ingest in logical order (reorder SOURCES to change it)
+        for source in SOURCES:
+            yield from self.source_items(source)
+
+    def name_index_entries(self) -> Dict[str, Dict[str, str]]:
+        # categories whose source was missing keep their previous names
+        names = {cat: ids for cat, ids in self.names.items() if cat not in self.missing_categories}
+        for cat, ids in read_names().items():
+            if cat in self.missing_categories or (cat in NAME_INDEX_CATEGORIES and cat not in self.seen):
+                names[cat] = ids
+        return names
+
+    def removed_ids(self) -> Dict[str, List[str]]:
+        removed = {}
+        for cat, seen in self.seen.items():
+            if cat in self.missing_categories:
                 continue
+            gone = sorted(self.manifest.ids(cat) - seen)
+            if gone:
+                removed[cat] = gone
+        return removed
 
-        metas.append({"id": cid, "category": cat, "name": name})
-        texts.append(content)
-
-        # commit in moderate batches
-        if len(texts) >= 500:
-            add_kb_chunks(texts, metas, existing_entries)
-            for m in metas:
-                existing_entries.add((m["category"].lower(), m["name"].strip().lower()))
-            texts, metas = [], []
 
-    if texts:
-        add_kb_chunks(texts, metas, existing_entries)
-        for m in metas:
-            existing_entries.add((m["category"].lower(), m["name"].strip().lower()))
+def load_manifest() -> KBManifest:
+    """
+    The local manifest, rebuilt from the collection (one payload-only
+    scroll) when it is missing or no longer matches the point count.
+    """
+    manifest = KBManifest.load()
+    points = count_points()
+    if manifest is not None and len(manifest) == points:
+        return manifest
 
-    print("[ ingest ] Disease files done.")
+    print(f"[ ingest ] Rebuilding manifest from {points} points in Qdrant ...")
+    manifest = KBManifest.from_points(scroll_points(["category", "content_hash"]))
+    manifest.save()
+    return manifest
 
 
 # -------------------------
@@ -221,13 +301,36 @@ def ingest_disease_files(existing_entries):
 # -------------------------
 def run_ingestion():
     ensure_collection()
-    existing_entries = load_existing_entries()
-
-    # ingest in logical order (you can reorder)
-    ingest_medicine(existing_entries)
-    ingest_home_remedies(existing_entries)
-    ingest_lab_master(existing_entries)
-    ingest_disease_files(existing_entries)
+    manifest = load_manifest()
+    run = IngestRun(manifest)
+
+    stats = IngestPipeline().run(run.all_source_items())
+    print(format_stats(stats))
+
+    for cat, pid, digest in run.updates:
+        manifest.set(cat, pid, digest)
+
+    for cat, ids in run.removed_ids().items():
+        delete_points(ids)
+        for pid in ids:
+            manifest.remove(cat, pid)
+        run.counts["deleted"] += len(ids)
+        print(f"[ ingest ] Deleted {len(ids)} '{cat}' rows no longer in the source.")
+
+    manifest.save()
+    # exact-name lookups for prescriptions / lab reports (src/name_index.py)
+    write_name_index(run.name_index_entries())
+    c = run.counts
+    print(f"[ ingest ] {c['new']} new, {c['changed']} changed, {c['unchanged']} unchanged, {c['deleted']} deleted.")
+
+    if c["new"] or c["changed"] or c["deleted"]:
+        # invalidates caches derived from the KB (e.g. the answer cache)
+        version = bump_kb_version()
+        print(f"[ ingest ] KB version is now {version}")
+
+        # workers using RETRIEVAL_BACKEND=numpy map the new export on their next query
+        from src.vector_index import refresh_if_present
+        refresh_if_present(version)
 
     print("\n======== INGESTION COMPLETE ========\n")
 
@@ -0,0 +1,193 @@
+# ingest_pipeline.py
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from utils.embedding import BATCH_SIZE, build_points, embed_texts, upsert_points
+
+# -------------------------
+# CONFIG
+# -------------------------
+# batches waiting between two stages; bounds memory when one stage is slower
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 4))
+
+_DONE = object()
+
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.rows = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+
+    def add(self, rows: int, seconds: float):
+        self.rows += rows
+        self.batches += 1
+        self.busy_seconds += seconds
+
+    def as_dict(self, wall_seconds: float) -> Dict:
+        return {
+            "rows": self.rows,
+            "batches": self.batches,
+            "busy_seconds": round(self.busy_seconds, 3),
+            # rows/s while the stage was working, and over the whole run
+            "busy_rows_per_s": round(self.rows / self.busy_seconds, 1) if self.busy_seconds else 0.0,
+            "rows_per_s": round(self.rows / wall_seconds, 1) if wall_seconds else 0.0,
+        }
+
+
+class IngestPipeline:
+    """
+    Three concurrent stages joined by bounded queues:
+
+        build   (caller's iterable: rows -> [{"text", "meta"}, ...])
+          -> embed   (BGE, one batch at a time)
+          -> upsert  (Qdrant, wait=False; the last batch waits)
+
+    While BGE embeds batch N+1, Qdrant indexes batch N. The first error in
+    any stage stops the others and is re-raised from run().
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], List[List[float]]] = embed_texts,
+        upsert_fn: Callable = upsert_points,
+        batch_size: int = BATCH_SIZE,
+        queue_size: int = INGEST_QUEUE_SIZE,
+    ):
+        self.embed_fn = embed_fn
+        self.upsert_fn = upsert_fn
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.stats = {name: StageStats(name) for name in ("build", "embed", "upsert")}
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    # ---- queue helpers: never block forever once another stage failed ----
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _fail(self, exc: BaseException):
+        if self._error is None:
+            self._error = exc
+        self._stop.set()
+
+    # ---- stages ----
+    def _build(self, item_batches: Iterable[List[Dict]], out: queue.Queue):
+        try:
+            pending: List[Dict] = []
+            it = iter(item_batches)
+            while True:
+                start = time.perf_counter()
+                items = next(it, None)
+                if items is None:
+                    break
+                pending.extend(items)
+                # re-slice to fixed-size batches so embed/upsert see even work
+                while len(pending) >= self.batch_size:
+                    batch, pending = pending[:self.batch_size], pending[self.batch_size:]
+                    self.stats["build"].add(len(batch), time.perf_counter() - start)
+                    if not self._put(out, batch):
+                        return
+                    start = time.perf_counter()
+            if pending:
+                self.stats["build"].add(len(pending), time.perf_counter() - start)
+                self._put(out, pending)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._put(out, _DONE)
+
+    def _embed(self, inp: queue.Queue, out: queue.Queue):
+        try:
+            while True:
+                batch = self._get(inp)
+                if batch is _DONE:
+                    break
+                start = time.perf_counter()
+                vectors = self.embed_fn([it["text"] for it in batch])
+                points = build_points(batch, vectors)
+                self.stats["embed"].add(len(batch), time.perf_counter() - start)
+                if not self._put(out, points):
+                    return
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._put(out, _DONE)
+
+    def _upsert(self, inp: queue.Queue):
+        # hold one batch back so the final one can be sent with wait=True:
+        # Qdrant applies a collection's updates in order, so once it returns
+        # every earlier fire-and-forget upsert is applied too
+        held = None
+        try:
+            while True:
+                points = self._get(inp)
+                if points is _DONE:
+                    break
+                if held is not None:
+                    start = time.perf_counter()
+                    self.upsert_fn(held, wait=False)
+                    self.stats["upsert"].add(len(held), time.perf_counter() - start)
+                held = points
+            if held is not None and self._error is None:
+                start = time.perf_counter()
+                self.upsert_fn(held, wait=True)
+                self.stats["upsert"].add(len(held), time.perf_counter() - start)
+        except BaseException as e:
+            self._fail(e)
+
+    def run(self, item_batches: Iterable[List[Dict]]) -> Dict:
+        """Push every batch through the stages; returns per-stage stats."""
+        to_embed = queue.Queue(maxsize=self.queue_size)
+        to_upsert = queue.Queue(maxsize=self.queue_size)
+
+        start = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._embed, args=(to_embed, to_upsert), name="ingest-embed", daemon=True),
+            threading.Thread(target=self._upsert, args=(to_upsert,), name="ingest-upsert", daemon=True),
+        ]
+        for t in threads:
+            t.start()
+        # the build stage runs on the caller's thread: source readers
+        # (tqdm bars, openpyxl workbooks) stay where they were created
+        self._build(item_batches, to_embed)
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - start
+
+        if self._error is not None:
+            raise self._error
+
+        return {
+            "wall_seconds": round(wall, 3),
+            "stages": {name: s.as_dict(wall) for name, s in self.stats.items()},
+        }
+
+
+def format_stats(stats: Dict) -> str:
+    lines = [f"[ ingest ] Pipeline finished in {stats['wall_seconds']:.1f}s"]
+    for name, s in stats["stages"].items():
+        lines.append(
+            f"[ ingest ]   {name:<7} {s['rows']:>8} rows  "
+            f"{s['rows_per_s']:>9.1f} rows/s  (busy {s['busy_seconds']:.1f}s, "
+            f"{s['busy_rows_per_s']:.1f} rows/s while busy)"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,86 @@
+# kb_manifest.py
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, Optional
+
+# -------------------------
+# CONFIG
+# -------------------------
+# Local record of what the medical_kb collection holds:
+#   {"version": 1, "categories": {category: {point id: content hash}}}
+# Lets an ingestion run diff the source files against the KB without
+# scrolling the whole collection.
+KB_MANIFEST_PATH = os.getenv("KB_MANIFEST_PATH", "kb_manifest.json")
+MANIFEST_FORMAT = 1
+
+
+def content_hash(text: str, meta: Dict, model_id: str = "") -> str:
+    """
+    Hash of everything that ends up in a point: document text + category +
+    name, and the embedding model that produced its vector.
+    """
+    h = hashlib.sha256()
+    h.update(model_id.encode("utf-8"))
+    h.update(b"\0")
+    h.update((meta.get("category") or "").encode("utf-8"))
+    h.update(b"\0")
+    h.update((meta.get("name") or "").encode("utf-8"))
+    h.update(b"\0")
+    h.update((text or "").encode("utf-8"))
+    return h.hexdigest()
+
+
+class KBManifest:
+    def __init__(self, categories: Optional[Dict[str, Dict[str, str]]] = None, path: str = KB_MANIFEST_PATH):
+        self.path = path
+        self.categories: Dict[str, Dict[str, str]] = categories or {}
+
+    @classmethod
+    def load(cls, path: str = KB_MANIFEST_PATH) -> Optional["KBManifest"]:
+        """The manifest on disk, or None if there is none (or it is unreadable)."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if data.get("version") != MANIFEST_FORMAT:
+            return None
+        return cls(data.get("categories", {}), path)
+
+    @classmethod
+    def from_points(cls, points: Iterable, path: str = KB_MANIFEST_PATH) -> "KBManifest":
+        """
+        Rebuild from Qdrant points (payload 'category' + 'content_hash').
+        Points written before hashes existed get an empty hash, so the next
+        run re-embeds them once and stamps them.
+        """
+        manifest = cls(path=path)
+        for p in points:
+            payload = p.payload or {}
+            cat = (payload.get("category") or "").strip().lower()
+            manifest.set(cat, str(p.id), payload.get("content_hash") or "")
+        return manifest
+
+    def save(self):
+        parent = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(parent, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_FORMAT, "categories": self.categories}, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    def get(self, category: str, point_id: str) -> Optional[str]:
+        return self.categories.get(category, {}).get(point_id)
+
+    def set(self, category: str, point_id: str, digest: str):
+        self.categories.setdefault(category, {})[point_id] = digest
+
+    def remove(self, category: str, point_id: str):
+        self.categories.get(category, {}).pop(point_id, None)
+
+    def ids(self, category: str):
+        return set(self.categories.get(category, {}))
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self.categories.values())
@@ -0,0 +1,34 @@
+# kb_version.py
+import os
+import time
+import uuid
+
+# A stamp file rewritten every time the medical_kb collection changes.
+# Anything derived from the KB (answer cache, exported indexes, ...) compares
+# against it to know when to invalidate.
+KB_VERSION_FILE = os.getenv("KB_VERSION_FILE", "kb_version.txt")
+
+_cached = {"mtime": None, "version": ""}
+
+
+def bump_kb_version() -> str:
+    version = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    tmp = KB_VERSION_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp, KB_VERSION_FILE)
+    return version
+
+
+def read_kb_version() -> str:
+    """Current KB version ('' if the KB was never stamped). Re-reads only when the file changes."""
+    try:
+        mtime = os.stat(KB_VERSION_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return ""
+
+    if mtime != _cached["mtime"]:
+        with open(KB_VERSION_FILE, "r", encoding="utf-8") as f:
+            _cached["version"] = f.read().strip()
+        _cached["mtime"] = mtime
+    return _cached["version"]
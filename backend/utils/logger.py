@@ -1,4 +1,111 @@
+# logger.py
+import atexit
 import datetime
+import json
+import os
+import queue
+import sys
+import threading
 
-def log(msg: str):
-    print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {msg}")
+from utils.metrics import request_id_var
+
+# -------------------------
+# CONFIG
+# -------------------------
+# "text": [HH:MM:SS] [request id] message      "json": one JSON object per line
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+# log() only enqueues; one writer thread does the (blocking) stdout writes,
+# so request threads and the event loop never wait on the terminal.
+_queue: "queue.Queue" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_dropped = 0
+_writer = None
+_writer_lock = threading.Lock()
+_STOP = object()
+
+
+def _format(record: dict) -> str:
+    if LOG_FORMAT == "json":
+        return json.dumps(record, ensure_ascii=False, default=str)
+    ts = record["ts"][11:19]
+    rid = f" [{record['request_id']}]" if record.get("request_id") else ""
+    extra = " ".join(f"{k}={v}" for k, v in record.items() if k not in ("ts", "msg", "request_id"))
+    return f"[{ts}]{rid} {record['msg']}" + (f" {extra}" if extra else "")
+
+
+def _write_loop():
+    global _dropped
+    while True:
+        record = _queue.get()
+        if record is _STOP:
+            return
+        lines = [_format(record)]
+        # drain whatever else is waiting: one write per burst
+        while True:
+            try:
+                record = _queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is _STOP:
+                _emit(lines)
+                return
+            lines.append(_format(record))
+        if _dropped:
+            lines.append(_format({"ts": _now(), "msg": f"[ logger ] dropped {_dropped} records (queue full)"}))
+            _dropped = 0
+        _emit(lines)
+
+
+def _emit(lines):
+    try:
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+    except (OSError, ValueError):
+        pass
+
+
+def _start_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_write_loop, name="log-writer", daemon=True)
+            _writer.start()
+
+
+def flush_logs(timeout: float = 2.0):
+    """Stop the writer after everything queued so far is written (at exit)."""
+    if _writer is None or not _writer.is_alive():
+        return
+    try:
+        _queue.put(_STOP, timeout=timeout)
+    except queue.Full:
+        return
+    _writer.join(timeout)
+
+
+atexit.register(flush_logs)
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat(timespec="milliseconds")
+
+
+def log(msg: str, **fields):
+    """
+    Queue a log record; never blocks. `fields` become structured keys
+    (key=value in text mode). The current request id is attached.
+    """
+    global _dropped
+    record = {"ts": _now(), "msg": msg}
+    rid = request_id_var.get()
+    if rid:
+        record["request_id"] = rid
+    record.update(fields)
+
+    if _writer is None:
+        _start_writer()
+    try:
+        _queue.put_nowait(record)
+    except queue.Full:
+        _dropped += 1
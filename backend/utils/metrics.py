@@ -0,0 +1,220 @@
+# metrics.py
+import bisect
+import contextvars
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# -------------------------
+# CONFIG
+# -------------------------
+METRICS_ENABLED = os.getenv("METRICS", "1") == "1"
+
+# seconds: 1 ms .. 2 min (page OCR and LLM generation sit at the top end)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 768, 1024, 1536, 2048, 3072, 4096)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+# -------------------------
+# Request correlation
+# Set by the HTTP middleware; copied into executor threads by
+# src/executor.run_in, so logs and spans anywhere in a request share it.
+# -------------------------
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_spans_var: contextvars.ContextVar[Optional[List]] = contextvars.ContextVar("spans", default=None)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def start_request(request_id: Optional[str] = None) -> Tuple[str, List]:
+    """Begin collecting spans for a request (in the current context)."""
+    rid = request_id or new_request_id()
+    spans: List[Tuple[str, float]] = []
+    request_id_var.set(rid)
+    _spans_var.set(spans)
+    return rid, spans
+
+
+def current_spans() -> List[Tuple[str, float]]:
+    return _spans_var.get() or []
+
+
+def span_summary(spans: Iterable[Tuple[str, float]]) -> Dict[str, float]:
+    """Total milliseconds per stage (a stage may run several times per request)."""
+    out: Dict[str, float] = {}
+    for stage, seconds in spans:
+        out[stage] = round(out.get(stage, 0.0) + seconds * 1000, 2)
+    return out
+
+
+# -------------------------
+# Prometheus primitives (text exposition format 0.0.4)
+# -------------------------
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_fmt(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram; one series per label combination."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(s)) for labels, s in sorted(self._series.items())]
+        for labels, s in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s[:-2]):
+                cumulative += n
+                le = f'le="{_fmt(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_fmt(s[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {s[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        m = Histogram(*args, **kwargs)
+        self._metrics.append(m)
+        return m
+
+    def counter(self, *args, **kwargs) -> Counter:
+        m = Counter(*args, **kwargs)
+        self._metrics.append(m)
+        return m
+
+    def render(self) -> str:
+        return "\n".join(line for m in self._metrics for line in m.render()) + "\n"
+
+
+metrics = MetricsRegistry()
+
+HTTP_SECONDS = metrics.histogram(
+    "curasense_http_request_seconds", "HTTP request latency (streams: until the response starts)",
+    ["path", "status"],
+)
+STAGE_SECONDS = metrics.histogram("curasense_stage_seconds", "Time spent per pipeline stage", ["stage"])
+PAGE_SECONDS = metrics.histogram(
+    "curasense_pdf_page_seconds", "Text extraction time per PDF page, by engine", ["engine"]
+)
+PROMPT_TOKENS = metrics.histogram(
+    "curasense_prompt_tokens", "Prompt size after packing", ["kind"], buckets=TOKEN_BUCKETS
+)
+LLM_TOKENS = metrics.counter("curasense_llm_tokens_total", "Tokens processed by the LLM", ["phase"])
+LLM_TOKENS_PER_SECOND = metrics.histogram(
+    "curasense_llm_tokens_per_second", "LLM throughput per call (prompt_eval / generation)", ["phase"],
+    buckets=RATE_BUCKETS,
+)
+LLM_DRAFT_TOKENS = metrics.counter(
+    "curasense_llm_draft_tokens_total", "Prompt-lookup draft tokens by outcome (accepted is an estimate)", ["result"]
+)
+
+
+def record_request(path: str, status: int, seconds: float):
+    if METRICS_ENABLED:
+        HTTP_SECONDS.observe(seconds, path, str(status))
+
+
+def record_stage(stage: str, seconds: float):
+    if not METRICS_ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage)
+    spans = _spans_var.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block as `stage` (histogram + the current request's span list)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def record_page(engine: str, seconds: float):
+    if METRICS_ENABLED:
+        PAGE_SECONDS.observe(seconds, engine)
+
+
+def record_prompt_tokens(kind: str, tokens: int):
+    if METRICS_ENABLED:
+        PROMPT_TOKENS.observe(tokens, kind)
+
+
+def record_llm_phase(phase: str, tokens: int, seconds: float):
+    """One LLM call's prompt_eval or generation phase: stage time, token count and tokens/s."""
+    record_stage(f"llm_{phase}", seconds)
+    if not METRICS_ENABLED:
+        return
+    LLM_TOKENS.inc(tokens, phase)
+    if tokens and seconds > 0:
+        LLM_TOKENS_PER_SECOND.observe(tokens / seconds, phase)
+
+
+def record_draft_tokens(drafted: int, accepted: int):
+    if METRICS_ENABLED:
+        LLM_DRAFT_TOKENS.inc(accepted, "accepted")
+        LLM_DRAFT_TOKENS.inc(drafted - accepted, "rejected")
+
+
+def render_metrics() -> str:
+    return metrics.render()
@@ -0,0 +1,189 @@
+# model_registry.py
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from utils.logger import log
+
+# -------------------------
+# CONFIG
+# -------------------------
+LLM_MODEL_PATH = os.getenv("LLM_MODEL_PATH", "../models/Phi-3-mini-4k-instruct-q4.gguf")
+LLM_N_CTX = int(os.getenv("LLM_N_CTX", 2048))
+# 0 = all cores available to this process (per worker share under src/llm_server.py)
+LLM_THREADS = int(os.getenv("LLM_THREADS", 0))
+LLM_GPU_LAYERS = int(os.getenv("LLM_GPU_LAYERS", 0))    # -1 = offload every layer
+# weights are memory-mapped (shared through the page cache); mlock also pins them in RAM
+LLM_MLOCK = os.getenv("LLM_MLOCK", "0") == "1"
+BGE_MODEL_NAME = os.getenv("BGE_MODEL_NAME", "BAAI/bge-small-en-v1.5")
+TROCR_MODEL_NAME = os.getenv("TROCR_MODEL_NAME", "microsoft/trocr-base-handwritten")
+QDRANT_PATH = os.getenv("QDRANT_PATH", "qdrant_local")
+# a Qdrant server (e.g. http://localhost:6333); takes precedence over QDRANT_PATH
+QDRANT_URL = os.getenv("QDRANT_URL", "")
+QDRANT_API_KEY = os.getenv("QDRANT_API_KEY") or None
+# dynamic int8 quantization of TrOCR's Linear layers (CPU only)
+TROCR_INT8 = os.getenv("TROCR_INT8", "0") == "1"
+
+
+def _rss_bytes() -> int:
+    """Resident set size of this process (0 if unknown)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        try:
+            import resource
+            # ru_maxrss is KiB on Linux, bytes on macOS; good enough as a fallback
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except Exception:
+            return 0
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of heavy models.
+
+    Each model is loaded once, on first get(), by the loader registered under
+    its name. Load time and the RSS growth seen while loading are recorded so
+    /warmup and /stats can report them.
+    """
+
+    def __init__(self):
+        self._loaders: Dict[str, Callable] = {}
+        self._models: Dict[str, object] = {}
+        self._info: Dict[str, Dict] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._registry_lock = threading.Lock()
+
+    def register(self, name: str, loader: Callable):
+        with self._registry_lock:
+            self._loaders[name] = loader
+            self._locks.setdefault(name, threading.Lock())
+
+    def override(self, name: str, model):
+        """Install an already-built model (stubs for benchmarks, tests, ...)."""
+        with self._registry_lock:
+            self._locks.setdefault(name, threading.Lock())
+            self._models[name] = model
+            self._info[name] = {"load_seconds": 0.0, "rss_delta_mb": 0.0, "override": True}
+
+    def is_registered(self, name: str) -> bool:
+        return name in self._loaders or name in self._models
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def get(self, name: str):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        if name not in self._loaders:
+            raise KeyError(f"No model registered under '{name}'")
+
+        with self._locks[name]:
+            model = self._models.get(name)
+            if model is not None:
+                return model
+
+            log(f"[ models ] Loading '{name}' ...")
+            rss_before = _rss_bytes()
+            start = time.perf_counter()
+            model = self._loaders[name]()
+            elapsed = time.perf_counter() - start
+            rss_delta = max(_rss_bytes() - rss_before, 0)
+
+            self._models[name] = model
+            self._info[name] = {
+                "load_seconds": round(elapsed, 3),
+                "rss_delta_mb": round(rss_delta / (1024 * 1024), 1),
+            }
+            log(f"[ models ] '{name}' loaded in {elapsed:.2f}s (+{rss_delta / (1024 * 1024):.0f} MB RSS)")
+            return model
+
+    def info(self) -> Dict:
+        return {
+            "models": {
+                name: {"loaded": name in self._models, **self._info.get(name, {})}
+                for name in sorted(set(self._loaders) | set(self._models))
+            },
+            "rss_mb": round(_rss_bytes() / (1024 * 1024), 1),
+        }
+
+
+# -------------------------
+# Default loaders
+# Heavy imports live inside the loaders so importing a module that
+# *might* need a model costs nothing until the model is used.
+# -------------------------
+def load_llama(n_threads: int = LLM_THREADS, speculative: Optional[bool] = None):
+    from llama_cpp import Llama
+
+    from src.llm_server import available_cores
+    from src.speculative import SPECULATIVE_ENDPOINTS
+
+    n_threads = n_threads or len(available_cores())
+    # verifying draft tokens needs logits for every evaluated position; a
+    # context without them cannot decode speculatively, so decide at load time
+    if speculative is None:
+        speculative = bool(SPECULATIVE_ENDPOINTS)
+    return Llama(
+        model_path=LLM_MODEL_PATH,
+        n_ctx=LLM_N_CTX,
+        n_threads=n_threads,
+        n_threads_batch=n_threads,
+        n_gpu_layers=LLM_GPU_LAYERS,
+        use_mmap=True,
+        use_mlock=LLM_MLOCK,
+        logits_all=speculative,
+        verbose=False
+    )
+
+
+def _load_llm():
+    # with an inference server configured, this process only keeps a client
+    from src.llm_server import LLM_SERVER_ADDRESS, RemoteLLM
+
+    if LLM_SERVER_ADDRESS:
+        return RemoteLLM(LLM_SERVER_ADDRESS)
+    return load_llama()
+
+
+def _load_bge():
+    # length-bucketed encoder over the EMBED_BACKEND runtime (torch / onnx)
+    from utils.embed_backend import load_backend
+
+    return load_backend()
+
+
+def _load_trocr():
+    import torch
+    from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+
+    processor = TrOCRProcessor.from_pretrained(TROCR_MODEL_NAME)
+    model = VisionEncoderDecoderModel.from_pretrained(TROCR_MODEL_NAME)
+    model.eval()
+
+    if TROCR_INT8 and not torch.cuda.is_available():
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return processor, model
+
+
+def _load_qdrant():
+    from qdrant_client import QdrantClient
+
+    if QDRANT_URL:
+        return QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
+
+    # local mode takes a file lock: one client per process, shared by
+    # retrieval and ingestion
+    return QdrantClient(path=QDRANT_PATH)
+
+
+registry = ModelRegistry()
+registry.register("llm", _load_llm)
+registry.register("bge", _load_bge)
+registry.register("trocr", _load_trocr)
+registry.register("qdrant", _load_qdrant)
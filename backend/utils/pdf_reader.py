@@ -9,26 +9,125 @@
 #     return text.strip()
 
 # pdf_reader.py
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import fitz  # PyMuPDF
 import pytesseract
 from PIL import Image
 import numpy as np
 import cv2
-from transformers import TrOCRProcessor, VisionEncoderDecoderModel
-from PIL import Image
 
-processor = TrOCRProcessor.from_pretrained("microsoft/trocr-base-handwritten")
-model = VisionEncoderDecoderModel.from_pretrained("microsoft/trocr-base-handwritten")
+from utils.handwriting import read_handwritten_page
+from utils.extract_cache import document_hash, get_extract_cache, page_hash
+from utils.logger import log
+from utils.metrics import record_page, span
 
 def extract_handwritten_text(image):
-    img = Image.fromarray(image)
-    pixel_values = processor(img, return_tensors="pt").pixel_values
-    generated_ids = model.generate(pixel_values)
-    text = processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
-    return text
+    # line-segmented, batched TrOCR (see utils/handwriting.py)
+    return read_handwritten_page(image)[0]
+
+# If using Windows, set your Tesseract path (or TESSERACT_CMD)
+if os.getenv("TESSERACT_CMD"):
+    pytesseract.pytesseract.tesseract_cmd = os.getenv("TESSERACT_CMD")
+elif os.name == "nt":
+    pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+
+# -------------------------
+# OCR worker pool
+# Scanned pages are rendered + Tesseract'd in separate processes, one page
+# per task. TrOCR stays in this process so only one copy is ever loaded.
+# -------------------------
+PDF_OCR_WORKERS = int(os.getenv("PDF_OCR_WORKERS", os.cpu_count() or 1))
+PDF_OCR_START_METHOD = os.getenv("PDF_OCR_START_METHOD", "spawn")
+OCR_DPI = 300
+TESSERACT_CONFIG = r'--oem 1 --psm 6 -l eng'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _ocr_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=PDF_OCR_WORKERS,
+                    mp_context=multiprocessing.get_context(PDF_OCR_START_METHOD),
+                )
+    return _pool
+
+
+def shutdown_ocr_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _render_gray(page) -> np.ndarray:
+    # ------- Convert page to a grayscale image (for OCR) -------
+    # rendered straight to 8-bit gray: no PNG encode/decode round trip
+    pix = page.get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY, alpha=False)
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+    return gray[:, :pix.width].copy()
+
+
+def open_pdf(source):
+    """
+    Open a PDF from a path, raw bytes or a binary file-like object.
+    Uploads are kept in memory, so nothing has to touch the disk.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return fitz.open(source)
+    if hasattr(source, "read"):
+        source = source.read()
+    return fitz.open(stream=bytes(source), filetype="pdf")
+
+
+def _single_page_pdf(pdf, page_index: int) -> bytes:
+    # ship just one page to a worker instead of the whole document
+    out = fitz.open()
+    out.insert_pdf(pdf, from_page=page_index, to_page=page_index)
+    data = out.tobytes()
+    out.close()
+    return data
+
+
+def _tesseract_loaded_page(pdf, page_index: int):
+    gray = _render_gray(pdf.load_page(page_index))
+    ocr_text = pytesseract.image_to_string(Image.fromarray(gray), config=TESSERACT_CONFIG)
+    # If Tesseract finds some text → use it
+    if len(ocr_text.strip()) > 10:
+        return ocr_text
+    return None
+
+
+def tesseract_page(source, page_index: int):
+    """
+    Worker task: render one page and run Tesseract on it.
+    `source` is a path or PDF bytes. Returns the text, or None when the
+    page looks handwritten.
+    """
+    with open_pdf(source) as pdf:
+        return _tesseract_loaded_page(pdf, page_index)
+
+
+def _timed_tesseract_page(source, page_index: int):
+    # worker side of the timing: metrics live in the parent process
+    start = time.perf_counter()
+    return tesseract_page(source, page_index), time.perf_counter() - start
+
+
+def _timed_tesseract_loaded_page(pdf, page_index: int):
+    start = time.perf_counter()
+    return _tesseract_loaded_page(pdf, page_index), time.perf_counter() - start
 
-# If using Windows, uncomment & set your Tesseract path
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
 # def extract_pdf_text(pdf_path: str) -> str:
 #     text_output = []
@@ -63,48 +162,95 @@ pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tessera
 
 #     return "\n".join(text_output).strip()
 
-def extract_pdf_text(pdf_path: str) -> str:
-    text_output = []
-    pdf = fitz.open(pdf_path)
+def _read_bytes(source) -> bytes:
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+    return bytes(source)
 
-    for page_index in range(len(pdf)):
-        page = pdf.load_page(page_index)
 
-        # ------- 1. Try normal PDF text extraction -------
-        extracted_text = page.get_text("text")
+def extract_pdf_text(pdf_path) -> str:
+    """`pdf_path` may be a path, PDF bytes or a binary file-like object."""
+    with span("extract"):
+        return _extract_pdf_text(pdf_path)
+
+
+def _extract_pdf_text(pdf_path) -> str:
+    if hasattr(pdf_path, "read"):
+        pdf_path = pdf_path.read()
+
+    # ------- 0. Same document seen before? -------
+    cache = get_extract_cache()
+    doc_digest = None
+    if cache is not None:
+        doc_digest = document_hash(_read_bytes(pdf_path))
+        cached = cache.get_document(doc_digest)
+        if cached is not None:
+            return cached
+
+    pdf = open_pdf(pdf_path)
+    text_output = [None] * len(pdf)
+    scanned = []
+
+    # ------- 1. Fast path: digital text, straight from the PDF -------
+    for page_index in range(len(pdf)):
+        start = time.perf_counter()
+        extracted_text = pdf.load_page(page_index).get_text("text")
+        record_page("text", time.perf_counter() - start)
         if extracted_text.strip():
-            text_output.append(extracted_text)
-            continue
-
-        # ------- 2. Convert page to an image (for OCR) -------
-        pix = page.get_pixmap(dpi=300)
-        img_bytes = pix.tobytes("png")
-
-        # Decode to OpenCV image
-        nparr = np.frombuffer(img_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-        # Convert to PIL-friendly grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        pil_img = Image.fromarray(gray)
-
-        # ------- 3. FIRST try normal OCR (Tesseract) -------
-        config = r'--oem 1 --psm 6 -l eng'
-        ocr_text = pytesseract.image_to_string(pil_img, config=config)
-        
-        # If Tesseract finds some text → use it
-        if len(ocr_text.strip()) > 10:
-            text_output.append(ocr_text)
-            continue
-
-        # ------- 4. If OCR fails → try Handwritten OCR (TrOCR) -------
-        print(f"[INFO] Page {page_index} looks handwritten, using TrOCR...")
-        rgb_img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_GRAY2RGB)
-        handwritten = extract_handwritten_text(rgb_img)
-
-        text_output.append(handwritten)
-
-    return "\n".join(text_output).strip()
+            text_output[page_index] = extracted_text
+        else:
+            scanned.append(page_index)
+
+    # scanned pages shared with an earlier document skip OCR
+    page_digests = {}
+    if cache is not None:
+        for page_index in list(scanned):
+            page_digests[page_index] = page_hash(pdf, page_index)
+            cached = cache.get_page(page_digests[page_index])
+            if cached is not None:
+                text_output[page_index] = cached
+                scanned.remove(page_index)
+
+    # ------- 2. Scanned pages → Tesseract, one page per worker -------
+    if len(scanned) > 1 and PDF_OCR_WORKERS > 1:
+        pool = _ocr_pool()
+        if isinstance(pdf_path, (str, os.PathLike)):
+            futures = {i: pool.submit(_timed_tesseract_page, pdf_path, i) for i in scanned}
+        else:
+            futures = {i: pool.submit(_timed_tesseract_page, _single_page_pdf(pdf, i), 0) for i in scanned}
+        timed = {i: f.result() for i, f in futures.items()}
+    else:
+        timed = {i: _timed_tesseract_loaded_page(pdf, i) for i in scanned}
+    ocr_results = {}
+    for i, (ocr_text, seconds) in timed.items():
+        record_page("tesseract", seconds)
+        ocr_results[i] = ocr_text
+
+    # ------- 3. If OCR fails → try Handwritten OCR (TrOCR) -------
+    complete = True
+    for page_index in scanned:
+        ocr_text = ocr_results[page_index]
+        page_complete = True
+        if ocr_text is None:
+            log(f"[INFO] Page {page_index} looks handwritten, using TrOCR...")
+            start = time.perf_counter()
+            gray = _render_gray(pdf.load_page(page_index))
+            ocr_text, page_complete = read_handwritten_page(gray)
+            record_page("trocr", time.perf_counter() - start)
+
+        text_output[page_index] = ocr_text
+        # a page cut short by the TrOCR budget must not be served again from the cache
+        complete = complete and page_complete
+        if cache is not None and page_complete:
+            cache.set_page(page_digests[page_index], ocr_text)
+
+    pdf.close()
+    text = "\n".join(text_output).strip()
+    if cache is not None and complete:
+        cache.set_document(doc_digest, text)
+    return text
+
 
 def extract_image_text(img):
     # preprocessing
@@ -0,0 +1,209 @@
+# qdrant_layout.py
+import os
+import sys
+import time
+import warnings
+from typing import Dict, List, Optional
+
+import numpy as np
+from qdrant_client.models import (
+    CollectionParamsDiff,
+    Disabled,
+    Distance,
+    FieldCondition,
+    Filter,
+    HnswConfigDiff,
+    MatchValue,
+    PayloadSchemaType,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    VectorParams,
+    VectorParamsDiff,
+)
+
+# -------------------------
+# CONFIG
+# How medical_kb is laid out. Applied when the collection is created, and
+# to an existing collection by `python -m utils.qdrant_layout migrate`.
+# (Qdrant's local mode accepts and ignores indexing/quantization settings;
+# they take effect on a Qdrant server, see QDRANT_URL.)
+# -------------------------
+QDRANT_HNSW_M = int(os.getenv("QDRANT_HNSW_M", 16))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", 100))
+QDRANT_HNSW_EF = int(os.getenv("QDRANT_HNSW_EF", 64))           # search-time ef
+QDRANT_INT8 = os.getenv("QDRANT_INT8", "0") == "1"              # scalar int8 quantization
+QDRANT_RESCORE = os.getenv("QDRANT_RESCORE", "1") == "1"        # re-rank int8 hits with full vectors
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", 2.0))
+QDRANT_VECTORS_ON_DISK = os.getenv("QDRANT_VECTORS_ON_DISK", "0") == "1"
+QDRANT_PAYLOAD_ON_DISK = os.getenv("QDRANT_PAYLOAD_ON_DISK", "1") == "1"
+
+# filtered on by retrieval and ingestion
+KEYWORD_FIELDS = ["category", "name"]
+
+# local mode warns on every call that carries these settings; they are
+# simply unused there
+warnings.filterwarnings("ignore", message="Payload indexes have no effect in the local Qdrant*")
+warnings.filterwarnings("ignore", message="Local mode performs exact*")
+
+
+def _quantization():
+    if not QDRANT_INT8:
+        return None
+    return ScalarQuantization(
+        scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+    )
+
+
+def create_collection(client, name: str, dim: int):
+    client.create_collection(
+        collection_name=name,
+        vectors_config=VectorParams(size=dim, distance=Distance.COSINE, on_disk=QDRANT_VECTORS_ON_DISK),
+        hnsw_config=HnswConfigDiff(m=QDRANT_HNSW_M, ef_construct=QDRANT_HNSW_EF_CONSTRUCT),
+        quantization_config=_quantization(),
+        # the large `text` field stays on disk; only indexed fields are in RAM
+        on_disk_payload=QDRANT_PAYLOAD_ON_DISK,
+    )
+    ensure_payload_indexes(client, name)
+
+
+def ensure_payload_indexes(client, name: str):
+    """Keyword indexes for the payload fields used in filters (no-op if present)."""
+    schema = client.get_collection(name).payload_schema or {}
+    for field in KEYWORD_FIELDS:
+        if field not in schema:
+            client.create_payload_index(
+                collection_name=name,
+                field_name=field,
+                field_schema=PayloadSchemaType.KEYWORD,
+                wait=True,
+            )
+
+
+def migrate_collection(client, name: str):
+    """
+    Bring an existing collection to the configured layout in place:
+    HNSW params, quantization, on-disk storage and payload indexes.
+    Qdrant rebuilds the affected segments in the background.
+    """
+    client.update_collection(
+        collection_name=name,
+        hnsw_config=HnswConfigDiff(m=QDRANT_HNSW_M, ef_construct=QDRANT_HNSW_EF_CONSTRUCT),
+        quantization_config=_quantization() or Disabled.DISABLED,
+        vectors_config={"": VectorParamsDiff(on_disk=QDRANT_VECTORS_ON_DISK)},
+        collection_params=CollectionParamsDiff(on_disk_payload=QDRANT_PAYLOAD_ON_DISK),
+    )
+    ensure_payload_indexes(client, name)
+
+
+def search_params(hnsw_ef: int = QDRANT_HNSW_EF, exact: bool = False) -> SearchParams:
+    quantization = None
+    if QDRANT_INT8:
+        quantization = QuantizationSearchParams(rescore=QDRANT_RESCORE, oversampling=QDRANT_OVERSAMPLING)
+    return SearchParams(hnsw_ef=hnsw_ef, exact=exact, quantization=quantization)
+
+
+def category_filter(category: Optional[str]) -> Optional[Filter]:
+    if not category:
+        return None
+    return Filter(must=[FieldCondition(key="category", match=MatchValue(value=category))])
+
+
+# -------------------------
+# Recall vs. latency report
+# -------------------------
+def _sample_queries(client, name: str, n: int, noise: float, seed: int = 0):
+    # stored vectors + a little noise: realistic neighbourhoods, but the
+    # query is not trivially its own nearest point
+    rng = np.random.default_rng(seed)
+    points, _ = client.scroll(collection_name=name, limit=n * 4, with_vectors=True, with_payload=["category"])
+    if not points:
+        return []
+    picked = [points[i] for i in rng.choice(len(points), size=min(n, len(points)), replace=False)]
+    queries = []
+    for p in picked:
+        v = np.asarray(p.vector, dtype=np.float32)
+        v = v + rng.normal(0, noise, v.shape).astype(np.float32)
+        v /= np.linalg.norm(v) or 1.0
+        queries.append((v.tolist(), (p.payload or {}).get("category")))
+    return queries
+
+
+def recall_latency_report(client, name: str, efs: List[int], n: int = 200, top_k: int = 3,
+                          noise: float = 0.05, filtered: bool = False) -> Dict:
+    """
+    recall@top_k and p50/p95 latency of approximate search for each ef,
+    against exact (brute-force) search over the same collection.
+    """
+    queries = _sample_queries(client, name, n, noise)
+    if not queries:
+        return {"queries": 0, "rows": []}
+
+    def run(params):
+        ids, times = [], []
+        for vec, cat in queries:
+            start = time.perf_counter()
+            resp = client.query_points(
+                collection_name=name,
+                query=vec,
+                limit=top_k,
+                with_payload=False,
+                query_filter=category_filter(cat) if filtered else None,
+                search_params=params,
+            )
+            times.append(time.perf_counter() - start)
+            ids.append({str(p.id) for p in resp.points})
+        return ids, np.asarray(times) * 1000
+
+    truth, exact_ms = run(search_params(exact=True))
+    rows = [{
+        "ef": "exact",
+        "recall": 1.0,
+        "p50_ms": round(float(np.percentile(exact_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(exact_ms, 95)), 3),
+    }]
+    for ef in efs:
+        got, ms = run(search_params(hnsw_ef=ef))
+        hits = sum(len(g & t) for g, t in zip(got, truth))
+        total = sum(len(t) for t in truth) or 1
+        rows.append({
+            "ef": ef,
+            "recall": round(hits / total, 4),
+            "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        })
+    return {"queries": len(queries), "top_k": top_k, "filtered": filtered, "int8": QDRANT_INT8, "rows": rows}
+
+
+def format_report(report: Dict) -> str:
+    lines = [
+        f"[ qdrant ] {report['queries']} queries, top_k={report.get('top_k')}, "
+        f"filtered={report.get('filtered')}, int8={report.get('int8')}",
+        f"{'ef':>8} {'recall':>8} {'p50 ms':>9} {'p95 ms':>9}",
+    ]
+    for r in report["rows"]:
+        lines.append(f"{r['ef']:>8} {r['recall']:>8.4f} {r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python -m utils.qdrant_layout migrate
+    # python -m utils.qdrant_layout report [N] [ef,ef,...]
+    from utils.embedding import COLLECTION_NAME
+    from utils.model_registry import registry
+
+    client = registry.get("qdrant")
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "report"
+    if cmd == "migrate":
+        migrate_collection(client, COLLECTION_NAME)
+        print(f"[ qdrant ] '{COLLECTION_NAME}' updated; segments are re-optimized in the background.")
+    elif cmd == "report":
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+        efs = [int(e) for e in sys.argv[3].split(",")] if len(sys.argv) > 3 else [16, 32, 64, 128, 256]
+        for filtered in (False, True):
+            print(format_report(recall_latency_report(client, COLLECTION_NAME, efs, n=n, filtered=filtered)))
+            print()
+    else:
+        sys.exit(f"Unknown command '{cmd}' (expected 'migrate' or 'report')")
@@ -0,0 +1,152 @@
+# uploads.py
+import os
+import tempfile
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from utils.logger import log
+
+# -------------------------
+# CONFIG
+# -------------------------
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 25 * 1024 * 1024))
+# whole multipart request body (all files of a /summary upload together);
+# checked while the body arrives, before the form is parsed and spooled
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", 4 * MAX_UPLOAD_BYTES))
+# uploads up to this size stay in memory; larger ones spill to a private temp file
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", 8 * 1024 * 1024))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES."""
+
+
+class SpooledUpload:
+    """
+    One uploaded PDF, owned by a single request.
+
+    `source` is what the extraction layer consumes: the raw bytes for small
+    uploads, or the path of a uniquely named temp file once the upload grew
+    past the spool threshold. close() removes the temp file, if any.
+    """
+
+    def __init__(self, filename: str = "", spool_bytes: int = UPLOAD_SPOOL_BYTES):
+        self.filename = filename or "upload.pdf"
+        self.size = 0
+        self._spool_bytes = spool_bytes
+        self._buf = bytearray()
+        self._tmp = None
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self._tmp is None and self.size > self._spool_bytes:
+            self._tmp = tempfile.NamedTemporaryFile(prefix="curasense_", suffix=".pdf", delete=False)
+            self._tmp.write(self._buf)
+            self._buf = bytearray()
+        if self._tmp is not None:
+            self._tmp.write(chunk)
+        else:
+            self._buf.extend(chunk)
+
+    async def write_async(self, chunk: bytes):
+        """write(), with the temp-file work (spill and later writes) off the event loop."""
+        if self._tmp is None and self.size + len(chunk) <= self._spool_bytes:
+            self.write(chunk)
+        else:
+            await run_in_threadpool(self.write, chunk)
+
+    def finish(self):
+        if self._tmp is not None:
+            self._tmp.close()
+
+    @property
+    def source(self):
+        return self._tmp.name if self._tmp is not None else bytes(self._buf)
+
+    def close(self):
+        if self._tmp is not None:
+            self._tmp.close()
+            if os.path.exists(self._tmp.name):
+                os.remove(self._tmp.name)
+            self._tmp = None
+        self._buf = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def read_upload(file, max_bytes: int = MAX_UPLOAD_BYTES) -> SpooledUpload:
+    """Read a FastAPI UploadFile in chunks, enforcing max_bytes."""
+    upload = SpooledUpload(file.filename)
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            if upload.size + len(chunk) > max_bytes:
+                raise UploadTooLargeError(
+                    f"'{upload.filename}' is larger than the {max_bytes / (1024 * 1024):.1f} MB upload limit."
+                )
+            await upload.write_async(chunk)
+        if upload._tmp is not None:
+            await run_in_threadpool(upload.finish)
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+
+def _too_large(max_bytes: int) -> str:
+    return f"The request is larger than the {max_bytes / (1024 * 1024):.1f} MB upload limit."
+
+
+class RequestSizeLimit:
+    """
+    ASGI middleware bounding multipart request bodies to max_bytes.
+
+    A Content-Length over the limit is answered with 413 before any of the
+    body is read; otherwise the body is counted as it streams in (chunked
+    uploads have no Content-Length) and parsing stops with a 413 as soon as
+    it passes the limit, instead of after Starlette has spooled all of it.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or [])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/"):
+            return await self.app(scope, receive, send)
+
+        try:
+            declared = int(headers.get(b"content-length", b"-1"))
+        except ValueError:
+            declared = -1
+        if declared > self.max_bytes:
+            log(f"🔴 [UPLOAD] Rejected {scope['path']}: Content-Length {declared}")
+            response = JSONResponse(status_code=413, content={"detail": _too_large(self.max_bytes)})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    log(f"🔴 [UPLOAD] Rejected {scope['path']}: body passed {self.max_bytes} bytes")
+                    # re-raised as is by FastAPI's body parsing, answered by its HTTPException handler
+                    raise HTTPException(status_code=413, detail=_too_large(self.max_bytes))
+            return message
+
+        await self.app(scope, limited_receive, send)